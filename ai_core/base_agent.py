@@ -1,21 +1,52 @@
-# 版本: v1.2
+# 版本: v2.4
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-28
-# 总结: 升级 AgentFactory，支持通过配置文件中的 role_mapping 自动分配模型。
+# 日期: 2026-10-18
+# 总结: 只有缓存、限流、兜底/对冲、逐轮选择、流式、录制或用量追踪需要时才挂载 CyberModelClient，否则使用 AutoGen 自带客户端。
 
 import os
-import autogen
 from .utils import load_secrets_config, get_model_config
+from .llm_cache import open_response_cache
+from .rate_limiter import get_rate_limiter
+from .model_router import RoutingPolicy, resolve_fallbacks
+from .model_selector import create_model_selector
+from .session_archive import get_session_archive
+from .tracing import traced
+
+# llm_config 中的 model_client_cls 只需类名，不必为此导入 model_client (openai)
+MODEL_CLIENT_CLS = "CyberModelClient"
 
 class AgentFactory:
-    def __init__(self):
+    def __init__(self, tracker=None, stream_sink=None):
+        """
+        :param tracker: 可选 TokenTracker，模型调用的用量实时记入其中
+        :param stream_sink: 可选 StreamSink，设置后 Assistant 以流式调用模型
+        """
         self.secrets_config = load_secrets_config()
+        self.tracker = tracker
+        self.stream_sink = stream_sink
         if not self.secrets_config and not os.environ.get("DASHSCOPE_API_KEY"):
             print("⚠️ Warning: No configuration found in secrets/config.json or environment!")
 
-    def _get_llm_config(self, model_alias=None):
-        """构造 Autogen 的 llm_config"""
+    def _resolve_alias(self, model_alias=None):
+        """别名为空时返回 default_model"""
+        if model_alias:
+            return model_alias
+        return (self.secrets_config or {}).get("default_model")
+
+    def _get_response_cache(self, model_alias):
+        """模型配置中 "cache": true 且 llm_cache 未被禁用时返回共享的 ResponseCache"""
+        model_cfg = get_model_config(self.secrets_config, model_alias) or {}
+        cache_cfg = (self.secrets_config or {}).get("llm_cache", {})
+        if not model_cfg.get("cache") or not cache_cfg.get("enabled", True):
+            return None
+        return open_response_cache(cache_cfg)
+
+    def _get_llm_config(self, model_alias=None, use_client=False):
+        """
+        构造 Autogen 的 llm_config
+        :param use_client: 是否通过 CyberModelClient 调用 (需在 Agent 创建后 register_model_client)
+        """
         model_cfg = get_model_config(self.secrets_config, model_alias)
         
         if not model_cfg:
@@ -30,17 +61,26 @@ class AgentFactory:
             "base_url": model_cfg.get("base_url"),
         }]
         
-        return {
+        timeout = model_cfg.get("timeout", 120)
+        llm_config = {
             "config_list": config_list,
             "temperature": model_cfg.get("temperature", 0.3),
-            "timeout": 120,
+            "timeout": timeout,
         }
+        if use_client:
+            config_list[0]["model_client_cls"] = MODEL_CLIENT_CLS
+            config_list[0]["timeout"] = timeout
+            # 缓存由 CyberModelClient 的 ResponseCache 统一负责，关闭 AutoGen 自带的磁盘缓存
+            llm_config["cache_seed"] = None
+        return llm_config
 
-    def create_assistant(self, name, system_message, model_alias=None):
+    @traced("factory.create_assistant", "setup")
+    def create_assistant(self, name, system_message, model_alias=None, tools=None):
         """
         创建 AssistantAgent
         :param name: Agent 名称，用于查找 role_mapping
         :param model_alias: 显式指定模型别名 (优先级最高)
+        :param tools: {工具名: (函数, 描述)}，向模型声明的工具 (由 UserProxy 执行)
         """
         # 1. 优先级: 显式参数 > 角色映射 > 默认模型
         selected_alias = model_alias
@@ -52,19 +92,88 @@ class AgentFactory:
             
         # 2. 如果仍未指定，get_model_config 会自动使用 default_model
         
-        llm_config = self._get_llm_config(selected_alias)
+        selected_alias = self._resolve_alias(selected_alias)
+        llm_config = self._get_llm_config(selected_alias, use_client=True)
+        client_kwargs = self._client_kwargs(selected_alias, llm_config["config_list"][0], name)
+        if not self._needs_model_client(client_kwargs):
+            llm_config = self._get_llm_config(selected_alias)
+        
+        import autogen
+        from .model_client import CyberModelClient
         
         # 打印调试信息，确认模型选择
         actual_model = llm_config["config_list"][0].get("model")
         print(f"🤖 Agent '{name}' initialized with model: {actual_model}")
 
-        return autogen.AssistantAgent(
+        agent = autogen.AssistantAgent(
             name=name,
             system_message=system_message,
             llm_config=llm_config
         )
+        # register_for_llm 会重建 OpenAIWrapper，必须在 register_model_client 之前
+        for tool_name, (func, description) in (tools or {}).items():
+            agent.register_for_llm(name=tool_name, description=description)(func)
+        client_cfg = llm_config["config_list"][0]
+        if "model_client_cls" in client_cfg:
+            agent.register_model_client(model_client_cls=CyberModelClient, stream=self.stream_sink, **client_kwargs)
+        return agent
+
+    def _needs_model_client(self, client_kwargs):
+        """
+        是否需要 CyberModelClient：用量追踪 (含预算预检)、流式输出、响应缓存、限流、会话录制/回放、
+        兜底链、对冲或逐轮模型选择任一启用时需要；全部关闭时交给 AutoGen 自带的 OpenAI 客户端
+        """
+        if self.tracker is not None or self.stream_sink is not None:
+            return True
+        if any(client_kwargs[key] is not None for key in ("cache", "limiter", "archive", "selector")):
+            return True
+        return bool(client_kwargs["fallbacks"]) or client_kwargs["routing"].hedge_enabled
+
+    def _client_kwargs(self, alias, client_cfg, agent_name=None):
+        """CyberModelClient 的附加参数：响应缓存、用量追踪、限流、会话录制/回放、兜底链、逐轮模型选择"""
+        selector = create_model_selector(self.secrets_config, alias, agent_name)
+        variants = {}
+        for variant_alias in selector.candidates() if selector is not None else ():
+            variants[variant_alias] = dict(
+                self._route_config(variant_alias),
+                fallbacks=[self._route_config(a) for a in resolve_fallbacks(self.secrets_config, variant_alias)],
+            )
+        return {
+            "alias": alias,
+            "agent_name": agent_name,
+            "cache": self._get_response_cache(alias),
+            "tracker": self.tracker,
+            "limiter": get_rate_limiter(self.secrets_config, alias, client_cfg.get("base_url")),
+            "archive": get_session_archive(),
+            "fallbacks": [self._route_config(a) for a in resolve_fallbacks(self.secrets_config, alias, agent_name)],
+            "routing": RoutingPolicy((self.secrets_config or {}).get("routing")),
+            "selector": selector,
+            "variants": variants,
+        }
+
+    def _route_config(self, alias):
+        """兜底链/候选模型中一个端点的配置: {"alias", "config", "limiter"}"""
+        client_cfg = self._get_llm_config(alias, use_client=True)["config_list"][0]
+        return {
+            "alias": alias,
+            "config": client_cfg,
+            "limiter": get_rate_limiter(self.secrets_config, alias, client_cfg.get("base_url")),
+        }
+
+    @traced("factory.create_model_client", "setup")
+    def create_model_client(self, model_alias=None, name=None):
+        """
+        直接创建 CyberModelClient (不经过 Agent)，用于摘要等框架内部调用
+        用量同样记入 tracker，并共享缓存与限流
+        :param name: 遥测中显示的调用方名称
+        """
+        from .model_client import CyberModelClient
+        alias = self._resolve_alias(model_alias)
+        client_cfg = self._get_llm_config(alias, use_client=True)["config_list"][0]
+        return CyberModelClient(client_cfg, **self._client_kwargs(alias, client_cfg, name))
 
     def create_user_proxy(self, name="UserProxy", human_input_mode="NEVER", max_replies=30):
+        import autogen
         return autogen.UserProxyAgent(
             name=name,
             human_input_mode=human_input_mode,
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 增加 run_batch_async，在单进程的事件循环中并发运行多个会话。
+
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from .model_client import install_process_limits
+from .rate_limiter import set_rate_share
+
+# 目录模式下识别为任务文件的扩展名
+TASK_EXTENSIONS = (".md", ".txt")
+
+class SharedBudget:
+    """
+    跨进程共享的成本计数 (Manager 代理，可随任务传给子进程)
+    子进程的 CyberModelClient 每次调用后实时累加
+    """
+
+    def __init__(self, manager, limit=None):
+        """
+        :param manager: multiprocessing.Manager 实例
+        :param limit: 全局成本上限 (元)，None 表示不限制
+        """
+        self.limit = limit
+        self._spent = manager.Value('d', 0.0)
+        self._lock = manager.Lock()
+
+    def add(self, cost):
+        if not cost:
+            return
+        with self._lock:
+            self._spent.value += cost
+
+    def spent(self):
+        return self._spent.value
+
+    def remaining(self):
+        if self.limit is None:
+            return None
+        return max(0.0, self.limit - self.spent())
+
+    def exceeded(self):
+        return self.limit is not None and self.spent() >= self.limit
+
+class LocalBudget:
+    """单进程内 (异步批量模式) 共享的成本计数，接口与 SharedBudget 一致"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._spent = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, cost):
+        if not cost:
+            return
+        with self._lock:
+            self._spent += cost
+
+    def spent(self):
+        return self._spent
+
+    def remaining(self):
+        if self.limit is None:
+            return None
+        return max(0.0, self.limit - self.spent())
+
+    def exceeded(self):
+        return self.limit is not None and self.spent() >= self.limit
+
+def discover_tasks(spec):
+    """
+    解析 --batch 参数：目录 (取其中的 .md/.txt 文件) 或 glob 模式
+    :return: 排序后的任务文件路径列表
+    """
+    spec = spec.replace("\\", "/")
+    if os.path.isdir(spec):
+        paths = [
+            os.path.join(spec, name) for name in os.listdir(spec)
+            if name.lower().endswith(TASK_EXTENSIONS)
+        ]
+    else:
+        paths = glob.glob(spec, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p))
+
+def _unique_project_names(task_paths):
+    """按文件名生成项目名，重名时追加序号"""
+    names = []
+    seen = {}
+    for path in task_paths:
+        base = os.path.splitext(os.path.basename(path))[0]
+        count = seen.get(base, 0)
+        seen[base] = count + 1
+        names.append(base if count == 0 else f"{base}_{count + 1}")
+    return names
+
+def _init_worker(model_semaphores, shared_budget, rate_share):
+    install_process_limits(model_semaphores, shared_budget)
+    # 限流器为进程内共享，各子进程平分配置的速率
+    set_rate_share(rate_share)
+
+def _batch_worker(task_fn, args, task_path, project_name, console_path, shared_budget):
+    """子进程入口：控制台输出重定向到项目目录，异常不外抛"""
+    os.makedirs(os.path.dirname(console_path), exist_ok=True)
+    start = time.time()
+    stdout, stderr = sys.stdout, sys.stderr
+    console = open(console_path, "w", encoding="utf-8")
+    sys.stdout = sys.stderr = console
+    try:
+        result = task_fn(args, task_path, project_name, budget_limit=shared_budget.remaining())
+    except BaseException as e:
+        result = {"status": "failed", "error": repr(e)}
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        console.close()
+
+    result = dict(result or {})
+    result.setdefault("project", project_name)
+    result.setdefault("status", "ok")
+    result["task"] = task_path
+    result["duration_seconds"] = round(time.time() - start, 2)
+    result["console_log"] = console_path
+    return result
+
+def run_batch(task_fn, args, task_paths, output_base, workers=4, budget_limit=None, model_concurrency=None):
+    """
+    并行运行一批任务
+    :param task_fn: 单任务函数 task_fn(args, task_path, project_name, budget_limit=...) -> dict
+    :param args: 传给 task_fn 的参数 (需可 pickle)
+    :param task_paths: 任务文件列表
+    :param output_base: 输出根目录 (output/)
+    :param workers: 并行进程数
+    :param budget_limit: 全局成本上限 (元)
+    :param model_concurrency: {模型别名: 最大同时在途调用数}
+    :return: 每个任务的结果列表
+    """
+    names = _unique_project_names(task_paths)
+    pending = [(task_path, name, 0) for task_path, name in zip(task_paths, names)]
+    results = []
+    workers = max(1, workers)
+
+    with multiprocessing.Manager() as manager:
+        semaphores = {alias: manager.Semaphore(int(n)) for alias, n in (model_concurrency or {}).items()}
+        shared_budget = SharedBudget(manager, budget_limit)
+
+        def new_pool():
+            return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(semaphores, shared_budget, 1.0 / workers))
+
+        pool = new_pool()
+        in_flight = {}
+        solo = False  # 正在单独重试受进程池崩溃波及的任务
+        try:
+            while pending or in_flight:
+                # 保持最多 workers 个任务在途，预算耗尽后不再启动新任务
+                while pending and len(in_flight) < workers and not solo:
+                    if shared_budget.exceeded():
+                        for task_path, name, _ in pending:
+                            results.append({"project": name, "task": task_path, "status": "skipped",
+                                            "error": "global budget exhausted"})
+                        pending = []
+                        break
+                    task_path, name, attempt = pending[0]
+                    if attempt and in_flight:
+                        break  # 重试任务等在途任务结束后单独运行，避免再次被波及
+                    pending.pop(0)
+                    solo = attempt > 0
+                    console_path = os.path.join(output_base, name, "console.log")
+                    print(f"▶️  [{name}] started ({len(results) + len(in_flight) + 1}/{len(task_paths)})")
+                    future = pool.submit(_batch_worker, task_fn, args, task_path, name, console_path, shared_budget)
+                    in_flight[future] = (task_path, name, attempt)
+
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                broken = []
+                pool_broken = False
+                for future in done:
+                    task_path, name, attempt = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        pool_broken = True
+                        if attempt == 0:
+                            broken.append((task_path, name, attempt + 1))
+                            continue
+                        result = {"project": name, "task": task_path, "status": "failed", "error": f"worker crashed: {e}"}
+                    except Exception as e:
+                        result = {"project": name, "task": task_path, "status": "failed", "error": repr(e)}
+                    results.append(result)
+                    icon = "✅" if result.get("status") == "ok" else "❌"
+                    print(f"{icon} [{name}] {result.get('status')} ¥{result.get('cost_cny', 0.0):.4f}")
+                if not in_flight:
+                    solo = False
+
+                # 子进程崩溃会使整个进程池失效：重建进程池，受波及的任务各自单独重试一次
+                if pool_broken:
+                    for future, (task_path, name, attempt) in in_flight.items():
+                        broken.append((task_path, name, attempt + 1))
+                    in_flight = {}
+                    solo = False
+                    for task_path, name, attempt in broken:
+                        print(f"⚠️  [{name}] worker pool crashed, retrying alone")
+                    pending = broken + pending
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = new_pool()
+        finally:
+            pool.shutdown(wait=True)
+
+        spent = shared_budget.spent()
+
+    print_batch_summary(results, spent, budget_limit)
+    save_batch_summary(results, spent, budget_limit, output_base)
+    return results
+
+async def run_batch_async(task_coro_fn, args, task_paths, output_base, workers=16, budget_limit=None, model_concurrency=None):
+    """
+    在单个事件循环中并发运行一批任务 (不启动子进程)
+    :param task_coro_fn: 协程函数 task_coro_fn(args, task_path, project_name, budget_limit=...) -> dict
+    :param workers: 同时运行的会话数
+    其余参数同 run_batch；控制台输出不做重定向
+    """
+    names = _unique_project_names(task_paths)
+    workers = max(1, workers)
+    semaphores = {alias: threading.BoundedSemaphore(int(n)) for alias, n in (model_concurrency or {}).items()}
+    budget = LocalBudget(budget_limit)
+    install_process_limits(semaphores, budget)
+
+    # AutoGen 在默认线程池中执行模型调用，每个在途会话至少需要一个线程
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=workers + 4))
+    gate = asyncio.Semaphore(workers)
+
+    async def run_one(task_path, name):
+        async with gate:
+            if budget.exceeded():
+                return {"project": name, "task": task_path, "status": "skipped", "error": "global budget exhausted"}
+            print(f"▶️  [{name}] started")
+            start = time.time()
+            try:
+                result = dict(await task_coro_fn(args, task_path, name, budget_limit=budget.remaining()) or {})
+            except Exception as e:
+                result = {"status": "failed", "error": repr(e)}
+            result.setdefault("project", name)
+            result.setdefault("status", "ok")
+            result["task"] = task_path
+            result["duration_seconds"] = round(time.time() - start, 2)
+            icon = "✅" if result["status"] == "ok" else "❌"
+            print(f"{icon} [{name}] {result['status']} ¥{result.get('cost_cny', 0.0):.4f}")
+            return result
+
+    try:
+        results = await asyncio.gather(*(run_one(path, name) for path, name in zip(task_paths, names)))
+    finally:
+        install_process_limits()
+
+    print_batch_summary(results, budget.spent(), budget_limit)
+    save_batch_summary(results, budget.spent(), budget_limit, output_base)
+    return results
+
+def print_batch_summary(results, spent, budget_limit=None):
+    """打印汇总表"""
+    width = max([len("Project")] + [len(r.get("project", "")) for r in results]) + 2
+    print("\n" + "=" * (width + 52))
+    print(f"📦 Batch Summary - {len(results)} projects")
+    print("=" * (width + 52))
+    print(f"{'Project':<{width}}{'Status':<10}{'Rounds':>8}{'Cost(¥)':>12}{'Time(s)':>10}  Error")
+    for r in results:
+        print(
+            f"{r.get('project', ''):<{width}}{r.get('status', ''):<10}"
+            f"{r.get('rounds', 0):>8}{r.get('cost_cny', 0.0):>12.4f}"
+            f"{r.get('duration_seconds', 0.0):>10.1f}  {r.get('error') or ''}"
+        )
+    counts = {}
+    for r in results:
+        counts[r.get("status")] = counts.get(r.get("status"), 0) + 1
+    print("-" * (width + 52))
+    print(f"Status: {counts}")
+    print(f"💰 Total cost: ¥{spent:.4f}" + (f" / budget ¥{budget_limit:.4f}" if budget_limit is not None else ""))
+    print("=" * (width + 52) + "\n")
+
+def save_batch_summary(results, spent, budget_limit, output_base):
+    """保存汇总 JSON 到 output/"""
+    os.makedirs(output_base, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(output_base, f"batch_summary_{timestamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "total_cost_cny": round(spent, 4),
+            "budget_limit_cny": budget_limit,
+            "projects": results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"📊 Batch summary saved: {path}")
+    return path
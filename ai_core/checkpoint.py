@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 消息改为追加写入 checkpoint.messages.jsonl (每轮只写新增消息)，检查点 JSON 只记条数；--resume 回退工作区前列出将被丢弃的提交与改动。
+
+import json
+import os
+import subprocess
+import time
+
+from .tracing import span
+
+CHECKPOINT_VERSION = 2
+CHECKPOINT_FILE = "checkpoint.json"
+MESSAGES_FILE = "checkpoint.messages.jsonl"
+# 回退工作区前最多列出的提交/文件数
+DISCARD_PREVIEW_LINES = 20
+
+def checkpoint_path(work_dir):
+    """检查点与 workspace 同级: output/<项目>/checkpoint.json"""
+    return os.path.join(os.path.dirname(os.path.abspath(work_dir)), CHECKPOINT_FILE)
+
+def messages_path(work_dir):
+    """群聊消息 (每行一条): output/<项目>/checkpoint.messages.jsonl"""
+    return os.path.join(os.path.dirname(os.path.abspath(work_dir)), MESSAGES_FILE)
+
+def _read_messages(path, count):
+    """读取前 count 条消息 (之后的行属于尚未完成的一轮，忽略)，条数不足时返回 None"""
+    messages = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if len(messages) >= count:
+                    break
+                messages.append(json.loads(line))
+    except (OSError, json.JSONDecodeError):
+        return None
+    return messages if len(messages) == count else None
+
+def load_checkpoint(work_dir):
+    """读取检查点，不存在或损坏时返回 None"""
+    path = checkpoint_path(work_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ Failed to read checkpoint {path}: {e}")
+        return None
+    if state.get("version") == 1:
+        return state  # 旧格式：消息内嵌在检查点中
+    if state.get("version") != CHECKPOINT_VERSION:
+        print(f"⚠️ Unsupported checkpoint version in {path}")
+        return None
+    messages = _read_messages(messages_path(work_dir), state.get("message_count", 0))
+    if messages is None:
+        print(f"⚠️ Checkpoint messages are missing or incomplete: {messages_path(work_dir)}")
+        return None
+    state["messages"] = messages
+    return state
+
+def git_head(work_dir):
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=work_dir, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def _git_lines(work_dir, *args):
+    result = subprocess.run(["git", *args], cwd=work_dir, capture_output=True, text=True)
+    return result.stdout.splitlines() if result.returncode == 0 else []
+
+def _print_discarded(work_dir, head):
+    """列出 git reset --hard 将丢弃的提交与已跟踪文件的改动 (未跟踪的文件保留)"""
+    commits = _git_lines(work_dir, "log", "--oneline", f"{head}..HEAD")
+    files = _git_lines(work_dir, "diff", "--name-status", head)
+    print(f"⚠️ Resuming resets the workspace to checkpoint commit {head[:10]}; "
+          f"discarding {len(commits)} later commit(s) and changes to {len(files)} tracked file(s):")
+    for title, lines in (("commits", commits), ("files", files)):
+        for line in lines[:DISCARD_PREVIEW_LINES]:
+            print(f"   - {line}")
+        if len(lines) > DISCARD_PREVIEW_LINES:
+            print(f"   ... {len(lines) - DISCARD_PREVIEW_LINES} more {title}")
+
+def restore_workspace(work_dir, head):
+    """
+    把工作区恢复到检查点时的提交 (丢弃检查点之后的轮次写入的文件)，恢复前打印将被丢弃的内容
+    :return: 是否执行了恢复
+    """
+    current = git_head(work_dir)
+    if not head or current == head:
+        return False
+    _print_discarded(work_dir, head)
+    result = subprocess.run(["git", "reset", "-q", "--hard", head], cwd=work_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"⚠️ Failed to restore workspace to {head[:10]}: {result.stderr.strip()}")
+        return False
+    return True
+
+class SessionCheckpoint:
+    """
+    逐轮检查点写入器
+    - save_round 通过副作用流水线在本轮代码提取与 Git 提交之后执行，记录的 HEAD 与消息一致
+    - 消息追加写入 MESSAGES_FILE，每轮只序列化新增消息；检查点 JSON 只记 message_count
+    - 消息文件 fsync 之后才替换检查点 JSON (先写临时文件、fsync 后 os.replace)，
+      进程在任何时刻被杀，检查点记录的条数都已完整落盘
+    """
+
+    def __init__(self, work_dir, company_config_path, task_content):
+        self.work_dir = work_dir
+        self.path = checkpoint_path(work_dir)
+        self.meta = {
+            "company": os.path.abspath(company_config_path),
+            "task": task_content,
+            "work_dir": os.path.abspath(work_dir),
+        }
+        self.messages_path = messages_path(work_dir)
+        self.saves = 0
+        self._last = None
+        self._written = 0  # 本进程已写入消息文件的条数 (0 表示下次整体重写)
+        self._offset = 0  # 消息文件中已确认内容的字节数
+
+    def save_round(self, round_num, messages, last_speaker, tracker_state, compactor_state=None):
+        """
+        :param messages: 本轮结束时 groupchat.messages 的快照
+        :param tracker_state: TokenTracker.export_state()
+        :param compactor_state: ContextCompactor.export_state() (未启用压缩时为 None)
+        """
+        with span("checkpoint.save", "io", round=round_num):
+            try:
+                self._append_messages(messages)
+            except OSError as e:
+                self._written = 0
+                print(f"⚠️ Failed to write checkpoint messages: {e}")
+                return
+            state = dict(
+                self.meta,
+                version=CHECKPOINT_VERSION,
+                status="running",
+                round=round_num,
+                message_count=len(messages),
+                last_speaker=last_speaker,
+                tracker=tracker_state,
+                compactor=compactor_state,
+                git_head=git_head(self.work_dir),
+                updated=round(time.time(), 3),
+            )
+            self._write(state)
+            self._last = state
+            self.saves += 1
+
+    def mark(self, status, stop_reason=None):
+        """会话结束时更新状态 (finished / interrupted)，已完成的会话不会被 --resume 重复执行"""
+        if self._last is None:
+            return
+        self._last = dict(self._last, status=status, stop_reason=stop_reason, updated=round(time.time(), 3))
+        self._write(self._last)
+
+    def _append_messages(self, messages):
+        """追加本轮新增的消息；本进程首次写入 (含续跑) 或消息列表变短时整体重写"""
+        if self._written == 0 or len(messages) < self._written:
+            mode, new = "wb", messages
+        else:
+            # 丢弃上一次写入失败可能留下的残行
+            os.truncate(self.messages_path, self._offset)
+            mode, new = "ab", messages[self._written:]
+        with open(self.messages_path, mode) as f:
+            for message in new:
+                f.write(json.dumps(message, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self._offset = f.tell()
+        self._written = len(messages)
+
+    def _write(self, state):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Failed to write checkpoint: {e}")
+
+def create_checkpoint(secrets_config, work_dir, company_config_path, task_content):
+    """secrets/config.json 的 checkpoint 段，默认启用"""
+    cfg = (secrets_config or {}).get("checkpoint", {})
+    if not cfg.get("enabled", True) or task_content is None:
+        return None
+    return SessionCheckpoint(work_dir, company_config_path, task_content)
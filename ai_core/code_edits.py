@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 文件代码块中的增量编辑 (统一 diff / SEARCH-REPLACE)：整块全部匹配才生成新内容，失败时给出可反馈给 Agent 的原因。
+
+import re
+
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+HUNK_LOOSE_RE = re.compile(r'^@@.*@@')
+SEARCH_RE = re.compile(r'^<{5,9} SEARCH\s*$')
+DIVIDER_RE = re.compile(r'^={5,9}\s*$')
+REPLACE_RE = re.compile(r'^>{5,9} REPLACE\s*$')
+# 这些路径的代码块本身就是补丁文件，按整文件保存
+PATCH_SUFFIXES = (".diff", ".patch")
+
+class EditError(ValueError):
+    """编辑块无法应用，消息原文会反馈给发出编辑的 Agent"""
+
+def _split(text):
+    """文本 -> (行列表, 是否以换行结尾)"""
+    if not text:
+        return [], False
+    trailing = text.endswith("\n")
+    lines = text.split("\n")
+    if trailing:
+        lines.pop()
+    return lines, trailing
+
+def _join(lines, trailing):
+    return "\n".join(lines) + ("\n" if trailing and lines else "")
+
+def _find(lines, target, hint=0):
+    """
+    target 连续出现在 lines 中的位置
+    依次尝试精确匹配、忽略行尾空白、忽略首尾空白，取第一种有结果的方式
+    :return: (离 hint 最近的位置, 该方式下的全部位置)，找不到时为 (-1, [])
+    """
+    n = len(target)
+    for normalize in (None, str.rstrip, str.strip):
+        wanted = [normalize(t) for t in target] if normalize else target
+        first = wanted[0]
+        matches = []
+        for i in range(len(lines) - n + 1):
+            line = normalize(lines[i]) if normalize else lines[i]
+            if line != first:
+                continue
+            window = lines[i:i + n]
+            if (([normalize(x) for x in window] if normalize else window) == wanted):
+                matches.append(i)
+        if matches:
+            return min(matches, key=lambda i: abs(i - hint)), matches
+    return -1, []
+
+class Hunk:
+    def __init__(self, old_start, header):
+        self.old_start = old_start  # 从 1 开始；头部没有行号时为 None
+        self.header = header
+        self.old = []
+        self.new = []
+
+class UnifiedDiffEdit:
+    """
+    统一 diff (单个文件)
+    - 先在头部行号 (加上前面各块造成的偏移) 附近查找上下文，找不到再全文件查找，行号写错也能应用
+    - `--- /dev/null` 表示新建文件
+    """
+
+    kind = "diff"
+
+    def __init__(self, hunks, new_file=False):
+        self.hunks = hunks
+        self.new_file = new_file
+
+    def apply(self, text):
+        """
+        :param text: 文件当前内容，文件不存在时为 None
+        :return: 应用全部 hunk 后的内容 (任意一个失败则抛出 EditError，不产生部分结果)
+        """
+        if text is None and not self.new_file:
+            raise EditError("file does not exist; send the full file content instead of a diff")
+        lines, trailing = _split(text or "")
+        if text is None:
+            trailing = True
+        offset = 0
+        for i, hunk in enumerate(self.hunks, 1):
+            hint = hunk.old_start - 1 + offset if hunk.old_start is not None else 0
+            if not hunk.old:
+                # 纯插入：插在 old_start 行之后 (没有行号时追加到末尾)
+                pos = len(lines) if hunk.old_start is None else min(len(lines), max(0, hint + 1))
+            else:
+                pos, _ = _find(lines, hunk.old, hint)
+                if pos < 0:
+                    raise EditError(
+                        f"hunk {i} ({hunk.header}) does not apply: its {len(hunk.old)} context/removed lines "
+                        f"were not found (first expected line: {hunk.old[0]!r}). "
+                        "Re-read the file and resend the edit against its current content."
+                    )
+            lines[pos:pos + len(hunk.old)] = hunk.new
+            offset += len(hunk.new) - len(hunk.old)
+        return _join(lines, trailing)
+
+class SearchReplaceEdit:
+    """
+    SEARCH/REPLACE 块 (可有多组，按顺序应用)
+    - SEARCH 必须在文件中唯一匹配；空 SEARCH 表示追加到末尾 (文件不存在时新建)
+    """
+
+    kind = "search_replace"
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def apply(self, text):
+        if text is None and any(search for search, _ in self.pairs):
+            raise EditError("file does not exist; SEARCH blocks need existing content (send the full file instead)")
+        lines, trailing = _split(text or "")
+        if text is None:
+            trailing = True
+        for i, (search, replace) in enumerate(self.pairs, 1):
+            if not search:
+                lines.extend(replace)
+                continue
+            pos, matches = _find(lines, search)
+            if pos < 0:
+                raise EditError(
+                    f"SEARCH block {i} was not found (first line: {search[0]!r}); "
+                    "SEARCH text must match the current file, use read_file to check it"
+                )
+            if len(matches) > 1:
+                where = ", ".join(str(m + 1) for m in matches[:5])
+                raise EditError(
+                    f"SEARCH block {i} matches {len(matches)} places (lines {where}); include more context lines"
+                )
+            lines[pos:pos + len(search)] = replace
+        return _join(lines, trailing)
+
+def _parse_unified_diff(lines):
+    hunks, current, headers, new_file = [], None, 0, False
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            headers += 1
+            if headers > 1:
+                raise EditError("a diff block may change only one file (the one named in its #### header)")
+            if lines[i + 1][4:].split("\t")[0].strip() == "/dev/null":
+                raise EditError("deleting files through a diff is not supported")
+            new_file = line[4:].split("\t")[0].strip() == "/dev/null"
+            i += 2
+            continue
+        if HUNK_LOOSE_RE.match(line):
+            match = HUNK_RE.match(line)
+            current = Hunk(int(match.group(1)) if match else None, line.strip())
+            hunks.append(current)
+        elif current is None:
+            pass  # diff --git / index 等元信息
+        elif line.startswith("\\"):
+            pass  # \ No newline at end of file
+        elif line.startswith("-"):
+            current.old.append(line[1:])
+        elif line.startswith("+"):
+            current.new.append(line[1:])
+        elif line.startswith(" ") or line == "":
+            # 部分模型会去掉空白上下文行的前导空格
+            current.old.append(line[1:])
+            current.new.append(line[1:])
+        else:
+            raise EditError(f"line {i + 1} of the diff is not a valid hunk line: {line!r}")
+        i += 1
+    hunks = [h for h in hunks if h.old or h.new]
+    if not hunks:
+        raise EditError("the diff contains no hunks")
+    return UnifiedDiffEdit(hunks, new_file=new_file)
+
+def _parse_search_replace(lines):
+    pairs, state, search, replace = [], "text", [], []
+    for line in lines:
+        if state == "text":
+            if SEARCH_RE.match(line.strip()):
+                state, search, replace = "search", [], []
+        elif state == "search":
+            if DIVIDER_RE.match(line.strip()):
+                state = "replace"
+            else:
+                search.append(line)
+        elif REPLACE_RE.match(line.strip()):
+            pairs.append((search, replace))
+            state = "text"
+        else:
+            replace.append(line)
+    if state != "text":
+        raise EditError("unterminated SEARCH/REPLACE block (expected ======= and >>>>>>> REPLACE)")
+    return SearchReplaceEdit(pairs)
+
+def parse_edit_block(path, code):
+    """
+    判断文件代码块是否为增量编辑
+    :return: UnifiedDiffEdit / SearchReplaceEdit；普通的整文件内容返回 None
+    :raises EditError: 是编辑块但格式有误
+    """
+    if path.lower().endswith(PATCH_SUFFIXES):
+        return None
+    lines = code.rstrip("\n").split("\n")
+    if any(SEARCH_RE.match(line.strip()) for line in lines):
+        return _parse_search_replace(lines)
+    first = next((line for line in lines if line.strip()), "")
+    if first.startswith(("--- ", "@@", "diff --git")) and any(HUNK_LOOSE_RE.match(line) for line in lines):
+        return _parse_unified_diff(lines)
+    return None
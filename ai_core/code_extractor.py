@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 增加 rewrite_code_blocks，按相同规则定位文件代码块并替换。
+
+import re
+
+# 文件路径标题: #### path/to/file (可带反引号)
+HEADER_RE = re.compile(r'^#{1,4}\s+`?(.+?)`?\s*$')
+FENCE = "```"
+
+class CodeBlockExtractor:
+    """
+    流式代码块解析器 (单遍状态机)
+    支持格式: #### path/to/file \\n ```python ... ```
+
+    状态:
+    - scan: 寻找文件路径标题
+    - await: 已识别路径，等待开始围栏 (期间出现新的路径标题则替换)
+    - code: 在代码块内，收集代码行直到结束围栏
+
+    用法:
+        extractor = CodeBlockExtractor(on_block=lambda path, code: ...)
+        extractor.feed(chunk)  # 可多次调用，按行增量解析
+        blocks = extractor.close()
+    """
+
+    def __init__(self, on_block=None):
+        """
+        :param on_block: 代码块闭合时的回调 on_block(path, code)
+        """
+        self.on_block = on_block
+        self.blocks = []  # [(path, code)]
+        self._state = "scan"
+        self._path = None
+        self._code_lines = []
+        self._partial = ""
+
+    @staticmethod
+    def match_path(line):
+        """判断一行是否为文件路径标题，返回路径或 None"""
+        if not line.startswith("#"):
+            return None
+        match = HEADER_RE.match(line)
+        if not match:
+            return None
+        path = match.group(1).strip()
+        # 过滤掉普通标题，只处理看起来像文件路径的
+        # 简单的启发式：包含 '.' 或者 '/'
+        if not ('.' in path or '/' in path or '\\' in path):
+            return None
+        return path
+
+    def feed(self, chunk):
+        """输入一段文本 (可以是任意切分的片段)"""
+        if not chunk:
+            return
+        if '\n' not in chunk:
+            self._partial += chunk
+            return
+        data = self._partial + chunk
+        lines = data.split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._process_line(line)
+
+    def close(self):
+        """输入结束：处理残留的半行，未闭合的代码块同样输出"""
+        if self._partial:
+            self._process_line(self._partial)
+            self._partial = ""
+        if self._state == "code":
+            self._emit()
+        self._state = "scan"
+        self._path = None
+        return self.blocks
+
+    def _process_line(self, raw_line):
+        line = raw_line.strip()
+        if self._state == "code":
+            if line.startswith(FENCE):
+                self._emit()
+            else:
+                self._code_lines.append(raw_line)
+            return
+
+        if self._state == "await" and line.startswith(FENCE):
+            self._state = "code"
+            self._code_lines = []
+            return
+
+        path = self.match_path(line)
+        if path:
+            self._path = path
+            self._state = "await"
+
+    def _emit(self):
+        path, code_lines = self._path, self._code_lines
+        self._state = "scan"
+        self._path = None
+        self._code_lines = []
+        if not code_lines:
+            return
+        code = "\n".join(code_lines)
+        self.blocks.append((path, code))
+        if self.on_block:
+            self.on_block(path, code)
+
+def extract_code_blocks(content):
+    """一次性解析整段文本，返回 [(path, code)]"""
+    extractor = CodeBlockExtractor()
+    extractor.feed(content)
+    return extractor.close()
+
+def rewrite_code_blocks(content, replace):
+    """
+    按与 CodeBlockExtractor 相同的规则定位文件代码块
+    :param replace: replace(path, code) -> 替换文本或 None (保留原样)；替换范围为整个围栏块，路径标题保留
+    :return: 替换后的文本
+    """
+    out = []
+    state, path, block = "scan", None, []
+    for raw_line in content.split('\n'):
+        line = raw_line.strip()
+        if state == "code":
+            if not line.startswith(FENCE):
+                block.append(raw_line)
+                continue
+            code_lines = block[1:]
+            new = replace(path, "\n".join(code_lines)) if code_lines else None
+            if new is None:
+                out.extend(block)
+                out.append(raw_line)
+            else:
+                out.append(new)
+            state, path, block = "scan", None, []
+            continue
+
+        if state == "await" and line.startswith(FENCE):
+            state, block = "code", [raw_line]
+            continue
+
+        matched = CodeBlockExtractor.match_path(line)
+        if matched:
+            path, state = matched, "await"
+        out.append(raw_line)
+
+    # 未闭合的代码块保留原样
+    out.extend(block)
+    return "\n".join(out)
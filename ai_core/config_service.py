@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 校验时先检查各配置段的类型 (类型不对记为错误并跳过该段)，畸形配置统一报 ConfigError；触发规则缺少 pattern/next 报缺少必填字段。
+
+import json
+import os
+import re
+import threading
+
+from .speaker_selector import BUILTIN_METHODS
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_service = None
+_service_lock = threading.Lock()
+
+class ConfigError(ValueError):
+    """配置文件无法解析或未通过校验"""
+
+    def __init__(self, path, errors):
+        self.path = path
+        self.errors = list(errors)
+        super().__init__(f"Invalid config {path}:\n" + "\n".join(f"  - {e}" for e in self.errors))
+
+class FrozenDict(dict):
+    """
+    只读 dict：同一快照在多个会话/线程间共享，任何修改都会抛出 TypeError
+    仍是 dict 子类，json.dumps / pickle 与 .get() 等读取方式照常可用；需要修改时用 thaw() 复制
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("config snapshot is read-only, use thaw() for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze(value):
+    """JSON 数据 -> 只读快照 (dict -> FrozenDict, list -> tuple)"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def thaw(value):
+    """只读快照 -> 可修改的普通 dict / list 副本"""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+def secrets_path():
+    """secrets/config.json 路径，环境变量 CYBER_SECRETS_PATH 可覆盖"""
+    return os.environ.get("CYBER_SECRETS_PATH") or os.path.join(ROOT_DIR, "secrets", "config.json")
+
+def _is_number(value, minimum=0):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= minimum
+
+def _known(name, names):
+    """name 是 names 中的字符串 (列表/对象等不可哈希的值同样视为未知)"""
+    return isinstance(name, str) and name in names
+
+def _section(parent, key, name, errors):
+    """
+    取 parent[key] 并检查其为 JSON 对象
+    缺省时返回空 dict；类型不对时记录错误并返回空 dict，调用方据此跳过该段
+    """
+    value = parent.get(key, {})
+    if not isinstance(value, dict):
+        errors.append(f"{name} must be an object")
+        return {}
+    return value
+
+def validate_secrets(config):
+    """返回 secrets/config.json 的错误列表 (空列表表示通过)"""
+    if not isinstance(config, dict):
+        return ["top level must be a JSON object"]
+    errors = []
+    models = config.get("models", {})
+    if not isinstance(models, dict):
+        errors.append("models must be an object of {alias: model config}")
+        models = {}
+    for alias, model_cfg in models.items():
+        if not isinstance(model_cfg, dict):
+            errors.append(f"models.{alias} must be an object")
+            continue
+        if not isinstance(model_cfg.get("model"), str) or not model_cfg["model"]:
+            errors.append(f"models.{alias}.model is required")
+        if model_cfg.get("base_url") is not None and not isinstance(model_cfg["base_url"], str):
+            errors.append(f"models.{alias}.base_url must be a string")
+        if model_cfg.get("timeout") is not None and not _is_number(model_cfg["timeout"], minimum=1e-9):
+            errors.append(f"models.{alias}.timeout must be a positive number")
+
+    default_model = config.get("default_model")
+    if default_model is not None and not _known(default_model, models):
+        errors.append(f"default_model '{default_model}' is not defined in models")
+    for role, alias in _section(config, "role_mapping", "role_mapping", errors).items():
+        if not _known(alias, models):
+            errors.append(f"role_mapping.{role} refers to unknown model alias '{alias}'")
+
+    routing = _section(config, "routing", "routing", errors)
+    for key, chain in _section(routing, "fallbacks", "routing.fallbacks", errors).items():
+        if not isinstance(chain, list):
+            errors.append(f"routing.fallbacks.{key} must be a list of model aliases")
+            continue
+        for alias in chain:
+            if not _known(alias, models):
+                errors.append(f"routing.fallbacks.{key} refers to unknown model alias '{alias}'")
+
+    selection = _section(config, "model_selection", "model_selection", errors)
+    for primary, cheap in _section(selection, "downgrade", "model_selection.downgrade", errors).items():
+        if not _known(primary, models) or not _known(cheap, models):
+            errors.append(f"model_selection.downgrade {primary} -> {cheap} refers to an unknown model alias")
+    if selection.get("local_model") is not None and not _known(selection["local_model"], models):
+        errors.append(f"model_selection.local_model '{selection['local_model']}' is not defined in models")
+
+    budget = _section(config, "budget_control", "budget_control", errors)
+    if budget.get("max_cost_cny") is not None and not _is_number(budget["max_cost_cny"]):
+        errors.append("budget_control.max_cost_cny must be a non-negative number")
+    threshold = budget.get("warning_threshold")
+    if threshold is not None and not (_is_number(threshold) and threshold <= 1):
+        errors.append("budget_control.warning_threshold must be between 0 and 1")
+    for key, limits in _section(config, "rate_limits", "rate_limits", errors).items():
+        if key == "help" or not isinstance(limits, dict):
+            continue
+        for field in ("rpm", "tpm"):
+            if limits.get(field) is not None and not _is_number(limits[field], minimum=1e-9):
+                errors.append(f"rate_limits.{key}.{field} must be a positive number")
+    return errors
+
+def validate_company(config, model_aliases=None):
+    """
+    返回公司配置的错误列表
+    :param model_aliases: secrets 中的模型别名集合，None 表示不检查 model_alias
+    """
+    if not isinstance(config, dict):
+        return ["top level must be a JSON object"]
+    errors = []
+    roles = config.get("roles")
+    if not isinstance(roles, list) or not roles:
+        return errors + ["roles must be a non-empty list"]
+    names = []
+    for i, role in enumerate(roles):
+        if not isinstance(role, dict) or not isinstance(role.get("name"), str) or not role["name"]:
+            errors.append(f"roles[{i}].name is required")
+            continue
+        name = role["name"]
+        if name in names:
+            errors.append(f"duplicate role name '{name}'")
+        names.append(name)
+        if role.get("prompt_file") is not None and not isinstance(role["prompt_file"], str):
+            errors.append(f"roles[{i}].prompt_file must be a string")
+        alias = role.get("model_alias")
+        if alias and model_aliases is not None and not _known(alias, model_aliases):
+            errors.append(f"roles[{i}] ({name}) uses unknown model alias '{alias}'")
+
+    process = _section(config, "process", "process", errors)
+    max_round = process.get("max_round")
+    if max_round is not None and not (isinstance(max_round, int) and max_round > 0):
+        errors.append("process.max_round must be a positive integer")
+    method = process.get("speaker_selection_method", "auto")
+    if not _known(method, BUILTIN_METHODS + ("rules",)):
+        errors.append(f"process.speaker_selection_method '{method}' is not one of {BUILTIN_METHODS + ('rules',)}")
+    if method == "rules":
+        errors += _validate_speaker_rules(_section(process, "speaker_rules", "process.speaker_rules", errors), set(names))
+    compaction = _section(process, "context_compaction", "process.context_compaction", errors)
+    alias = compaction.get("summary_model")
+    if compaction.get("enabled") and alias and model_aliases is not None and not _known(alias, model_aliases):
+        errors.append(f"process.context_compaction.summary_model uses unknown model alias '{alias}'")
+    return errors
+
+def _validate_speaker_rules(rules, names):
+    errors = []
+    if rules.get("start") and not _known(rules["start"], names):
+        errors.append(f"speaker_rules.start '{rules['start']}' is not a role")
+    fallback = rules.get("fallback", "auto")
+    if not _known(fallback, BUILTIN_METHODS) and not _known(fallback, names):
+        errors.append(f"speaker_rules.fallback '{fallback}' is neither a role nor one of {BUILTIN_METHODS}")
+    for speaker, rule in _section(rules, "transitions", "speaker_rules.transitions", errors).items():
+        prefix = f"speaker_rules.transitions.{speaker}"
+        if speaker not in names:
+            errors.append(f"speaker_rules.transitions has unknown role '{speaker}'")
+        if not isinstance(rule, dict):
+            errors.append(f"{prefix} must be an object")
+            continue
+        targets = rule.get("next", [])
+        if not isinstance(targets, list):
+            errors.append(f"{prefix}.next must be a list of role names")
+            targets = []
+        triggers = rule.get("triggers", [])
+        if not isinstance(triggers, list):
+            errors.append(f"{prefix}.triggers must be a list")
+            triggers = []
+        for i, trigger in enumerate(triggers):
+            if not isinstance(trigger, dict):
+                errors.append(f"{prefix}.triggers[{i}] must be an object")
+                continue
+            missing = [field for field in ("pattern", "next") if field not in trigger]
+            if missing:
+                errors.append(f"{prefix}.triggers[{i}] is missing required field(s): {', '.join(missing)}")
+                continue
+            try:
+                re.compile(trigger["pattern"])
+            except (re.error, TypeError) as e:
+                errors.append(f"{prefix} has invalid pattern {trigger['pattern']!r}: {e}")
+            targets = targets + [trigger["next"]]
+        for target in targets:
+            if not _known(target, names):
+                errors.append(f"{prefix} routes to unknown role '{target}'")
+        if rule.get("fallback") and not _known(rule["fallback"], names):
+            errors.append(f"{prefix}.fallback '{rule['fallback']}' is not a role")
+    return errors
+
+class ConfigService:
+    """
+    进程级配置缓存
+    - 每个文件按 (mtime, size) 记忆解析结果；文件被修改后下一次访问自动重新解析与校验
+    - 返回的快照只读，同一版本在并发会话之间共享
+    - 公司配置的校验依赖 secrets 中的模型别名，secrets 重载后公司配置随之重新校验
+    """
+
+    def __init__(self):
+        self._entries = {}  # {(kind, path): (stamp, value)}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+        self.reloads = 0
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _cached(self, kind, path, stamp, loader):
+        key = (kind, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+        # 解析在锁外进行；并发的首次加载最多重复解析一次，结果相同
+        value = loader()
+        with self._lock:
+            if key in self._entries:
+                self.reloads += 1
+            self.loads += 1
+            self._entries[key] = (stamp, value)
+        return value
+
+    def secrets(self):
+        """
+        secrets/config.json 的只读快照，文件不存在时返回 None
+        :raises ConfigError: JSON 无法解析或校验失败
+        """
+        path = secrets_path()
+        stamp = self._stamp(path)
+        if stamp is None:
+            return None
+
+        def load():
+            data = _read_json(path)
+            errors = validate_secrets(data)
+            if errors:
+                raise ConfigError(path, errors)
+            return freeze(data)
+        return self._cached("secrets", path, stamp, load)
+
+    def company(self, path):
+        """
+        公司配置 JSON 的只读快照
+        :raises ConfigError: 文件缺失、无法解析或校验失败
+        """
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+        if stamp is None:
+            raise ConfigError(path, ["file not found"])
+        secrets = self.secrets()
+        aliases = frozenset(secrets.get("models", {})) if secrets else None
+
+        def load():
+            data = _read_json(path)
+            errors = validate_company(data, aliases)
+            if errors:
+                raise ConfigError(path, errors)
+            return freeze(data)
+        # 同一文件在不同 secrets 快照下分别缓存
+        return self._cached("company", path, (stamp, aliases), load)
+
+    def prompt(self, path):
+        """Prompt 文件内容，不存在时返回空字符串"""
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+        if stamp is None:
+            return ""
+
+        def load():
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        return self._cached("prompt", path, stamp, load)
+
+    def get_stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "loads": self.loads, "reloads": self.reloads, "hits": self.hits}
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ConfigError(path, [str(e)]) from e
+
+def get_config_service():
+    """进程级单例"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ConfigService()
+    return _service
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.2
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 摘要的模型调用在锁外进行 (同一段摘要只由一个线程生成)；省下的 token 用 TokenTracker 的估算器计算。
+
+import hashlib
+import threading
+
+from .code_extractor import rewrite_code_blocks
+from .tools import saved_file_ref
+
+SUMMARY_NAME = "ContextSummary"
+
+SUMMARY_PROMPT = """你是项目会议记录员。请把【已有摘要】与【新增对话】合并成一份新的摘要。
+要求:
+- 保留已做出的决定、需求变更、接口/数据结构约定、已创建的文件及其用途、未解决的问题与分工
+- 省略寒暄、重复内容和完整代码 (代码已保存在工作区，只需写文件路径)
+- 不超过 {max_chars} 字，使用与对话相同的语言"""
+
+class ContextCompactor:
+    """
+    上下文压缩 (挂在每个 Assistant 的 process_all_messages_before_reply Hook 上)
+    - 前 keep_first 条 (任务描述) 与最近 keep_last 条消息保留原文
+    - 中间较早的消息每满 summary_chunk 条由廉价模型合并进滚动摘要，摘要在所有 Agent 间共享
+    - 未被摘要的较早消息中，已保存到工作区的代码块替换为 path@hash 引用
+    - 只改写发给模型的消息副本，不修改 Agent 的对话历史
+    """
+
+    def __init__(self, work_dir, summarizer=None, tracker=None, keep_first=1, keep_last=6,
+                 summary_chunk=6, max_summary_chars=1500, code_refs=True):
+        """
+        :param work_dir: 工作区目录 (用于查找已保存的代码块)
+        :param summarizer: CyberModelClient，None 表示只做代码引用替换
+        :param tracker: 可选 TokenTracker，记录每轮省下的 token 与摘要次数
+        """
+        self.work_dir = work_dir
+        self.summarizer = summarizer
+        self.tracker = tracker
+        self.keep_first = max(0, keep_first)
+        self.keep_last = max(1, keep_last)
+        self.summary_chunk = max(1, summary_chunk)
+        self.max_summary_chars = max_summary_chars
+        self.code_refs = code_refs
+        self._checkpoints = {}  # {前缀指纹: (消息数, 摘要)}
+        self._pending = {}  # {前缀指纹: Event}，正在生成的摘要
+        self._lock = threading.Lock()
+
+    def attach(self, agent):
+        agent.register_hook("process_all_messages_before_reply", self.compact)
+
+    def export_state(self):
+        """已有的滚动摘要 (写入检查点)"""
+        with self._lock:
+            return {"checkpoints": {fp: list(v) for fp, v in self._checkpoints.items()}}
+
+    def restore_state(self, state):
+        with self._lock:
+            for fp, (count, summary) in (state or {}).get("checkpoints", {}).items():
+                self._checkpoints[fp] = (count, summary)
+
+    def compact(self, messages):
+        """Hook 入口：返回压缩后的消息列表"""
+        if len(messages) <= self.keep_first + self.keep_last:
+            return messages
+
+        head = messages[:self.keep_first]
+        body_end = len(messages) - self.keep_last
+        # 最近的原文不能以工具结果开头 (必须紧跟对应的工具调用)
+        while body_end > self.keep_first and _is_tool_result(messages[body_end]):
+            body_end -= 1
+        body = messages[self.keep_first:body_end]
+        tail = messages[body_end:]
+
+        summarized, summary = self._summary_for(messages, body)
+        compacted = list(head)
+        if summary:
+            compacted.append({
+                "role": "user",
+                "name": SUMMARY_NAME,
+                "content": f"[前 {summarized} 条对话的摘要]\n{summary}",
+            })
+        compacted.extend(self._with_code_refs(m) for m in body[summarized:])
+        compacted.extend(tail)
+
+        if self.tracker is not None:
+            estimator = self.tracker.estimator
+            saved = estimator.count_messages(messages) - estimator.count_messages(compacted)
+            self.tracker.track_compaction(max(0, saved))
+        return compacted
+
+    def _summary_for(self, messages, body):
+        """
+        返回 (已被摘要覆盖的 body 消息数, 摘要文本)
+        摘要边界取 summary_chunk 的整数倍，且不落在工具调用与结果之间
+        """
+        if self.summarizer is None:
+            return 0, None
+        target = len(body) // self.summary_chunk * self.summary_chunk
+        while 0 < target < len(body) and _is_tool_result(body[target]):
+            target -= 1
+        if target <= 0:
+            return 0, None
+
+        prefixes = _prefix_fingerprints(messages[:self.keep_first], body[:target])
+        key = prefixes[target]
+        with self._lock:
+            # 从最近的已有摘要出发，只摘要新增部分
+            start, summary = 0, ""
+            for count in range(target, 0, -1):
+                checkpoint = self._checkpoints.get(prefixes[count])
+                if checkpoint is not None:
+                    start, summary = checkpoint
+                    break
+            if start == target:
+                return target, summary
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = threading.Event()
+
+        if not owner:
+            # 另一个线程正在生成同一段摘要，等它完成而不是重复付费
+            pending.wait()
+            with self._lock:
+                return self._checkpoints.get(key) or (start, summary or None)
+
+        # 模型调用不持锁，其他 Agent 的压缩 (代码引用替换、已有摘要) 不被阻塞
+        try:
+            new_summary = self._summarize(summary, [self._with_code_refs(m) for m in body[start:target]])
+            with self._lock:
+                if new_summary is not None:
+                    self._checkpoints[key] = (target, new_summary)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        if new_summary is None:
+            return start, summary or None
+        return target, new_summary
+
+    def _summarize(self, summary, messages):
+        transcript = "\n\n".join(f"[{m.get('name') or m.get('role')}]: {m.get('content') or ''}" for m in messages)
+        request = {
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT.format(max_chars=self.max_summary_chars)},
+                {"role": "user", "content": f"【已有摘要】\n{summary or '(无)'}\n\n【新增对话】\n{transcript}"},
+            ],
+            "temperature": 0,
+        }
+        try:
+            response = self.summarizer.create(request)
+            text = self.summarizer.message_retrieval(response)[0]
+        except Exception as e:
+            print(f"⚠️ Context summary failed, keeping messages verbatim: {e}")
+            return None
+        if not isinstance(text, str) or not text.strip():
+            return None
+        if self.tracker is not None:
+            self.tracker.track_compaction(0, summaries=1)
+        return text.strip()[:self.max_summary_chars * 2]
+
+    def _with_code_refs(self, message):
+        content = message.get("content")
+        if not self.code_refs or not isinstance(content, str) or "```" not in content:
+            return message
+
+        def replace(path, code):
+            ref = saved_file_ref(self.work_dir, path, code)
+            return f"`{ref}` (已保存到工作区，内容略)" if ref else None
+
+        new_content = rewrite_code_blocks(content, replace)
+        if new_content == content:
+            return message
+        return dict(message, content=new_content)
+
+def _is_tool_result(message):
+    return message.get("role") in ("tool", "function") or bool(message.get("tool_responses"))
+
+def _prefix_fingerprints(head, body):
+    """返回 fingerprints[i] = head + body[:i] 的指纹 (只看发言人与内容，与接收方视角无关)"""
+    digest = hashlib.sha1()
+    for m in head:
+        digest.update(f"{m.get('name')}\x00{m.get('content')}\x01".encode("utf-8"))
+    fingerprints = [digest.hexdigest()]
+    for m in body:
+        digest.update(f"{m.get('name')}\x00{m.get('content')}\x01".encode("utf-8"))
+        fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+def create_context_compactor(process_cfg, work_dir, factory, tracker=None):
+    """
+    根据公司 JSON 的 process.context_compaction 段创建压缩器，未启用时返回 None
+    """
+    cfg = process_cfg.get("context_compaction", {})
+    if not cfg.get("enabled", False):
+        return None
+    summarizer = None
+    if cfg.get("summaries", True):
+        summarizer = factory.create_model_client(cfg.get("summary_model"), name=SUMMARY_NAME)
+    return ContextCompactor(
+        work_dir,
+        summarizer=summarizer,
+        tracker=tracker,
+        keep_first=cfg.get("keep_first", 1),
+        keep_last=cfg.get("keep_last", 6),
+        summary_chunk=cfg.get("summary_chunk", 6),
+        max_summary_chars=cfg.get("max_summary_chars", 1500),
+        code_refs=cfg.get("code_refs", True),
+    )
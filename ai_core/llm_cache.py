@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 基于 SQLite 的模型响应磁盘缓存，按条目数/字节数做 LRU 淘汰。
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 参与缓存键计算的消息字段
+MESSAGE_KEYS = ("role", "content", "name", "tool_calls", "function_call", "tool_call_id")
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def _default_cache_path():
+    current_dir = os.path.dirname(os.path.abspath(__file__))  # ai_core/
+    root_dir = os.path.dirname(current_dir)
+    return os.path.join(root_dir, ".cache", "llm_responses.sqlite")
+
+def normalize_messages(messages):
+    """规范化消息列表：只保留影响回复的字段，去掉空值和首尾空白"""
+    normalized = []
+    for msg in messages or []:
+        item = {}
+        for k in MESSAGE_KEYS:
+            v = msg.get(k)
+            if v is None:
+                continue
+            if isinstance(v, str):
+                v = v.strip()
+            item[k] = v
+        normalized.append(item)
+    return normalized
+
+def make_cache_key(base_url, request):
+    """
+    根据 base_url 和请求参数 (model, temperature, messages, tools 等) 生成缓存键
+    """
+    payload = {k: v for k, v in request.items() if k != "messages"}
+    payload["messages"] = normalize_messages(request.get("messages"))
+    payload["base_url"] = base_url
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    模型响应磁盘缓存
+    - SQLite 单文件存储，多进程可共享
+    - 超过 max_entries 或 max_bytes 时按最近访问时间淘汰 (LRU)
+    """
+
+    def __init__(self, path=None, max_entries=5000, max_bytes=200 * 1024 * 1024):
+        """
+        :param path: 数据库路径，默认 <项目根目录>/.cache/llm_responses.sqlite
+        :param max_entries: 最大条目数
+        :param max_bytes: 最大总字节数，None 表示不限制
+        """
+        self.path = path or _default_cache_path()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """读取缓存，命中时刷新访问时间；未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """写入缓存 (value 需可 JSON 序列化)，随后按需淘汰"""
+        data = json.dumps(value, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        over_count = max(0, count - self.max_entries) if self.max_entries else 0
+        over_bytes = max(0, total - self.max_bytes) if self.max_bytes else 0
+        if not over_count and not over_bytes:
+            return
+
+        victims = []
+        freed = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if len(victims) >= over_count and freed >= over_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def get_stats(self):
+        """获取命中统计"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def open_response_cache(cache_cfg):
+    """
+    根据 secrets/config.json 的 llm_cache 段打开缓存 (同一路径在进程内共享实例)
+    """
+    cache_cfg = cache_cfg or {}
+    path = cache_cfg.get("path") or _default_cache_path()
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+    max_mb = cache_cfg.get("max_mb", 200)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = ResponseCache(
+                path,
+                max_entries=cache_cfg.get("max_entries", 5000),
+                max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+            )
+            _caches[path] = cache
+        return cache
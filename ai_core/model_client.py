@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+# 版本: v2.5
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: StreamInterruptedError 移到 ai_core.streaming (runner 捕获它时不必导入 openai)。
+
+import time
+from contextlib import nullcontext
+
+from openai import APIConnectionError, APIStatusError, OpenAI, RateLimitError
+from openai.types.chat import ChatCompletion
+
+from .llm_cache import make_cache_key
+from .model_router import RETRYABLE_STATUS, ModelRouter, is_retryable_error
+from .streaming import StreamInterruptedError
+from .token_tracker import BudgetExceededError, get_token_estimator
+from .tracing import span
+
+# 429 响应未携带 retry-after 时的默认暂停秒数
+DEFAULT_RATE_LIMIT_PAUSE = 10
+
+# 透传给 chat.completions.create 的参数，其余 (alias、model_client_cls 等) 为框架内部字段
+REQUEST_KEYS = (
+    "model", "messages", "temperature", "top_p", "max_tokens", "n", "stop", "seed",
+    "tools", "tool_choice", "functions", "function_call", "response_format",
+    "presence_penalty", "frequency_penalty", "user",
+)
+
+DEFAULT_TIMEOUT = 120
+
+# 进程级限制，批量模式下由父进程通过 Manager 代理注入 (见 ai_core.batch)
+_model_semaphores = {}
+_shared_budget = None
+
+class CyberResponse:
+    """
+    CyberModelClient.create 的返回值：包装 ChatCompletion 并附带本框架的元数据，其余属性透传给 completion
+    AutoGen 在响应上设置的 cost、message_retrieval_function 等属性落在包装对象上，不依赖 pydantic 允许额外属性
+    """
+
+    def __init__(self, completion, served_model, cached=False, ttft=None):
+        """
+        :param completion: ChatCompletion
+        :param served_model: 实际应答的模型 (兜底或逐轮选择时不同于主模型)
+        :param cached: 是否来自响应缓存 (零成本)
+        :param ttft: 流式调用的首 token 延迟 (秒)，非流式为 None
+        """
+        self.completion = completion
+        self.served_model = served_model
+        self.cached = cached
+        self.ttft = ttft
+
+    def __getattr__(self, name):
+        if name == "completion":
+            raise AttributeError(name)
+        return getattr(self.completion, name)
+
+def install_process_limits(model_semaphores=None, shared_budget=None):
+    """
+    安装进程级调用限制
+    :param model_semaphores: {模型别名: Semaphore}，限制该别名的同时在途调用数
+    :param shared_budget: 跨进程共享的预算对象 (需提供 add(cost) / exceeded())
+    """
+    global _shared_budget
+    _model_semaphores.clear()
+    _model_semaphores.update(model_semaphores or {})
+    _shared_budget = shared_budget
+
+def _retry_after(error):
+    """从 429 响应头读取 retry-after 秒数"""
+    try:
+        return float(error.response.headers.get("retry-after", DEFAULT_RATE_LIMIT_PAUSE))
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_RATE_LIMIT_PAUSE
+
+def _is_retryable(error):
+    """连接错误/超时 (APITimeoutError 是 APIConnectionError 的子类)、429 与 5xx 换端点重试，其余请求错误直接抛出"""
+    if isinstance(error, (APIConnectionError, RateLimitError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return is_retryable_error(error)
+
+def _completion_text(response):
+    """回复的全部文本 (含工具调用参数)，用于本地估算输出 token"""
+    parts = []
+    for choice in response.choices:
+        message = choice.message
+        parts.append(message.content or "")
+        for call in message.tool_calls or []:
+            parts.append(call.function.name + call.function.arguments)
+        if message.function_call is not None:
+            parts.append(message.function_call.name + message.function_call.arguments)
+    return "".join(parts)
+
+def _collect_stream(chunks, on_text):
+    """
+    把流式 chunk 拼回完整的 ChatCompletion (文本、工具调用、finish_reason、usage)
+    :param on_text: on_text(delta)，第一个候选回复的每段文本到达时调用
+    """
+    head = None
+    usage = None
+    slots = {}
+    for chunk in chunks:
+        if head is None:
+            head = {"id": chunk.id, "created": chunk.created, "model": chunk.model,
+                    "system_fingerprint": getattr(chunk, "system_fingerprint", None)}
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage.model_dump()
+        for choice in chunk.choices:
+            slot = slots.setdefault(choice.index, {"content": [], "tool_calls": {}, "function_call": None,
+                                                   "finish_reason": None})
+            delta = choice.delta
+            if delta.content:
+                slot["content"].append(delta.content)
+                if choice.index == 0:
+                    on_text(delta.content)
+            for call in delta.tool_calls or []:
+                entry = slot["tool_calls"].setdefault(call.index, {
+                    "id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                entry["id"] = call.id or entry["id"]
+                if call.function is not None:
+                    entry["function"]["name"] += call.function.name or ""
+                    entry["function"]["arguments"] += call.function.arguments or ""
+            if delta.function_call is not None:
+                fc = slot["function_call"] = slot["function_call"] or {"name": "", "arguments": ""}
+                fc["name"] += delta.function_call.name or ""
+                fc["arguments"] += delta.function_call.arguments or ""
+            if choice.finish_reason:
+                slot["finish_reason"] = choice.finish_reason
+
+    choices = []
+    for index, slot in sorted(slots.items()):
+        tool_calls = [call for _, call in sorted(slot["tool_calls"].items())] or None
+        content = "".join(slot["content"])
+        choices.append({
+            "index": index,
+            "finish_reason": slot["finish_reason"] or ("tool_calls" if tool_calls else "stop"),
+            "message": {
+                "role": "assistant",
+                "content": content if content or not (tool_calls or slot["function_call"]) else None,
+                "tool_calls": tool_calls,
+                "function_call": slot["function_call"],
+            },
+        })
+    data = dict(head or {"id": "", "created": int(time.time()), "model": ""}, object="chat.completion",
+                choices=choices, usage=usage)
+    return ChatCompletion.model_validate(data)
+
+class ModelRoute:
+    """兜底链中的一个端点：模型别名、OpenAI 客户端与该端点的限流器"""
+
+    def __init__(self, alias, config, limiter=None):
+        self.alias = alias
+        self.model = config.get("model")
+        self.base_url = config.get("base_url")
+        self.limiter = limiter
+        self.client = OpenAI(
+            api_key=config.get("api_key"),
+            base_url=self.base_url,
+            timeout=config.get("timeout", DEFAULT_TIMEOUT),
+        )
+
+class CyberModelClient:
+    """
+    OpenAI 兼容接口的自定义 ModelClient (AutoGen custom model client 协议)
+    - AgentFactory 创建的 Assistant 均通过 register_model_client 挂载此客户端
+    - cache: 可选 ResponseCache，命中时不访问网络，计为零成本调用
+    - tracker: 可选 TokenTracker，每次调用实时记录用量
+    - limiter: 可选 RateLimiter，同一别名/端点的所有调用共享
+    - archive: 可选 SessionRecorder / SessionReplayer，回放时不访问网络、不限流、不等待
+    - fallbacks / routing: 兜底端点与路由策略 (见 ai_core.model_router)，缓存与录制仍以主端点为准
+    - selector / variants: 逐轮模型选择 (见 ai_core.model_selector) 及其可选别名的端点配置
+    - stream: 可选 StreamSink (见 ai_core.streaming)，设置后以流式调用，文本边生成边回显、边提取代码块
+    """
+
+    def __init__(self, config, alias=None, cache=None, tracker=None, limiter=None, agent_name=None,
+                 archive=None, fallbacks=None, routing=None, selector=None, variants=None, stream=None, **kwargs):
+        """
+        :param config: config_list 中的单项配置 (model, api_key, base_url ...)
+        :param alias: secrets/config.json 中的模型别名
+        :param agent_name: 使用此客户端的 Agent 名称 (写入遥测)
+        :param fallbacks: 兜底端点 [{"alias", "config", "limiter"}]，按顺序尝试
+        :param routing: RoutingPolicy，None 时不对冲
+        :param selector: ModelSelector，None 时始终使用 alias
+        :param variants: selector 可能选中的别名 {alias: {"config", "limiter", "fallbacks"}}
+        :param stream: StreamSink，None 时为普通 (非流式) 调用
+        """
+        self.config = config
+        self.alias = alias
+        self.agent_name = agent_name
+        self.model = config.get("model")
+        self.base_url = config.get("base_url")
+        self.cache = cache
+        self.tracker = tracker
+        self.limiter = limiter
+        self.archive = archive
+        self.routes = [ModelRoute(alias, config, limiter)] + [
+            ModelRoute(f["alias"], f["config"], f.get("limiter")) for f in fallbacks or ()
+        ]
+        self.router = ModelRouter(self.routes, routing)
+        self.selector = selector
+        self._variants = variants or {}
+        self._variant_routers = {}
+        self.stream = stream
+
+    def _build_request(self, params):
+        request = {k: params[k] for k in REQUEST_KEYS if params.get(k) is not None}
+        request.setdefault("model", self.model)
+        return request
+
+    def _router_for(self, alias):
+        """别名对应的兜底链路由器 (选择器选中的别名首次使用时才创建客户端)"""
+        if alias == self.alias:
+            return self.router
+        router = self._variant_routers.get(alias)
+        if router is None:
+            variant = self._variants[alias]
+            routes = [ModelRoute(alias, variant["config"], variant.get("limiter"))] + [
+                ModelRoute(f["alias"], f["config"], f.get("limiter")) for f in variant.get("fallbacks", ())
+            ]
+            router = self._variant_routers[alias] = ModelRouter(routes, self.router.policy)
+        return router
+
+    def _select(self, request):
+        """
+        逐轮选择模型别名
+        :return: (别名, 原因)，未启用选择器时原因为 None
+        """
+        if self.selector is None or request["model"] != self.model:
+            return self.alias, None
+        history_tokens = 0
+        remaining_fraction = None
+        if self.tracker is not None:
+            history_tokens = self.tracker.estimator.count_messages(request.get("messages"), self.model)
+            if self.tracker.budget_limit:
+                remaining = self.tracker.check_budget()[1]
+                remaining_fraction = max(0.0, remaining) / self.tracker.budget_limit
+        alias, reason = self.selector.choose(request.get("messages"), history_tokens, remaining_fraction)
+        return (alias if alias in self._variants else self.alias), reason
+
+    def create(self, params):
+        request = self._build_request(params)
+        alias, reason = self._select(request)
+        router = self._router_for(alias)
+        base_url = router.routes[0].base_url
+        if alias != self.alias:
+            request = dict(request, model=router.routes[0].model)
+        model = request["model"]
+        if self.archive is not None and self.archive.replaying:
+            return self._replay(request, base_url)
+
+        cache_key = None
+        if self.cache is not None:
+            start = time.perf_counter()
+            cache_key = make_cache_key(base_url, request)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                response = CyberResponse(ChatCompletion.model_validate(cached), model, cached=True)
+                latency = time.perf_counter() - start
+                if self.tracker is not None:
+                    self.tracker.track_cache_hit(model, agent=self.agent_name, latency=latency)
+                    if reason is not None:
+                        self.tracker.track_model_selection(self.agent_name, self.alias, alias, reason)
+                self._record(request, cached, latency, cache_key, cached=True)
+                return response
+            if self.tracker is not None:
+                self.tracker.track_cache_miss()
+
+        # 预算硬限制：在花钱之前拒绝 (缓存命中不计费，不受限制)
+        if _shared_budget is not None and _shared_budget.exceeded():
+            if self.tracker is not None:
+                self.tracker.stop_reason = "batch_budget_exhausted"
+            raise BudgetExceededError("Global batch budget exhausted")
+        if self.tracker is not None:
+            self.tracker.preflight(model, self.tracker.estimator.count_messages(request.get("messages"), model))
+
+        routed = router.call(
+            lambda route: self._send(route, request),
+            fatal=(BudgetExceededError, StreamInterruptedError),
+            on_orphan=self._track_orphan,
+            hedge=self.stream is None,
+            retryable=_is_retryable,
+        )
+        completion, served_request, waited, ttft = routed.value
+        latency = routed.latency
+
+        if cache_key is not None or self.archive is not None:
+            dumped = completion.model_dump()
+            if cache_key is not None:
+                self.cache.set(cache_key, dumped)
+            self._record(request, dumped, latency, cache_key or make_cache_key(base_url, request))
+
+        response = CyberResponse(completion, routed.route.model, ttft=ttft)
+        route_fields = {"endpoint": routed.route.alias, "ttft": ttft}
+        if routed.failed:
+            route_fields["fallback_from"] = routed.failed
+        if routed.hedged:
+            route_fields["hedged"] = True
+            route_fields["hedge_won"] = routed.hedge_won
+        if self.tracker is not None:
+            self.tracker.track_route(routed.route.alias, latency, fallback=bool(routed.failed),
+                                     hedged=routed.hedged, hedge_won=routed.hedge_won)
+        cost = self._track_response(served_request, response, latency, rate_wait_s=round(waited, 4), **route_fields)
+        if reason is not None and self.tracker is not None:
+            self.tracker.track_model_selection(self.agent_name, self.alias, alias, reason,
+                                               saved=self._selection_savings(request, response, cost))
+        if _shared_budget is not None:
+            _shared_budget.add(cost)
+        return response
+
+    def _selection_savings(self, request, response, cost):
+        """同样的 token 数按主模型计价与实际成本之差 (预估节省，元)"""
+        if response.served_model == self.model:
+            return 0.0
+        if response.usage is None:
+            prompt_tokens, completion_tokens = self.tracker.estimate_usage(
+                self.model, request.get("messages"), _completion_text(response))
+        else:
+            prompt_tokens = response.usage.prompt_tokens or 0
+            completion_tokens = response.usage.completion_tokens or 0
+        return self.tracker._calculate_cost(self.model, prompt_tokens, completion_tokens) - cost
+
+    def _send(self, route, request):
+        """
+        向一个端点发出请求 (限流、并发限制、错误记录)
+        :return: (ChatCompletion, 实际发出的请求, 限流等待秒数, 首 token 延迟或 None)
+        """
+        if route.model != request["model"]:
+            request = dict(request, model=route.model)
+        reserved_tokens = 0
+        waited = 0.0
+        if route.limiter is not None:
+            reserved_tokens = get_token_estimator().count_request(request)
+            with span("llm.rate_wait", "llm", key=route.limiter.key):
+                waited = route.limiter.acquire(reserved_tokens)
+            if self.tracker is not None:
+                self.tracker.track_rate_limit_wait(route.limiter.key, waited)
+
+        start = time.perf_counter()
+        ttft = None
+        try:
+            with span("llm.call", "llm", model=route.model, agent=self.agent_name, endpoint=route.alias), \
+                    _model_semaphores.get(route.alias) or nullcontext():
+                if self.stream is None:
+                    response = route.client.chat.completions.create(**request)
+                else:
+                    response, ttft = self._create_streaming(route, request, start)
+        except Exception as e:
+            if isinstance(e, RateLimitError) and route.limiter is not None:
+                route.limiter.pause(_retry_after(e))
+            if self.tracker is not None:
+                self.tracker.track_call_error(route.model, e, agent=self.agent_name, latency=time.perf_counter() - start,
+                                              alias=self.alias, endpoint=route.alias)
+            raise
+        if route.limiter is not None and response.usage is not None:
+            route.limiter.reconcile(reserved_tokens, response.usage.total_tokens)
+        return response, request, waited, ttft
+
+    def _create_streaming(self, route, request, start):
+        """流式调用：文本到达即写入 MessageStream，结束后拼成完整的 ChatCompletion，返回 (ChatCompletion, 首 token 延迟)"""
+        message_stream = self.stream.open(self.agent_name)
+        ttft = None
+
+        def on_text(text):
+            nonlocal ttft
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            message_stream.feed(text)
+
+        try:
+            options = {"stream_options": {"include_usage": True}} if self.stream.include_usage else {}
+            chunks = route.client.chat.completions.create(**request, stream=True, **options)
+            response = _collect_stream(chunks, on_text)
+        except BaseException as e:
+            message_stream.abort()
+            if message_stream.blocks_submitted and isinstance(e, Exception):
+                raise StreamInterruptedError(
+                    f"stream from {route.alias} failed after {message_stream.blocks_submitted} code block(s) "
+                    f"were saved: {e}"
+                ) from e
+            raise
+        message_stream.close()
+        return response, ttft
+
+    def _track_orphan(self, route, sent, latency):
+        """对冲落败的请求也已计费：只记用量与成本，不作为本次回复"""
+        response, served_request, waited, _ = sent
+        cost = self._track_response(served_request, response, latency, endpoint=route.alias, hedge="lost")
+        if _shared_budget is not None:
+            _shared_budget.add(cost)
+
+    def _track_response(self, request, response, latency, **extra):
+        """记录一次调用的用量，返回成本 (元)"""
+        if self.tracker is None:
+            return 0.0
+        model = request["model"]
+        usage_missing = response.usage is None
+        if usage_missing:
+            # 部分兼容接口 (本地模型等) 不返回 usage，改用本地估算
+            prompt_tokens, completion_tokens = self.tracker.estimate_usage(
+                model, request.get("messages"), _completion_text(response))
+        else:
+            prompt_tokens = response.usage.prompt_tokens or 0
+            completion_tokens = response.usage.completion_tokens or 0
+        return self.tracker.track_call(
+            model,
+            prompt_tokens,
+            completion_tokens,
+            agent=self.agent_name,
+            latency=latency,
+            estimated=usage_missing,
+            alias=self.alias,
+            **extra,
+        )
+
+    def _record(self, request, response_data, latency, key, cached=False):
+        if self.archive is None:
+            return
+        self.archive.record_call(self.agent_name, self.alias, key, request, response_data, latency, cached=cached)
+
+    def _replay(self, request, base_url):
+        """回放录制的响应：用量与成本按录制时记录，不做预算预检和限流"""
+        with span("llm.replay", "llm", model=request["model"], agent=self.agent_name):
+            call = self.archive.next_call(self.agent_name, make_cache_key(base_url, request))
+        response = CyberResponse(ChatCompletion.model_validate(call["response"]), request["model"],
+                                 cached=bool(call.get("cached")))
+        if response.cached:
+            if self.tracker is not None:
+                self.tracker.track_cache_hit(request["model"], agent=self.agent_name, latency=0.0)
+        else:
+            self._track_response(request, response, 0.0, replayed=True)
+        return response
+
+    def message_retrieval(self, response):
+        """提取回复：含工具调用时返回 message 对象，否则返回文本"""
+        return [
+            choice.message
+            if choice.message.function_call is not None or choice.message.tool_calls
+            else choice.message.content
+            for choice in response.choices
+        ]
+
+    def cost(self, response):
+        """单次调用成本 (元)，缓存命中为 0"""
+        if response.cached or response.usage is None or self.tracker is None:
+            return 0.0
+        return self.tracker._calculate_cost(
+            response.served_model,
+            response.usage.prompt_tokens or 0,
+            response.usage.completion_tokens or 0,
+        )
+
+    @staticmethod
+    def get_usage(response):
+        usage = response.usage
+        if usage is None or response.cached:
+            return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0, "model": response.model}
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+            "cost": getattr(response, "cost", 0.0),
+            "model": response.model,
+        }
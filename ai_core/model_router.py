@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.3
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 分位数计算抽为公共的 percentile()，Token 报告复用同一实现。
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_WINDOW = 50
+# 这些 HTTP 状态码视为端点暂时不可用 (另加所有 5xx)
+RETRYABLE_STATUS = (408, 429)
+# 未携带状态码的网络类异常 (按类名识别，避免在这里导入 openai / httpx)
+RETRYABLE_ERROR_NAMES = ("APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+                         "Timeout", "ReadTimeout", "ConnectTimeout", "ConnectError", "RemoteProtocolError")
+
+_stats = {}
+_stats_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+def percentile(samples, q):
+    """样本的 q 分位 (0-100，取最近秩)，无样本时返回 None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))]
+
+class LatencyStats:
+    """
+    单个端点 (模型别名) 的滚动延迟窗口与健康状态，进程内所有 Agent/会话共享
+    - 连续失败 max_failures 次后进入冷却，冷却期内路由优先跳过该端点
+    """
+
+    def __init__(self, key, window=DEFAULT_WINDOW):
+        self.key = key
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+            self.calls += 1
+            self.consecutive_failures = 0
+
+    def record_error(self, max_failures, cooldown):
+        with self._lock:
+            self.errors += 1
+            self.consecutive_failures += 1
+            if max_failures and self.consecutive_failures >= max_failures:
+                self.cooldown_until = time.monotonic() + cooldown
+
+    def available(self):
+        return time.monotonic() >= self.cooldown_until
+
+    def percentile(self, q):
+        """窗口内延迟的 q 分位 (0-100)，无样本时返回 None"""
+        with self._lock:
+            samples = list(self._samples)
+        return percentile(samples, q)
+
+    def sample_count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def get_stats(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "p50_latency_s": round(p50, 3) if p50 is not None else None,
+            "p95_latency_s": round(p95, 3) if p95 is not None else None,
+            "cooling_down": not self.available(),
+        }
+
+def get_latency_stats(key, window=DEFAULT_WINDOW):
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = LatencyStats(key, window)
+        return stats
+
+def get_routing_stats():
+    """所有端点的延迟统计 {别名: stats}"""
+    with _stats_lock:
+        items = list(_stats.values())
+    return {s.key: s.get_stats() for s in items}
+
+def is_retryable_error(exc):
+    """
+    超时、连接错误、限流 (429) 与服务端 5xx 可换端点重试
+    请求本身的问题 (400 上下文过长、工具 schema 错误、401/403/404 等) 换端点也不会成功，应直接抛出
+    """
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS or status >= 500
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+class RoutingPolicy:
+    """secrets/config.json 的 routing 段"""
+
+    def __init__(self, cfg=None):
+        cfg = cfg or {}
+        hedge = cfg.get("hedge", {})
+        self.hedge_enabled = hedge.get("enabled", False)
+        self.hedge_percentile = hedge.get("percentile", 95)
+        self.hedge_min_samples = hedge.get("min_samples", 5)
+        self.hedge_min_delay = hedge.get("min_delay_seconds", 1.0)
+        self.window = cfg.get("window", DEFAULT_WINDOW)
+        self.max_failures = cfg.get("max_failures", 3)
+        self.cooldown = cfg.get("cooldown_seconds", 30)
+
+    def hedge_delay(self, stats):
+        """主请求超过该秒数仍未返回时发出对冲请求；样本不足或未启用时返回 None"""
+        if not self.hedge_enabled or stats.sample_count() < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, stats.percentile(self.hedge_percentile))
+
+def resolve_fallbacks(secrets_config, alias, agent_name=None):
+    """
+    兜底链 (不含主别名)：routing.fallbacks 中先按 Agent 名、再按模型别名查找
+    未在 models 中定义的别名会被忽略
+    """
+    cfg = secrets_config or {}
+    fallbacks = cfg.get("routing", {}).get("fallbacks", {})
+    chain = fallbacks.get(agent_name) if agent_name in fallbacks else fallbacks.get(alias, ())
+    models = cfg.get("models", {})
+    result = []
+    for name in chain or ():
+        if name != alias and name in models and name not in result:
+            result.append(name)
+    return result
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+        return _executor
+
+class RouteResult:
+    """一次路由调用的结果：send 的返回值、实际服务的端点与路由过程"""
+
+    def __init__(self, value, route, latency, failed=(), hedged=False, hedge_won=False):
+        self.value = value
+        self.route = route
+        self.latency = latency
+        self.failed = list(failed)
+        self.hedged = hedged
+        self.hedge_won = hedge_won
+
+class ModelRouter:
+    """
+    按兜底链发送请求
+    - routes: 端点列表 (需有 alias 属性)，第一个为主端点
+    - 当前端点失败时依次换下一个；冷却中的端点排到最后
+    - 启用对冲时，主请求超过其 p95 延迟仍未返回，就向下一个端点 (无兜底时为同一端点) 再发一次，先成功的胜出
+    """
+
+    def __init__(self, routes, policy=None):
+        self.routes = list(routes)
+        self.policy = policy or RoutingPolicy()
+        self.stats = {r.alias: get_latency_stats(r.alias, self.policy.window) for r in self.routes}
+
+    def _candidates(self):
+        healthy = [r for r in self.routes if self.stats[r.alias].available()]
+        return healthy + [r for r in self.routes if r not in healthy]
+
+    def call(self, send, fatal=(), on_orphan=None, hedge=True, retryable=is_retryable_error):
+        """
+        :param send: send(route) -> value，真正发出请求
+        :param fatal: 这些异常直接抛出，不再尝试兜底 (例如预算超限)
+        :param on_orphan: on_orphan(route, value, latency)，对冲落败但仍成功返回的请求 (已产生费用)
+        :param hedge: False 时本次不对冲 (例如流式回复会实时输出)
+        :param retryable: retryable(exc) -> bool，为 False 的异常立即抛出且不计入端点健康度
+        :return: RouteResult
+        """
+        candidates = self._candidates()
+        failed = []
+        for i, route in enumerate(candidates):
+            if route.alias in failed:
+                continue  # 已作为对冲请求失败过
+            remaining = [r for r in candidates[i + 1:] if r.alias not in failed]
+            hedge_route = (remaining[0] if remaining else route) if hedge else None
+            try:
+                result = self._attempt(send, route, hedge_route, fatal, on_orphan, retryable, failed)
+            except fatal:
+                raise
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                if route.alias not in failed:
+                    failed.append(route.alias)
+                if all(r.alias in failed for r in candidates):
+                    raise
+                continue
+            result.failed = failed
+            return result
+
+    def _timed(self, send, route, retryable):
+        start = time.perf_counter()
+        try:
+            value = send(route)
+        except Exception as e:
+            if retryable(e):
+                self.stats[route.alias].record_error(self.policy.max_failures, self.policy.cooldown)
+            raise
+        latency = time.perf_counter() - start
+        self.stats[route.alias].record(latency)
+        return value, latency
+
+    def _attempt(self, send, route, hedge_route, fatal, on_orphan, retryable, failed):
+        """
+        :param failed: 本次调用中失败的端点别名，对冲请求的可重试失败也登记在这里
+        """
+        delay = self.policy.hedge_delay(self.stats[route.alias]) if hedge_route is not None else None
+        if delay is None:
+            value, latency = self._timed(send, route, retryable)
+            return RouteResult(value, route, latency)
+
+        executor = _get_executor()
+        primary = executor.submit(self._timed, send, route, retryable)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            value, latency = primary.result()
+            return RouteResult(value, route, latency)
+
+        hedge = executor.submit(self._timed, send, hedge_route, retryable)
+        pending = {primary: route, hedge: hedge_route}
+        error = None
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                served = pending.pop(future)
+                exc = future.exception()
+                if exc is None:
+                    value, latency = future.result()
+                    self._orphan_pending(pending, on_orphan)
+                    return RouteResult(value, served, latency, hedged=True, hedge_won=future is hedge)
+                if isinstance(exc, fatal) or not retryable(exc):
+                    self._orphan_pending(pending, on_orphan)
+                    raise exc
+                if served.alias not in failed:
+                    failed.append(served.alias)
+                error = exc
+        raise error
+
+    @staticmethod
+    def _orphan_pending(pending, on_orphan):
+        """仍在进行的另一路请求结束后按对冲落败处理 (成功时已产生费用)"""
+        for other, other_route in pending.items():
+            other.add_done_callback(lambda f, r=other_route: _orphan_done(f, r, on_orphan))
+
+def _orphan_done(future, route, on_orphan):
+    if on_orphan is None or future.cancelled() or future.exception() is not None:
+        return
+    value, latency = future.result()
+    on_orphan(route, value, latency)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 按轮次的成本感知模型选择：根据历史长度、是否需要写代码、角色与剩余预算，把简单轮次降级到便宜/本地模型。
+
+import re
+
+# 最近一条消息命中时认为本轮需要写代码，保留主模型
+DEFAULT_CODE_PATTERN = (
+    r"```|^####\s|\b(implement|code|fix|refactor|function|class|bug|test|write)\b"
+    r"|实现|代码|编写|修复|重构|函数|测试"
+)
+
+class ModelSelector:
+    """
+    单个 Agent 的逐轮模型选择 (只用本地信号，不额外调用 LLM)
+    决策顺序:
+    1. 剩余预算比例 <= local_below 且配置了 local_model -> 本地模型 (budget_critical)
+    2. 剩余预算比例 <= budget_pressure -> 便宜模型 (budget_pressure)
+    3. 历史 token 数超过 max_history_tokens -> 主模型 (long_history，便宜模型上下文/能力可能不足)
+    4. 角色在 code_roles 中，或最近一条消息要求写代码 -> 主模型 (code_expected)
+    5. 最近一条消息不超过 short_message_chars -> 便宜模型 (short_turn)
+    6. 其余 -> 主模型 (default)
+    """
+
+    def __init__(self, alias, cheap_alias, local_alias=None, agent_name=None, cfg=None):
+        cfg = cfg or {}
+        self.alias = alias
+        self.cheap_alias = cheap_alias
+        self.local_alias = local_alias
+        self.agent_name = agent_name
+        self.short_chars = cfg.get("short_message_chars", 600)
+        self.max_history_tokens = cfg.get("max_history_tokens", 12000)
+        self.budget_pressure = cfg.get("budget_pressure", 0.3)
+        self.local_below = cfg.get("local_below", 0.1)
+        self.code_role = agent_name in cfg.get("code_roles", ())
+        self.code_re = re.compile(cfg.get("code_pattern", DEFAULT_CODE_PATTERN), re.IGNORECASE | re.MULTILINE)
+
+    def candidates(self):
+        """可能被选中的非主模型别名"""
+        return [a for a in (self.cheap_alias, self.local_alias) if a and a != self.alias]
+
+    def choose(self, messages, history_tokens, remaining_fraction=None):
+        """
+        :param messages: 本次请求的消息列表
+        :param history_tokens: 消息列表的预估 token 数
+        :param remaining_fraction: 剩余预算 / 预算上限，未设预算时为 None
+        :return: (别名, 原因)
+        """
+        if remaining_fraction is not None:
+            if self.local_alias and remaining_fraction <= self.local_below:
+                return self.local_alias, "budget_critical"
+            if remaining_fraction <= self.budget_pressure:
+                return self.cheap_alias, "budget_pressure"
+        if history_tokens > self.max_history_tokens:
+            return self.alias, "long_history"
+        last = _last_content(messages)
+        if self.code_role or self.code_re.search(last):
+            return self.alias, "code_expected"
+        if len(last) <= self.short_chars:
+            return self.cheap_alias, "short_turn"
+        return self.alias, "default"
+
+def _last_content(messages):
+    for message in reversed(messages or []):
+        if message.get("role") == "system":
+            continue
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content or ""
+    return ""
+
+def create_model_selector(secrets_config, alias, agent_name=None):
+    """
+    secrets/config.json 的 model_selection 段
+    未启用、该别名没有降级目标或角色被固定时返回 None
+    """
+    cfg = (secrets_config or {}).get("model_selection", {})
+    if not cfg.get("enabled", False) or agent_name in cfg.get("pinned_roles", ()):
+        return None
+    models = (secrets_config or {}).get("models", {})
+    cheap_alias = cfg.get("downgrade", {}).get(alias)
+    if cheap_alias not in models or cheap_alias == alias:
+        return None
+    local_alias = cfg.get("local_model")
+    if local_alias not in models:
+        local_alias = None
+    return ModelSelector(alias, cheap_alias, local_alias, agent_name, cfg)
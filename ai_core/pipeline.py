@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: GroupChat Hook 副作用后台流水线，对话线程只负责入队。
+
+import queue
+import threading
+import time
+import zlib
+
+_STOP = object()
+
+class SideEffectPipeline:
+    """
+    副作用流水线 (日志落盘、代码提取、Git 提交等)
+    - 有界队列 + 后台线程，对话线程只付出一次入队的代价
+    - 同一 key (工作区) 的任务固定分配到同一个 worker，保证执行顺序
+    - 队列满时 submit() 阻塞，形成背压
+    - drain()/close() 在会话结束时确定性地等待所有任务完成
+    - enabled=False 时退化为同步执行，行为与原 Hook 一致
+    """
+
+    def __init__(self, enabled=False, workers=1, queue_size=64, name="side-effects"):
+        """
+        :param enabled: 是否启用后台执行
+        :param workers: 后台线程数 (按 key 分片)
+        :param queue_size: 每个 worker 的队列容量
+        :param name: 线程名前缀
+        """
+        self.enabled = enabled
+        self.submitted = 0
+        self.completed = 0
+        self.errors = []
+        self.blocked_seconds = 0.0  # 因队列满而阻塞的累计时间
+        self._stats_lock = threading.Lock()
+        self._queues = []
+        self._threads = []
+
+        if enabled:
+            for i in range(max(1, workers)):
+                q = queue.Queue(maxsize=max(1, queue_size))
+                t = threading.Thread(target=self._worker, args=(q,), name=f"{name}-{i}", daemon=True)
+                self._queues.append(q)
+                self._threads.append(t)
+                t.start()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        提交一个副作用任务
+        :param key: 排序键 (通常为工作区路径)，同 key 任务按提交顺序执行
+        """
+        with self._stats_lock:
+            self.submitted += 1
+
+        if not self.enabled:
+            self._run(fn, args, kwargs)
+            return
+
+        q = self._queues[zlib.crc32(str(key).encode("utf-8")) % len(self._queues)]
+        try:
+            q.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            start = time.perf_counter()
+            q.put((fn, args, kwargs))
+            with self._stats_lock:
+                self.blocked_seconds += time.perf_counter() - start
+
+    def drain(self):
+        """等待已提交的任务全部完成"""
+        for q in self._queues:
+            q.join()
+
+    def close(self):
+        """排空队列并停止后台线程"""
+        if not self._threads:
+            return
+        self.drain()
+        for q in self._queues:
+            q.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def get_stats(self):
+        """获取流水线统计"""
+        with self._stats_lock:
+            return {
+                "enabled": self.enabled,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": len(self.errors),
+                "blocked_seconds": round(self.blocked_seconds, 4),
+            }
+
+    def _run(self, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            with self._stats_lock:
+                self.errors.append(repr(e))
+            print(f"⚠️ Side-effect task failed: {e}")
+        finally:
+            with self._stats_lock:
+                self.completed += 1
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                fn, args, kwargs = item
+                self._run(fn, args, kwargs)
+            finally:
+                q.task_done()
+
+def create_pipeline(secrets_config, enabled=None):
+    """
+    根据 secrets/config.json 中的 pipeline 段创建流水线 (默认同步)
+    :param enabled: 非 None 时覆盖配置中的 enabled
+    """
+    cfg = (secrets_config or {}).get("pipeline", {})
+    if enabled is None:
+        enabled = cfg.get("enabled", False)
+    return SideEffectPipeline(
+        enabled=enabled,
+        workers=cfg.get("workers", 1),
+        queue_size=cfg.get("queue_size", 64),
+    )
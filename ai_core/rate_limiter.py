@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 去掉字符数/3 的 token 预估，调用方统一使用 token_tracker 的 TokenEstimator。
+
+import threading
+import time
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# 批量进程池模式下，每个子进程只分得配置速率的一部分
+_rate_share = 1.0
+
+def set_rate_share(share):
+    """设置本进程可用的速率比例 (进程池中为 1/workers)"""
+    global _rate_share
+    _rate_share = max(0.01, min(1.0, share))
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """距离可以取出 amount 个令牌还需等待的秒数"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+class RateLimiter:
+    """
+    单个 key (模型别名或 base_url) 的限流器
+    - rpm: 每分钟请求数；tpm: 每分钟 token 数 (按预估值扣减，调用结束后按实际用量修正)
+    - 等待者按到达顺序 (ticket) 依次放行，跨 Agent、跨会话公平
+    - 记录等待时间统计
+    """
+
+    def __init__(self, key, rpm=None, tpm=None):
+        self.key = key
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()  # 等待中被中断的 ticket
+        self._paused_until = 0.0
+
+        # 等待统计
+        self.calls = 0
+        self.waited_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _wait_time(self, tokens, now):
+        wait = max(0.0, self._paused_until - now)
+        if self.requests:
+            self.requests.refill(now)
+            wait = max(wait, self.requests.wait_time(1))
+        if self.token_bucket and tokens:
+            self.token_bucket.refill(now)
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        """
+        阻塞直到本次调用可以发出
+        :param tokens: 预估的 token 数 (输入 + 预期输出)
+        :return: 等待秒数
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            try:
+                while True:
+                    if ticket == self._serving:
+                        wait = self._wait_time(tokens, time.monotonic())
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._abandoned.add(ticket)
+                self._advance()
+                raise
+
+            if self.requests:
+                self.requests.tokens -= 1
+            if self.token_bucket and tokens:
+                self.token_bucket.tokens -= min(tokens, self.token_bucket.capacity)
+            self._serving += 1
+            self._advance()
+
+            waited = time.monotonic() - start
+            self.calls += 1
+            if waited > 0.001:
+                self.waited_calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def _advance(self):
+        """跳过已放弃的 ticket 并唤醒等待者 (需持有锁)"""
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
+        self._cond.notify_all()
+
+    def reconcile(self, estimated, actual):
+        """按实际 token 用量修正预扣额度 (允许透支，后续调用相应等待)"""
+        if not self.token_bucket or actual is None:
+            return
+        with self._cond:
+            self.token_bucket.tokens = min(self.token_bucket.capacity, self.token_bucket.tokens - (actual - estimated))
+
+    def pause(self, seconds):
+        """服务端返回 429 时暂停放行"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "calls": self.calls,
+                "waited_calls": self.waited_calls,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "avg_wait_seconds": round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                "max_wait_seconds": round(self.max_wait, 3),
+            }
+
+def get_rate_limiter(secrets_config, alias=None, base_url=None):
+    """
+    获取共享限流器：rate_limits 中先按模型别名、再按 base_url 查找配置
+    未配置时返回 None
+    """
+    limits = (secrets_config or {}).get("rate_limits", {})
+    key = alias if alias in limits else base_url if base_url in limits else None
+    if key is None:
+        return None
+    cfg = limits[key]
+    rpm = cfg.get("rpm")
+    tpm = cfg.get("tpm")
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(
+                key,
+                rpm=rpm * _rate_share if rpm else None,
+                tpm=tpm * _rate_share if tpm else None,
+            )
+            _limiters[key] = limiter
+        return limiter
+
+def get_rate_limit_stats():
+    """所有限流器的等待统计 {key: stats}"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.key: limiter.get_stats() for limiter in limiters}
@@ -1,23 +1,33 @@
-# 版本: v1.2
+# 版本: v3.7
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-29
-# 总结: 集成日志系统和 Token 追踪，支持预算控制和成本监控。
+# 日期: 2026-10-18
+# 总结: 会话收尾时释放进程内的工作区状态 (release_workspace_state)，批量异步运行不再保留每个项目的索引与内容哈希。
 
+import asyncio
 import os
-import autogen
-import json
+from typing import Annotated
 from .base_agent import AgentFactory
-from .tools import init_workspace, save_code_to_file, save_log, extract_and_save_code
+from .tools import (
+    init_workspace, save_code_to_file, read_workspace_file, save_log, extract_and_save_code,
+    enable_commit_coalescing, flush_workspace, get_log_writer, get_write_stats, get_workspace_state,
+    pop_edit_errors, release_workspace_state,
+)
 from .logger import WorkflowLogger
-from .token_tracker import TokenTracker
+from .token_tracker import TokenTracker, BudgetExceededError
+from .pipeline import create_pipeline
+from .speaker_selector import SELECTOR_NAME, LLMSpeakerSelector, create_speaker_selector
+from .context_compactor import create_context_compactor
+from .tracing import span, traced, tracing_enabled
+from .session_archive import get_session_archive
+from .checkpoint import create_checkpoint, load_checkpoint, restore_workspace
+from .config_service import ConfigError, get_config_service
+from .streaming import StreamInterruptedError, create_stream_sink
+from .workspace_index import get_workspace_index
 
 def load_text_file(filepath):
-    """通用文件读取"""
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    return ""
+    """通用文件读取 (经配置服务缓存，文件修改后自动重新读取)"""
+    return get_config_service().prompt(filepath)
 
 def load_prompt(filename):
     """加载 prompts 目录下的 Markdown 文件 (Legacy Support)"""
@@ -25,13 +35,276 @@ def load_prompt(filename):
     path = os.path.join(base_dir, "prompts", filename)
     return load_text_file(path)
 
-def run_company(company_config_path, task_content, work_dir):
+class CompanySession:
     """
-    运行基于 JSON 配置定义的 AI 公司
-    集成日志系统和 Token 追踪
+    一次公司群聊会话的运行时对象 (run_company / run_company_async 共用)
+    """
+
+    def __init__(self, work_dir, logger, tracker, pipeline, user_proxy, manager, checkpoint=None):
+        self.work_dir = work_dir
+        self.logger = logger
+        self.tracker = tracker
+        self.pipeline = pipeline
+        self.user_proxy = user_proxy
+        self.manager = manager
+        self.checkpoint = checkpoint
+        self.max_round = manager.groupchat.max_round
+        self.stream_interruptions = 0
+
+    @traced("session.finish", "setup")
+    def finish(self, status="finished"):
+        """
+        会话收尾：排空流水线、提交剩余变更、保存报告
+        :param status: 写入检查点的会话状态，interrupted 的会话可以 --resume 续跑
+        :return: TokenTracker 摘要，附 workspace_writes (文件写入统计)
+        """
+        logger, tracker, work_dir = self.logger, self.tracker, self.work_dir
+        
+        # 保存报告
+        logger.info("✅ 工作会话结束")
+        print("✅ Work Session Finished.")
+        
+        # 先排空流水线 (包括逐轮检查点)，再提交剩余变更
+        self.pipeline.close()
+        logger.info(f"副作用流水线统计: {self.pipeline.get_stats()}")
+        if self.checkpoint is not None:
+            self.checkpoint.mark(status, tracker.stop_reason)
+        git_stats = flush_workspace(work_dir)
+        logger.info(f"Git 提交统计: {git_stats}")
+        write_stats = get_write_stats(work_dir)
+        logger.info(f"文件写入统计: {write_stats}")
+        index = get_workspace_state(work_dir).index
+        if index is not None:
+            logger.info(f"工作区索引统计: {index.get_stats()}")
+        print(f"💾 Files written: {write_stats['written']}, unchanged (skipped): {write_stats['skipped_unchanged']}")
+        if write_stats["edits_applied"] or write_stats["edits_failed"]:
+            print(f"🩹 Edits applied: {write_stats['edits_applied']}, failed: {write_stats['edits_failed']}, "
+                  f"~{write_stats['edit_tokens_saved_est']} output tokens saved vs full rewrites")
+        release_workspace_state(work_dir)
+        
+        # 打印和保存 Token 使用报告
+        tracker.close_telemetry()
+        tracker.print_summary()
+        report_path = tracker.save_report()
+        logger.info(f"Token 使用报告已保存: {report_path}")
+        print(f"📊 Token usage report saved: {report_path}")
+        # 工作区状态已释放，写入统计随摘要返回
+        return dict(tracker.get_summary(), workspace_writes=write_stats)
+
+def _archive_speaker_selection(groupchat):
+    """
+    录制时记下每次选出的发言人；回放时按录制顺序返回，不再调用选择逻辑
+    (auto 模式的模型调用同时由 CyberModelClient 录制，回放时不会发生)
+    """
+    archive = get_session_archive()
+    if archive is None:
+        return
+    select, a_select = groupchat.select_speaker, groupchat.a_select_speaker
+    
+    def recorded_speaker():
+        name = archive.next_speaker() if archive.replaying else None
+        if name is None:
+            return None
+        try:
+            return groupchat.agent_by_name(name)
+        except ValueError:
+            return None
+    
+    def archived_select(last_speaker, selector):
+        speaker = recorded_speaker() or select(last_speaker, selector)
+        if speaker is not None and not archive.replaying:
+            archive.record_speaker(speaker.name)
+        return speaker
+    
+    async def archived_a_select(last_speaker, selector):
+        speaker = recorded_speaker() or await a_select(last_speaker, selector)
+        if speaker is not None and not archive.replaying:
+            archive.record_speaker(speaker.name)
+        return speaker
+    
+    groupchat.select_speaker = archived_select
+    groupchat.a_select_speaker = archived_a_select
+
+def _trace_speaker_selection(groupchat):
+    """追踪开启时为发言人选择计时 (包括 auto 模式下的 LLM 选择调用)"""
+    if not tracing_enabled():
+        return
+    select, a_select = groupchat.select_speaker, groupchat.a_select_speaker
+    
+    def traced_select(last_speaker, selector):
+        with span("speaker.select", "chat"):
+            return select(last_speaker, selector)
+    
+    async def traced_a_select(last_speaker, selector):
+        with span("speaker.select", "chat"):
+            return await a_select(last_speaker, selector)
+    
+    groupchat.select_speaker = traced_select
+    groupchat.a_select_speaker = traced_a_select
+
+def _offload_speaker_selection(groupchat):
+    """
+    异步模式：发言人选择整体放到线程中执行
+    speaker_selection_method 回调是同步的，LLMSpeakerSelector 的模型调用不能阻塞事件循环
+    """
+    select = groupchat.select_speaker
+    
+    async def threaded_a_select(last_speaker, selector):
+        return await asyncio.to_thread(select, last_speaker, selector)
+    
+    groupchat.a_select_speaker = threaded_a_select
+
+def _restore_history(session, state):
+    """
+    把检查点中的消息装回群聊 (AutoGen GroupChatManager.resume)，返回 (续跑发起者, 最后一条消息)
+    - 恢复的消息不经过 Hook (日志、代码提取、计数都已在原会话完成)
+    - 最后一条消息由发起者重新发出，其 append 同样跳过 Hook
+    - 剩余轮次 = 最大轮次 - 已完成轮次
+    """
+    manager = session.manager
+    groupchat = manager.groupchat
+    messages = state["messages"]
+    hooked_append = groupchat.append
+    raw_append = hooked_append.raw_append
+    
+    def skip_once(message, speaker):
+        groupchat.append = hooked_append
+        raw_append(message, speaker)
+    
+    groupchat.append = raw_append
+    try:
+        last_agent, last_message = manager.resume(messages=messages)
+    finally:
+        groupchat.append = skip_once
+    groupchat.max_round = max(1, groupchat.max_round - (len(messages) - 1))
+    session.logger.info(f"从检查点续跑: 已完成 {state['round']} 轮, 剩余最多 {groupchat.max_round} 轮, 发起者 {last_agent.name if last_agent else '-'}")
+    print(f"⏯️  Resuming after round {state['round']} (up to {groupchat.max_round} more rounds)")
+    return last_agent or session.user_proxy, last_message
+
+# 同一会话最多容忍的流式中断次数，超过后结束会话 (状态 interrupted，可 --resume)
+MAX_STREAM_INTERRUPTIONS = 3
+
+def _continue_after_interruption(session, error):
+    """
+    流式回复中途失败 (已有代码块写入，不能换端点重新生成)：只作废这一轮，从群聊现有消息继续
+    - 失败的回复没有进入群聊；清空群聊与各 Agent 的历史后按现有消息重新装入 (与 --resume 相同)
+    - 已写入的代码块保留在工作区，随下一轮一起提交
+    :return: (继续发起者, 最后一条消息)
+    """
+    session.stream_interruptions += 1
+    if session.stream_interruptions > MAX_STREAM_INTERRUPTIONS or not session.manager.groupchat.messages:
+        raise error
+    session.logger.warning(f"⚠️ 流式回复中断，本轮作废 ({session.stream_interruptions}/{MAX_STREAM_INTERRUPTIONS}): {error}")
+    print(f"⚠️ Stream interrupted, dropping this turn and continuing "
+          f"({session.stream_interruptions}/{MAX_STREAM_INTERRUPTIONS}): {error}")
+    manager = session.manager
+    groupchat = manager.groupchat
+    messages = list(groupchat.messages)
+    groupchat.reset()
+    manager.clear_history()
+    for agent in groupchat.agents:
+        agent.clear_history()
+    groupchat.max_round = session.max_round
+    return _restore_history(session, {"messages": messages, "round": session.tracker.round_count})
+
+def _log_stream_stop(logger, error):
+    """流式中断次数超限：结束会话，已写入的代码块照常提交"""
+    logger.error(f"🛑 流式回复多次中断，对话结束: {error}")
+    print(f"🛑 Streaming kept failing ({MAX_STREAM_INTERRUPTIONS}+ interrupted turns), stopping: {error}")
+
+def _load_resume_state(work_dir):
+    """读取可续跑的检查点，已完成的会话返回 None"""
+    state = load_checkpoint(work_dir)
+    if state is None:
+        print(f"❌ No checkpoint found for {work_dir}")
+        return None
+    if state.get("status") == "finished":
+        print(f"ℹ️ Session already finished at round {state['round']}, nothing to resume")
+        return None
+    return state
+
+EDIT_FEEDBACK_NAME = "Workspace"
+
+def _attach_edit_feedback(agent, work_dir):
+    """增量编辑未能应用时，在作者下一次回复前把失败原因追加到发给模型的消息末尾 (只反馈一次，不进入群聊历史)"""
+    def add_edit_feedback(messages):
+        errors = pop_edit_errors(work_dir, agent.name)
+        if not errors:
+            return messages
+        lines = "\n".join(f"- {e}" for e in errors)
+        return list(messages) + [{
+            "role": "user",
+            "name": EDIT_FEEDBACK_NAME,
+            "content": f"⚠️ These edits from your previous reply were NOT applied (the files are unchanged):\n{lines}\n"
+                       "Re-read the affected lines (read_file) and resend a corrected edit, or send the full file.",
+        }]
+    agent.register_hook("process_all_messages_before_reply", add_edit_feedback)
+
+def _workspace_tools(work_dir, secrets_config):
+    """
+    secrets/config.json 的 workspace_index / read_file 段：向 Assistant 声明的工作区工具 {名称: (函数, 描述)}
+    索引在这里创建，之后每次写入都会增量更新；首次调用 list_workspace 时才扫描磁盘
+    """
+    secrets_config = secrets_config or {}
+    tools = {}
+    index_cfg = secrets_config.get("workspace_index", {})
+    if index_cfg.get("enabled", True):
+        index = get_workspace_index(work_dir)
+        max_entries = index_cfg.get("max_entries", 200)
+        max_symbols = index_cfg.get("max_symbols", 12)
+
+        def list_workspace(
+            path_prefix: Annotated[str, "Only list files under this path prefix, e.g. 'src/'. Empty for the whole workspace."] = "",
+        ) -> str:
+            return index.manifest(path_prefix, max_entries=max_entries, max_symbols=max_symbols)
+
+        tools["list_workspace"] = (
+            list_workspace,
+            "List workspace files, one line each: path, size, line count, sha1 prefix and top-level symbols. "
+            "Use it to see what already exists instead of asking others to paste files.",
+        )
+
+    read_cfg = secrets_config.get("read_file", {})
+    if read_cfg.get("enabled", True):
+        max_tokens = read_cfg.get("max_tokens", 2000)
+
+        def read_file(
+            filepath: Annotated[str, "Workspace-relative path, e.g. 'src/main.py'."],
+            start_line: Annotated[int, "First line to return (1-based). 0 = from the beginning."] = 0,
+            end_line: Annotated[int, "Last line to return (inclusive). 0 = as far as the token cap allows."] = 0,
+            pattern: Annotated[str, "Regex; when set, return only matching lines with line numbers."] = "",
+            offset: Annotated[int, "Byte offset for a byte-range read (used when length > 0)."] = 0,
+            length: Annotated[int, "Number of bytes for a byte-range read. 0 = line mode."] = 0,
+        ) -> str:
+            return read_workspace_file(
+                work_dir, filepath,
+                start_line=start_line or None, end_line=end_line or None,
+                offset=offset if length > 0 else None, length=length or None,
+                pattern=pattern or None, max_tokens=max_tokens,
+            )
+
+        tools["read_file"] = (
+            read_file,
+            f"Read a workspace file. Lines come prefixed with 'N| '. Output is capped at about {max_tokens} tokens; "
+            "the truncation note tells where to continue. Prefer pattern or a line range on large files.",
+        )
+    return tools
+
+@traced("company.build", "setup")
+def _build_company(company_config_path, work_dir, budget_limit=None, background_hooks=None,
+                   task_content=None, resume_state=None):
+    """
+    初始化工作区并按 JSON 配置组建公司
+    :param background_hooks: 非 None 时覆盖 pipeline.enabled (异步模式强制后台执行)
+    :param task_content: 任务描述，写入检查点供 --resume 使用
+    :param resume_state: 检查点内容，非 None 时恢复工作区与各项统计
+    :return: CompanySession (配置加载失败时为 None)
     """
     # 1. 环境初始化
     init_workspace(work_dir)
+    if resume_state is not None and restore_workspace(work_dir, resume_state.get("git_head")):
+        print(f"⏪ Workspace restored to checkpoint commit {resume_state['git_head'][:10]}")
+    committer = enable_commit_coalescing(work_dir)
     
     # 提取项目名称
     project_name = os.path.basename(os.path.dirname(work_dir))
@@ -45,11 +318,10 @@ def run_company(company_config_path, task_content, work_dir):
     print(f"🏢 Loading Company Config: {company_config_path}")
     print(f"📝 Log file: {logger.get_log_path()}")
     
-    # 2. 读取配置
+    # 2. 读取配置 (校验后的只读快照，同一文件未修改时各会话共享)
     try:
-        with open(company_config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-    except Exception as e:
+        config = get_config_service().company(company_config_path)
+    except ConfigError as e:
         logger.error(f"加载配置失败: {e}")
         print(f"❌ Failed to load company config: {e}")
         return
@@ -62,11 +334,31 @@ def run_company(company_config_path, task_content, work_dir):
     budget_cfg = secrets_config.get("budget_control", {})
     budget_enabled = budget_cfg.get("enabled", False)
     max_cost = budget_cfg.get("max_cost_cny") if budget_enabled else None
+    if budget_limit is not None:
+        budget_enabled = True
+        max_cost = budget_limit if max_cost is None else min(max_cost, budget_limit)
     max_rounds = budget_cfg.get("max_rounds", 30)
     warning_threshold = budget_cfg.get("warning_threshold", 0.8)
     
-    tracker = TokenTracker(project_name, budget_limit=max_cost)
+    tracker = TokenTracker(
+        project_name,
+        budget_limit=max_cost,
+        hard_limit=budget_cfg.get("hard_stop", True),
+        reserve_output_tokens=budget_cfg.get("reserve_output_tokens", 0),
+    )
+    tracker.enable_telemetry(secrets_config.get("telemetry", {}))
+    tracker.estimator.configure(secrets_config.get("token_estimator", {}))
+    if resume_state is not None:
+        tracker.restore_state(resume_state.get("tracker", {}))
+    factory.tracker = tracker
+    checkpoint = create_checkpoint(secrets_config, work_dir, company_config_path, task_content)
+    pipeline = create_pipeline(secrets_config, enabled=background_hooks)
+    factory.stream_sink = create_stream_sink(secrets_config, work_dir, pipeline)
+    log_cfg = secrets_config.get("workspace_logs", {})
+    get_log_writer(work_dir, transcript=log_cfg.get("transcript", False))
     logger.info(f"预算控制: {'启用' if budget_enabled else '禁用'}")
+    logger.info(f"副作用流水线: {'后台' if pipeline.enabled else '同步'}")
+    logger.info(f"流式输出: {'启用' if factory.stream_sink is not None else '禁用'}")
     if budget_enabled:
         logger.info(f"最大成本: ¥{max_cost}, 最大轮次: {max_rounds}")
     
@@ -77,7 +369,11 @@ def run_company(company_config_path, task_content, work_dir):
         success, msg = save_code_to_file(work_dir, filepath, content)
         logger.info(f"保存文件: {filepath} - {'成功' if success else '失败'}")
         return msg
-    user_proxy.register_function(function_map={"save_file": save_file})
+    workspace_tools = _workspace_tools(work_dir, secrets_config)
+    user_proxy.register_function(function_map={
+        "save_file": save_file,
+        **{tool_name: func for tool_name, (func, _) in workspace_tools.items()},
+    })
     
     agents = [user_proxy]
     
@@ -108,7 +404,8 @@ def run_company(company_config_path, task_content, work_dir):
         agent = factory.create_assistant(
             name=name,
             system_message=sys_msg,
-            model_alias=model_alias
+            model_alias=model_alias,
+            tools=workspace_tools,
         )
         agents.append(agent)
         
@@ -121,17 +418,51 @@ def run_company(company_config_path, task_content, work_dir):
     
     logger.info(f"群聊配置: 最大轮次={effective_max_round}, 发言选择={speaker_method}")
     
+    # 上下文压缩只作用于发给模型的消息 (UserProxy 不调用模型)
+    compactor = create_context_compactor(process_cfg, work_dir, factory, tracker=tracker)
+    if compactor is not None:
+        if resume_state is not None:
+            compactor.restore_state(resume_state.get("compactor"))
+        for agent in agents[1:]:
+            compactor.attach(agent)
+        logger.info(f"上下文压缩: 保留最近 {compactor.keep_last} 条原文, 每 {compactor.summary_chunk} 条滚动摘要")
+    # 在压缩之后注册，反馈始终位于消息末尾且不会被摘要
+    for agent in agents[1:]:
+        _attach_edit_feedback(agent, work_dir)
+    
+    import autogen
     groupchat = autogen.GroupChat(
         agents=agents,
         messages=[],
         max_round=effective_max_round,
-        speaker_selection_method=speaker_method
+        speaker_selection_method=create_speaker_selector(
+            process_cfg, tracker=tracker,
+            llm_selector=LLMSpeakerSelector(factory.create_model_client(name=SELECTOR_NAME)),
+        )
     )
     
     # 6. Hook for logging, parsing and token tracking
     original_append = groupchat.append
     budget_exceeded = False
     
+    @traced("hook.side_effects", "hook")
+    def handle_side_effects(sender, content, round_num, streamed_blocks=None):
+        """磁盘/子进程相关的副作用，可在后台线程执行"""
+        # 日志记录
+        with span("logger.write", "io"):
+            logger.agent_message(sender, content)
+        save_log(work_dir, sender, content)
+        
+        # 代码提取 (流式输出时已保存/应用的代码块跳过，增量编辑不会应用两次)
+        saved_files = extract_and_save_code(work_dir, content, sender, skip_blocks=streamed_blocks)
+        if saved_files:
+            logger.info(f"提取并保存 {len(saved_files)} 个文件: {saved_files}")
+            print(f"✅ Extracted & Saved {len(saved_files)} files: {saved_files}")
+        
+        # 本轮所有写入合并为一次提交 (包括 save_file 工具调用)
+        committer.commit(round_num=round_num, author=sender)
+    
+    @traced("hook.append", "hook")
     def logged_append(message, speaker):
         nonlocal budget_exceeded
         
@@ -139,17 +470,12 @@ def run_company(company_config_path, task_content, work_dir):
         sender = message.get("name", "Unknown")
         content = message.get("content", "")
         
-        # 日志记录
-        logger.agent_message(sender, content)
-        save_log(work_dir, sender, content)
-        
-        # 代码提取
-        saved_files = extract_and_save_code(work_dir, content)
-        if saved_files:
-            logger.info(f"提取并保存 {len(saved_files)} 个文件: {saved_files}")
-            print(f"✅ Extracted & Saved {len(saved_files)} files: {saved_files}")
+        # 副作用入队 (流水线未启用时同步执行)；流式已处理的块在入队前取走，不会与下一条回复混淆
+        streamed_blocks = factory.stream_sink.take_handled(sender) if factory.stream_sink is not None else None
+        pipeline.submit(work_dir, handle_side_effects, sender, content, tracker.round_count + 1, streamed_blocks)
         
         # Token 追踪（尝试从 message 中提取 usage 信息）
+        # 纯内存操作，保留在对话线程以便预算检查即时生效
         usage = message.get("usage")
         if usage:
             model_name = message.get("model", "unknown")
@@ -169,41 +495,140 @@ def run_company(company_config_path, task_content, work_dir):
                 budget_exceeded = True
                 logger.warning(f"⚠️ 预算已超限! 当前成本: ¥{tracker.total_cost:.4f}")
                 print(f"⚠️ Budget exceeded! Current cost: ¥{tracker.total_cost:.4f}")
-                # 可以选择强制终止
-                # raise Exception("Budget limit exceeded")
+                # 硬限制 (hard_stop) 由 CyberModelClient 在下一次调用前执行，抛出 BudgetExceededError
             elif remaining is not None and remaining < max_cost * (1 - warning_threshold):
                 logger.warning(f"预算警告: 剩余 ¥{remaining:.4f}")
+        
+        # 检查点排在本轮副作用之后，记录的 Git HEAD 已包含本轮文件
+        if checkpoint is not None:
+            pipeline.submit(
+                work_dir, checkpoint.save_round, tracker.round_count, list(groupchat.messages), sender,
+                tracker.export_state(), compactor.export_state() if compactor is not None else None,
+            )
             
+    logged_append.raw_append = original_append
     groupchat.append = logged_append
+    _archive_speaker_selection(groupchat)
+    _trace_speaker_selection(groupchat)
     
+    # 模型选择发言人已由 LLMSpeakerSelector 负责，这里的 llm_config 不再用于付费调用
     manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=factory._get_llm_config())
     
-    logger.info("🚀 公司开始工作...")
+    return CompanySession(work_dir, logger, tracker, pipeline, user_proxy, manager, checkpoint=checkpoint)
+
+def _log_budget_stop(logger, error):
+    """预算硬限制触发：对话在下一次付费调用前结束，已有成果照常保存"""
+    logger.warning(f"🛑 预算硬限制触发，对话提前结束: {error}")
+    print(f"🛑 Budget limit reached, stopping before the next paid call: {error}")
+
+def run_company(company_config_path, task_content, work_dir, budget_limit=None, resume=False):
+    """
+    运行基于 JSON 配置定义的 AI 公司
+    集成日志系统和 Token 追踪
+    :param budget_limit: 额外的成本上限 (元)，与配置中的 max_cost_cny 取较小值
+    :param resume: 从 work_dir 的检查点续跑 (消息、统计与工作区恢复到最后完成的一轮)
+    :return: TokenTracker 摘要 (配置加载失败或没有可续跑的检查点时为 None)
+    """
+    resume_state = _load_resume_state(work_dir) if resume else None
+    if resume and resume_state is None:
+        return None
+    session = _build_company(company_config_path, work_dir, budget_limit=budget_limit,
+                             task_content=task_content, resume_state=resume_state)
+    if session is None:
+        return None
+    
+    session.logger.info("🚀 公司开始工作...")
     print("🚀 Company Started Working...")
     
+    status = "finished"
     try:
-        user_proxy.initiate_chat(manager, message=task_content)
+        with span("chat", "chat"):
+            if resume_state is not None:
+                sender, message = _restore_history(session, resume_state)
+            else:
+                sender, message = session.user_proxy, task_content
+            clear_history = resume_state is None
+            while True:
+                try:
+                    sender.initiate_chat(session.manager, message=message, clear_history=clear_history)
+                    break
+                except StreamInterruptedError as e:
+                    sender, message = _continue_after_interruption(session, e)
+                    clear_history = False
+    except BudgetExceededError as e:
+        _log_budget_stop(session.logger, e)
+        status = "interrupted"
+    except StreamInterruptedError as e:
+        _log_stream_stop(session.logger, e)
+        status = "interrupted"
     except Exception as e:
-        logger.error(f"执行异常: {e}")
+        session.logger.error(f"执行异常: {e}")
         print(f"❌ Execution Error: {e}")
+        status = "interrupted"
     finally:
-        # 保存报告
-        logger.info("✅ 工作会话结束")
-        print("✅ Work Session Finished.")
-        
-        # 打印和保存 Token 使用报告
-        tracker.print_summary()
-        report_path = tracker.save_report()
-        logger.info(f"Token 使用报告已保存: {report_path}")
-        print(f"📊 Token usage report saved: {report_path}")
+        summary = session.finish(status)
+    return summary
+
+async def run_company_async(company_config_path, task_content, work_dir, budget_limit=None, resume=False):
+    """
+    run_company 的异步版本，基于 AutoGen 的 a_initiate_chat
+    - 多个公司可在同一事件循环中并发运行
+    - 模型调用由 AutoGen 放入线程池执行，Hook 副作用强制走后台流水线，不阻塞事件循环
+    - 组建与收尾涉及磁盘/子进程操作，放到线程中执行
+    :return: TokenTracker 摘要 (配置加载失败或没有可续跑的检查点时为 None)
+    """
+    resume_state = _load_resume_state(work_dir) if resume else None
+    if resume and resume_state is None:
+        return None
+    session = await asyncio.to_thread(
+        _build_company, company_config_path, work_dir, budget_limit, True, task_content, resume_state
+    )
+    if session is None:
+        return None
+    _offload_speaker_selection(session.manager.groupchat)
+    
+    session.logger.info("🚀 公司开始工作 (async)...")
+    print(f"🚀 Company Started Working (async): {work_dir}")
+    
+    status = "finished"
+    try:
+        with span("chat", "chat"):
+            if resume_state is not None:
+                sender, message = _restore_history(session, resume_state)
+            else:
+                sender, message = session.user_proxy, task_content
+            clear_history = resume_state is None
+            while True:
+                try:
+                    await sender.a_initiate_chat(session.manager, message=message, clear_history=clear_history)
+                    break
+                except StreamInterruptedError as e:
+                    sender, message = _continue_after_interruption(session, e)
+                    clear_history = False
+    except BudgetExceededError as e:
+        _log_budget_stop(session.logger, e)
+        status = "interrupted"
+    except StreamInterruptedError as e:
+        _log_stream_stop(session.logger, e)
+        status = "interrupted"
+    except Exception as e:
+        session.logger.error(f"执行异常: {e}")
+        print(f"❌ Execution Error: {e}")
+        status = "interrupted"
+    finally:
+        summary = await asyncio.to_thread(session.finish, status)
+    return summary
 
 
-def run_project(project_type, task_content, work_dir):
+def run_project(project_type, task_content, work_dir, budget_limit=None):
     """
     (Legacy) 运行基于硬编码类型的项目
     集成日志系统和 Token 追踪
+    :param budget_limit: 额外的成本上限 (元)，与配置中的 max_cost_cny 取较小值
+    :return: TokenTracker 摘要
     """
     init_workspace(work_dir)
+    committer = enable_commit_coalescing(work_dir)
     
     project_name = os.path.basename(os.path.dirname(work_dir))
     logger = WorkflowLogger(project_name)
@@ -219,8 +644,24 @@ def run_project(project_type, task_content, work_dir):
     budget_cfg = secrets_config.get("budget_control", {})
     budget_enabled = budget_cfg.get("enabled", False)
     max_cost = budget_cfg.get("max_cost_cny") if budget_enabled else None
+    if budget_limit is not None:
+        budget_enabled = True
+        max_cost = budget_limit if max_cost is None else min(max_cost, budget_limit)
     
-    tracker = TokenTracker(project_name, budget_limit=max_cost)
+    tracker = TokenTracker(
+        project_name,
+        budget_limit=max_cost,
+        hard_limit=budget_cfg.get("hard_stop", True),
+        reserve_output_tokens=budget_cfg.get("reserve_output_tokens", 0),
+    )
+    tracker.enable_telemetry(secrets_config.get("telemetry", {}))
+    tracker.estimator.configure(secrets_config.get("token_estimator", {}))
+    factory.tracker = tracker
+    if budget_enabled:
+        logger.info(f"预算控制: 最大成本 ¥{max_cost}, 硬限制: {tracker.hard_limit}")
+    pipeline = create_pipeline(secrets_config)
+    log_cfg = secrets_config.get("workspace_logs", {})
+    get_log_writer(work_dir, transcript=log_cfg.get("transcript", False))
     
     user_proxy = factory.create_user_proxy()
     
@@ -228,7 +669,11 @@ def run_project(project_type, task_content, work_dir):
         success, msg = save_code_to_file(work_dir, filepath, content)
         logger.info(f"保存文件: {filepath} - {'成功' if success else '失败'}")
         return msg
-    user_proxy.register_function(function_map={"save_file": save_file})
+    workspace_tools = _workspace_tools(work_dir, secrets_config)
+    user_proxy.register_function(function_map={
+        "save_file": save_file,
+        **{tool_name: func for tool_name, (func, _) in workspace_tools.items()},
+    })
     
     agents = [user_proxy]
     
@@ -236,28 +681,41 @@ def run_project(project_type, task_content, work_dir):
         print("🌐 Loading Web Team (Legacy Mode)...")
         logger.info("加载 Web 团队")
         sys_msg = load_prompt("web_expert.md")
-        web = factory.create_assistant("WebArchitect", sys_msg, model_alias="qwen_max")
+        web = factory.create_assistant("WebArchitect", sys_msg, model_alias="qwen_max", tools=workspace_tools)
         agents.append(web)
     elif project_type == "embedded":
         print("🔌 Loading Embedded Team (Legacy Mode)...")
         logger.info("加载嵌入式团队")
         sys_msg = load_prompt("embedded_expert.md")
-        emb = factory.create_assistant("EmbeddedEngineer", sys_msg)
-        rev = factory.create_assistant("CodeReviewer", "Review C Code specifically for safety.")
+        emb = factory.create_assistant("EmbeddedEngineer", sys_msg, tools=workspace_tools)
+        rev = factory.create_assistant("CodeReviewer", "Review C Code specifically for safety.", tools=workspace_tools)
         agents.append(emb)
         agents.append(rev)
+    for agent in agents[1:]:
+        _attach_edit_feedback(agent, work_dir)
         
-    groupchat = autogen.GroupChat(agents=agents, messages=[], max_round=15)
+    import autogen
+    groupchat = autogen.GroupChat(
+        agents=agents, messages=[], max_round=15,
+        speaker_selection_method=LLMSpeakerSelector(factory.create_model_client(name=SELECTOR_NAME)),
+    )
     
     original_append = groupchat.append
+    @traced("hook.side_effects", "hook")
+    def handle_side_effects(sender, content, round_num):
+        with span("logger.write", "io"):
+            logger.agent_message(sender, content)
+        save_log(work_dir, sender, content)
+        extract_and_save_code(work_dir, content, sender)
+        committer.commit(round_num=round_num, author=sender)
+    
+    @traced("hook.append", "hook")
     def logged_append(message, speaker):
         original_append(message, speaker)
         sender = message.get("name", "Unknown")
         content = message.get("content", "")
         
-        logger.agent_message(sender, content)
-        save_log(work_dir, sender, content)
-        extract_and_save_code(work_dir, content)
+        pipeline.submit(work_dir, handle_side_effects, sender, content, tracker.round_count + 1)
         
         # Token 追踪
         usage = message.get("usage")
@@ -270,15 +728,31 @@ def run_project(project_type, task_content, work_dir):
         tracker.increment_round()
             
     groupchat.append = logged_append
+    _archive_speaker_selection(groupchat)
+    _trace_speaker_selection(groupchat)
     manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=factory._get_llm_config())
     
     try:
-        user_proxy.initiate_chat(manager, message=task_content)
+        with span("chat", "chat"):
+            user_proxy.initiate_chat(manager, message=task_content)
+    except BudgetExceededError as e:
+        _log_budget_stop(logger, e)
     except Exception as e:
         logger.error(f"执行异常: {e}")
         print(f"❌ Execution Error: {e}")
     finally:
+        pipeline.close()
+        git_stats = flush_workspace(work_dir)
+        logger.info(f"Git 提交统计: {git_stats}")
+        logger.info(f"文件写入统计: {get_write_stats(work_dir)}")
+        index = get_workspace_state(work_dir).index
+        if index is not None:
+            logger.info(f"工作区索引统计: {index.get_stats()}")
+        release_workspace_state(work_dir)
+        tracker.close_telemetry()
         tracker.print_summary()
         report_path = tracker.save_report()
         logger.info(f"Token 使用报告已保存: {report_path}")
         print(f"📊 Token usage report saved: {report_path}")
+    
+    return tracker.get_summary()
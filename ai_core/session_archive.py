@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 会话录制与回放：把模型请求/响应与发言顺序存入单个 JSONL 归档，回放时不访问网络、不等待。
+
+import atexit
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+ARCHIVE_VERSION = 1
+
+_archive = None
+_archive_lock = threading.Lock()
+
+class ReplayExhaustedError(RuntimeError):
+    """回放时找不到可用的录制响应 (对话比录制时走得更远)"""
+
+class SessionRecorder:
+    """
+    录制模式：每次模型调用与每次发言人选择追加一行 JSON
+    - 第一行为会话元数据 {"type": "session", ...}
+    - {"type": "call", "agent", "alias", "key", "cached", "latency_s", "request", "response"}
+    - {"type": "speaker", "name"}
+    文件句柄在会话中保持打开，每行写入后 flush，进程中断时已录制的部分仍可回放
+    """
+
+    replaying = False
+
+    def __init__(self, path, **meta):
+        self.path = str(path)
+        self.calls = 0
+        self.speakers = 0
+        self._lock = threading.Lock()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._write({"type": "session", "version": ARCHIVE_VERSION, "created": round(time.time(), 3), **meta})
+
+    def _write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record_call(self, agent, alias, key, request, response, latency=0.0, cached=False):
+        """
+        :param key: 请求键 (llm_cache.make_cache_key)，回放时按它匹配
+        :param response: ChatCompletion.model_dump() 的结果
+        :param cached: 是否为响应缓存命中 (回放时同样按零成本计)
+        """
+        self.calls += 1
+        self._write({
+            "type": "call", "agent": agent, "alias": alias, "key": key, "cached": cached,
+            "latency_s": round(latency, 4), "request": request, "response": response,
+        })
+
+    def record_speaker(self, name):
+        self.speakers += 1
+        self._write({"type": "speaker", "name": name})
+
+    def get_stats(self):
+        return {"mode": "record", "path": self.path, "calls": self.calls, "speakers": self.speakers}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class SessionReplayer:
+    """
+    回放模式：按录制内容返回模型响应与发言顺序
+    - 优先按请求键精确匹配 (同一请求多次出现时按录制顺序)
+    - 请求有变化 (例如修改了提示词或 Hook 改写了消息) 时退回到该 Agent 的下一条录制响应，并计入 mismatches
+    """
+
+    replaying = True
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.meta = {}
+        self.mismatches = 0
+        self._calls = []
+        self._consumed = set()
+        self._by_key = defaultdict(deque)
+        self._by_agent = defaultdict(deque)
+        self._speakers = deque()
+        self._lock = threading.Lock()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                kind = entry.get("type")
+                if kind == "session":
+                    self.meta = entry
+                elif kind == "call":
+                    index = len(self._calls)
+                    self._calls.append(entry)
+                    self._by_key[entry.get("key")].append(index)
+                    self._by_agent[entry.get("agent")].append(index)
+                elif kind == "speaker":
+                    self._speakers.append(entry.get("name"))
+        self.total_calls = len(self._calls)
+        self.total_speakers = len(self._speakers)
+
+    def next_call(self, agent, key):
+        """返回录制的调用记录 (含 response、cached)，没有可用记录时抛出 ReplayExhaustedError"""
+        with self._lock:
+            index = self._take(self._by_key.get(key))
+            if index is None:
+                index = self._take(self._by_agent.get(agent))
+                if index is None:
+                    raise ReplayExhaustedError(
+                        f"No recorded response left for {agent or 'unknown agent'} "
+                        f"({len(self._consumed)}/{self.total_calls} replayed)")
+                self.mismatches += 1
+            self._consumed.add(index)
+            return self._calls[index]
+
+    def _take(self, indices):
+        while indices:
+            index = indices.popleft()
+            if index not in self._consumed:
+                return index
+        return None
+
+    def next_speaker(self):
+        """录制的下一位发言人名称，录制内容用完时返回 None"""
+        with self._lock:
+            return self._speakers.popleft() if self._speakers else None
+
+    def get_stats(self):
+        return {
+            "mode": "replay",
+            "path": self.path,
+            "calls": len(self._consumed),
+            "recorded_calls": self.total_calls,
+            "mismatches": self.mismatches,
+            "speakers": self.total_speakers - len(self._speakers),
+        }
+
+    def close(self):
+        pass
+
+def get_session_archive():
+    """当前进程的录制器/回放器，未开启时为 None"""
+    return _archive
+
+def start_recording(path, **meta):
+    """开启录制，meta 写入归档首行 (项目名、任务摘要等)"""
+    global _archive
+    with _archive_lock:
+        if _archive is not None:
+            _archive.close()
+        _archive = SessionRecorder(path, **meta)
+        atexit.register(_archive.close)
+        return _archive
+
+def start_replay(path):
+    global _archive
+    with _archive_lock:
+        if _archive is not None:
+            _archive.close()
+        _archive = SessionReplayer(path)
+        return _archive
+
+def finish_session_archive():
+    """关闭录制/回放，返回统计 (未开启时为 None)"""
+    global _archive
+    with _archive_lock:
+        archive, _archive = _archive, None
+    if archive is None:
+        return None
+    archive.close()
+    atexit.unregister(archive.close)
+    return archive.get_stats()
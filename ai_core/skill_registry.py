@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 技能注册表：从 ai_core/skills/*/SKILL.md 元数据发现技能，按需导入入口函数。
+
+import importlib
+import os
+import threading
+
+SKILLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "skills")
+SKILLS_PACKAGE = __package__ + ".skills"
+
+_skills = None
+_skills_lock = threading.Lock()
+
+class SkillSpec:
+    """
+    SKILL.md 头部元数据 (--- 之间的 key: value)
+    entry 格式为 "模块:函数"，模块相对于技能目录，例如 runner:generate_design_system
+    """
+
+    def __init__(self, slug, path, meta):
+        self.slug = slug
+        self.path = path
+        self.meta = meta
+        self.name = meta.get("name", slug)
+        self.description = meta.get("description", "")
+        self.version = meta.get("version", "")
+        module, _, function = meta.get("entry", "runner").partition(":")
+        self.module = f"{SKILLS_PACKAGE}.{slug}.{module}"
+        self.function = function or None
+
+    def __repr__(self):
+        return f"SkillSpec({self.slug!r}, entry={self.module}:{self.function})"
+
+def parse_front_matter(text):
+    """解析 Markdown 头部的 --- 元数据块 (只支持单行 key: value)"""
+    lines = text.splitlines()
+    if not lines or lines[0].strip() != "---":
+        return {}
+    meta = {}
+    for line in lines[1:]:
+        if line.strip() == "---":
+            break
+        key, sep, value = line.partition(":")
+        if sep and key.strip():
+            meta[key.strip()] = value.strip().strip('"').strip("'")
+    return meta
+
+def discover_skills(skills_dir=SKILLS_DIR):
+    """
+    扫描技能目录，只读取 SKILL.md，不导入任何技能代码
+    :return: {目录名: SkillSpec}
+    """
+    global _skills
+    if _skills is not None and skills_dir == SKILLS_DIR:
+        return _skills
+    skills = {}
+    for slug in sorted(os.listdir(skills_dir)) if os.path.isdir(skills_dir) else []:
+        skill_md = os.path.join(skills_dir, slug, "SKILL.md")
+        if not os.path.isfile(skill_md):
+            continue
+        with open(skill_md, "r", encoding="utf-8") as f:
+            skills[slug] = SkillSpec(slug, os.path.dirname(skill_md), parse_front_matter(f.read()))
+    if skills_dir == SKILLS_DIR:
+        with _skills_lock:
+            _skills = skills
+    return skills
+
+def get_skill(slug):
+    skill = discover_skills().get(slug)
+    if skill is None:
+        raise KeyError(f"Unknown skill: {slug} (available: {', '.join(discover_skills()) or 'none'})")
+    return skill
+
+def load_skill(slug, function=None):
+    """
+    导入技能模块并返回入口函数 (首次调用时才导入技能及其依赖)
+    :param function: 模块内的其他函数名，默认取 SKILL.md 的 entry
+    """
+    skill = get_skill(slug)
+    module = importlib.import_module(skill.module)
+    name = function or skill.function
+    if not name:
+        return module
+    return getattr(module, name)
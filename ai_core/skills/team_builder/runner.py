@@ -1,16 +1,13 @@
-# 版本: v1.1
+# 版本: v1.2
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-28
-# 总结: Team Builder 技能实现逻辑 (Refactored)
+# 日期: 2026-10-18
+# 总结: 改为包内相对导入，不再修改 sys.path (由 ai_core.skill_registry 按需加载)。
 
 import os
 import json
-import sys
 
-# 确保能找到 ai_core
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
-from ai_core.base_agent import AgentFactory
+from ...base_agent import AgentFactory
 
 def load_skill_prompt(filename):
     """加载技能专用的 Prompt"""
@@ -1,17 +1,13 @@
-# 版本: v1.1
-# 总结: 升级为 "AI决策 + 算法执行" 模式
+# 版本: v1.2
+# 总结: 改为包内相对导入，不再修改 sys.path (由 ai_core.skill_registry 按需加载)。
 
 import os
 import json
 import re
-import sys
 
 # 导入算法引擎
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from color_engine import generate_design_tokens
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
-from ai_core.base_agent import AgentFactory
+from .color_engine import generate_design_tokens
+from ...base_agent import AgentFactory
 
 def load_skill_prompt(filename):
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.2
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 规则选择省下的选择器 token 改用 TokenTracker 的估算器计算。
+
+import re
+
+# AutoGen 内置的发言选择方式，可作为 fallback
+BUILTIN_METHODS = ("auto", "round_robin", "random", "manual")
+# 发言人选择调用在遥测与 Token 报告中的调用方名称
+SELECTOR_NAME = "SpeakerSelector"
+
+def _is_tool_call(message):
+    return bool(message.get("tool_calls") or message.get("function_call"))
+
+class LLMSpeakerSelector:
+    """
+    由模型选择下一位发言人，替代 AutoGen 内置的 auto 选择
+    内置 auto 用 GroupChatManager 的 llm_config 新建内部 Agent 调用模型，绕过 CyberModelClient；
+    这里改用同一个 CyberModelClient，预算预检、限流、用量/成本记录与会话录制和 Assistant 的调用一致
+    - 提示词沿用 GroupChat 的 select_speaker_msg / select_speaker_prompt
+    - 回复中恰好提到一个角色名时选中该角色，否则按顺序轮到下一位 (与内置 auto 选择失败时相同)
+    """
+
+    def __init__(self, client):
+        """:param client: CyberModelClient (AgentFactory.create_model_client)"""
+        self.client = client
+
+    def __call__(self, last_speaker, groupchat):
+        messages = groupchat.messages
+        # 工具调用由框架的 func_call_filter 直接交给执行者，不调用模型
+        if messages and _is_tool_call(messages[-1]):
+            return "auto"
+        agents = groupchat.agents
+        request = {
+            "messages": [
+                {"role": "system", "content": groupchat.select_speaker_msg(agents)},
+                *(self._transcript_message(m) for m in messages),
+                {"role": "system", "content": groupchat.select_speaker_prompt(agents)},
+            ],
+            "temperature": 0,
+        }
+        response = self.client.create(request)
+        text = self.client.message_retrieval(response)[0]
+        mentioned = [a for a in agents if isinstance(text, str) and _mentions(text, a.name)]
+        if len(mentioned) == 1:
+            return mentioned[0]
+        return groupchat.next_agent(last_speaker, agents)
+
+    @staticmethod
+    def _transcript_message(message):
+        """群聊消息 -> 纯文本消息 (工具调用/结果不能脱离配对单独发送)"""
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = "" if content is None else str(content)
+        if _is_tool_call(message):
+            calls = message.get("tool_calls") or [{"function": message["function_call"]}]
+            names = ", ".join(c.get("function", {}).get("name", "?") for c in calls)
+            content = f"{content}\n[calls tool: {names}]".strip()
+        converted = {"role": "user", "content": content}
+        if message.get("name"):
+            converted["name"] = message["name"]
+        return converted
+
+def _mentions(text, name):
+    return re.search(rf"(?<!\w){re.escape(name)}(?!\w)", text) is not None
+
+class RuleBasedSpeakerSelector:
+    """
+    GroupChat 的 speaker_selection_method 回调 (AutoGen 0.2 callable 协议)
+    公司 JSON 的 process.speaker_rules 示例:
+    {
+        "start": "ProductManager",
+        "transitions": {
+            "ProductManager": {"next": ["ChiefArchitect"]},
+            "FullStackDev": {
+                "next": ["ChiefArchitect", "ProductManager"],
+                "triggers": [{"pattern": "需求|requirement", "next": "ProductManager"}],
+                "fallback": "ChiefArchitect"
+            }
+        },
+        "fallback": "auto"
+    }
+    解析顺序: 工具调用 -> 关键字/正则触发 -> 唯一候选 -> 角色 fallback -> 全局 fallback
+    全局 fallback 为 auto 时才会产生 LLM 选择调用
+    """
+
+    def __init__(self, rules, tracker=None, llm_selector=None):
+        """
+        :param rules: process.speaker_rules 配置
+        :param tracker: 可选 TokenTracker，记录本地解析/LLM 回退次数
+        :param llm_selector: 可选 LLMSpeakerSelector，全局 fallback 为 auto 时由它调用模型 (None 时交给 AutoGen)
+        """
+        self.start = rules.get("start")
+        self.fallback = rules.get("fallback", "auto")
+        self.tracker = tracker
+        self.llm_selector = llm_selector
+        self.transitions = {}
+        for name, rule in rules.get("transitions", {}).items():
+            self.transitions[name] = {
+                "next": list(rule.get("next", [])),
+                "triggers": [
+                    (re.compile(t["pattern"], re.IGNORECASE), t["next"])
+                    for t in rule.get("triggers", [])
+                ],
+                "fallback": rule.get("fallback"),
+            }
+
+    def __call__(self, last_speaker, groupchat):
+        messages = groupchat.messages
+        last = messages[-1] if messages else {}
+
+        # 工具调用交给框架的 func_call_filter (只有一个执行者时同样不调用 LLM)
+        if _is_tool_call(last):
+            return "auto"
+
+        # 工具结果返回给发起调用的 Agent
+        if last.get("role") in ("tool", "function") or last.get("tool_responses"):
+            caller = messages[-2].get("name") if len(messages) > 1 else None
+            return self._resolved(groupchat, self._agent(groupchat, caller)) or self._auto(last_speaker, groupchat)
+
+        selected = self._resolve(last_speaker.name, last.get("content") or "", groupchat)
+        if selected is not None:
+            return self._resolved(groupchat, selected)
+
+        if self.fallback == "auto":
+            return self._auto(last_speaker, groupchat)
+        if self.fallback in BUILTIN_METHODS:
+            return self.fallback
+        return self._resolved(groupchat, self._agent(groupchat, self.fallback)) or self._auto(last_speaker, groupchat)
+
+    def _auto(self, last_speaker, groupchat):
+        """规则无法确定时由模型选择"""
+        if self.tracker is not None:
+            self.tracker.track_speaker_selection(local=False)
+        if self.llm_selector is not None:
+            return self.llm_selector(last_speaker, groupchat)
+        return "auto"
+
+    def _resolve(self, speaker_name, content, groupchat):
+        """按规则解析下一位发言人，无法确定时返回 None"""
+        rule = self.transitions.get(speaker_name)
+        if rule is None:
+            # 没有转移规则的发言人 (通常是发起任务的 UserProxy) 之后由 start 指定的角色接手
+            return self._agent(groupchat, self.start)
+
+        if isinstance(content, str):
+            for pattern, target in rule["triggers"]:
+                if pattern.search(content):
+                    agent = self._agent(groupchat, target)
+                    if agent is not None:
+                        return agent
+
+        candidates = [a for a in (self._agent(groupchat, n) for n in rule["next"]) if a is not None]
+        if len(candidates) == 1:
+            return candidates[0]
+        if rule["fallback"]:
+            return self._agent(groupchat, rule["fallback"])
+        return None
+
+    def _resolved(self, groupchat, agent):
+        """记录一次本地解析，并估算省下的选择器 token"""
+        if agent is not None and self.tracker is not None:
+            estimator = self.tracker.estimator
+            roles = "\n".join(f"{a.name}: {a.description}" for a in groupchat.agents)
+            avoided = estimator.count_messages(groupchat.messages) + estimator.count_text(roles)[0]
+            self.tracker.track_speaker_selection(local=True, avoided_tokens=avoided)
+        return agent
+
+    @staticmethod
+    def _agent(groupchat, name):
+        if not name:
+            return None
+        for agent in groupchat.agents:
+            if agent.name == name:
+                return agent
+        return None
+
+def create_speaker_selector(process_cfg, tracker=None, llm_selector=None):
+    """
+    根据公司 JSON 的 process 段确定 speaker_selection_method
+    - "rules": RuleBasedSpeakerSelector (auto 回退交给 llm_selector)
+    - "auto": 给出 llm_selector 时返回它，否则原样返回
+    - 其余内置方式原样返回
+    """
+    method = process_cfg.get("speaker_selection_method", "auto")
+    if method == "rules":
+        return RuleBasedSpeakerSelector(process_cfg.get("speaker_rules", {}), tracker=tracker,
+                                        llm_selector=llm_selector)
+    if method == "auto" and llm_selector is not None:
+        return llm_selector
+    return method
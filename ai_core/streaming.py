@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.4
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: StreamInterruptedError 定义在此 (runner 据此只作废当前一轮)；去掉从未被读取的 MessageStream.saved_files。
+
+import sys
+import threading
+
+from .code_extractor import CodeBlockExtractor
+from .tools import save_code_block
+
+class StreamInterruptedError(RuntimeError):
+    """流式回复中途失败，且已有代码块写入工作区；换端点重新生成会重复应用这些写入，因此直接抛出"""
+
+class MessageStream:
+    """
+    单条流式回复
+    - feed: 每段文本到达时调用 (回显 + 增量解析)
+    - close: 回复完整结束，处理残留的半行
+    - abort: 调用失败，丢弃未闭合的代码块；已闭合的块已经写入 (blocks_submitted > 0)，此时不能再换端点重新生成
+    """
+
+    def __init__(self, sink, agent_name):
+        self.sink = sink
+        self.agent_name = agent_name
+        self.handled = set()  # 已提交保存的 (path, code)
+        self.blocks_submitted = 0
+        self._extractor = CodeBlockExtractor(on_block=self._on_block)
+        self._at_line_start = True
+        self._started = False
+
+    def _echo(self, text):
+        if not self.sink.echo:
+            return
+        with self.sink.console_lock:
+            if not self._started:
+                sys.stdout.write(f"\n💬 {self.agent_name} ▸ ")
+                self._started = True
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        self._at_line_start = text.endswith("\n")
+
+    def feed(self, text):
+        self._echo(text)
+        self._extractor.feed(text)
+
+    def _on_block(self, path, code):
+        if self.sink.echo and not self._at_line_start:
+            self._echo("\n")
+        self.blocks_submitted += 1
+        self.handled.add((path, code))
+        self.sink.submit(save_code_block, self.sink.work_dir, path, code, self.agent_name)
+
+    def close(self):
+        self._extractor.close()
+        if self._started and not self._at_line_start:
+            self._echo("\n")
+
+    def abort(self):
+        self._extractor = CodeBlockExtractor()
+        self.sink.discard(self)
+        if self._started:
+            self._echo("\n⚠️ (stream interrupted)\n")
+
+class StreamSink:
+    """
+    会话级流式出口，由 AgentFactory 传给每个 Assistant 的 CyberModelClient
+    :param submit: submit(fn, *args)，代码块保存的执行方式；传入副作用流水线时与本轮其他写入保持顺序
+    :param include_usage: 请求 stream_options.include_usage (不支持的兼容接口可关闭，用量改为本地估算)
+    """
+
+    def __init__(self, work_dir, echo=True, submit=None, include_usage=True):
+        self.work_dir = work_dir
+        self.echo = echo
+        self.include_usage = include_usage
+        self.submit = submit or (lambda fn, *args: fn(*args))
+        self.console_lock = threading.Lock()
+        self._handled = {}  # {Agent: 最近一条流式回复已处理的 (path, code) 集合}
+        self._handled_lock = threading.Lock()
+
+    def open(self, agent_name):
+        stream = MessageStream(self, agent_name)
+        with self._handled_lock:
+            self._handled[agent_name] = stream.handled
+        return stream
+
+    def discard(self, stream):
+        """回复失败 (不会进入群聊)，其代码块与之后的消息无关"""
+        with self._handled_lock:
+            if self._handled.get(stream.agent_name) is stream.handled:
+                del self._handled[stream.agent_name]
+
+    def take_handled(self, agent_name):
+        """取走该 Agent 最近一条流式回复已处理的代码块 (在这条消息加入群聊时调用一次)"""
+        with self._handled_lock:
+            return self._handled.pop(agent_name, None) or set()
+
+def create_stream_sink(secrets_config, work_dir, pipeline=None):
+    """secrets/config.json 的 streaming 段，未启用时返回 None"""
+    cfg = (secrets_config or {}).get("streaming", {})
+    if not cfg.get("enabled", False):
+        return None
+    submit = None
+    if pipeline is not None:
+        submit = lambda fn, *args: pipeline.submit(work_dir, fn, *args)
+    return StreamSink(work_dir, echo=cfg.get("echo", True), submit=submit,
+                      include_usage=cfg.get("include_usage", True))
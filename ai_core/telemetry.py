@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 逐次模型调用遥测：JSONL 批量追加 + 定期重写 Prometheus 文本快照。
+
+import atexit
+import json
+import os
+import threading
+import time
+
+class TelemetryWriter:
+    """
+    调用级遥测写入器
+    - 每次模型调用一条 JSON 记录，先进内存缓冲，满 flush_every 条或距上次刷新超过 flush_interval 秒时批量写入
+    - JSONL 文件句柄在整个会话中保持打开
+    - 后台线程每 snapshot_interval 秒刷新缓冲并原子重写 Prometheus 文本快照 (可 tail -f / 本地抓取)
+    - 进程正常退出或异常退出时 (atexit) 写出剩余缓冲
+    """
+
+    def __init__(self, jsonl_path, prom_path=None, project=None, flush_every=20,
+                 flush_interval=2.0, snapshot_interval=5.0):
+        """
+        :param jsonl_path: 调用记录 JSONL 路径
+        :param prom_path: Prometheus 文本快照路径，None 表示不输出
+        :param project: 写入指标标签的项目名
+        """
+        self.jsonl_path = str(jsonl_path)
+        self.prom_path = str(prom_path) if prom_path else None
+        self.project = project or ""
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.records = 0
+
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(self.jsonl_path, "a", encoding="utf-8")
+        self._started = time.time()
+        # 快照用的聚合指标 {(model, agent): {...}}
+        self._series = {}
+        self._gauges = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if self.prom_path and snapshot_interval > 0:
+            self._thread = threading.Thread(target=self._snapshot_loop, name="telemetry-snapshot", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, **fields):
+        """追加一条调用记录 (字段原样写入 JSONL)"""
+        fields.setdefault("ts", round(time.time(), 3))
+        with self._lock:
+            if self._file is None:
+                return
+            self._buffer.append(json.dumps(fields, ensure_ascii=False))
+            self.records += 1
+            self._aggregate(fields)
+            if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def set_gauge(self, name, value):
+        """设置会话级指标 (轮次、预算等)，随下一次快照输出"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """写出缓冲、输出最终快照并关闭文件 (可重复调用)"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.snapshot_interval + 1)
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush_locked()
+            self._file.close()
+            self._file = None
+        self.write_snapshot()
+        atexit.unregister(self.close)
+
+    def _flush_locked(self):
+        if self._buffer and self._file is not None:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._file.flush()
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def _aggregate(self, fields):
+        key = (fields.get("model") or "unknown", fields.get("agent") or "unknown")
+        s = self._series.setdefault(key, {
+            "calls": 0, "cached": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "cost": 0.0, "latency_sum": 0.0, "latency_max": 0.0, "ttft_sum": 0.0, "ttft_count": 0,
+        })
+        s["calls"] += 1
+        s["cached"] += 1 if fields.get("cached") else 0
+        s["errors"] += 1 if fields.get("error") else 0
+        s["prompt_tokens"] += fields.get("prompt_tokens") or 0
+        s["completion_tokens"] += fields.get("completion_tokens") or 0
+        s["cost"] += fields.get("cost_cny") or 0.0
+        latency = fields.get("latency_s") or 0.0
+        s["latency_sum"] += latency
+        s["latency_max"] = max(s["latency_max"], latency)
+        if fields.get("ttft_s") is not None:
+            s["ttft_sum"] += fields["ttft_s"]
+            s["ttft_count"] += 1
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.flush()
+            self.write_snapshot()
+
+    def render_snapshot(self):
+        """Prometheus 文本格式的当前指标"""
+        with self._lock:
+            series = {k: dict(v) for k, v in self._series.items()}
+            gauges = dict(self._gauges)
+        project = _escape(self.project)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join([f'project="{project}"'] + [f'{k}="{_escape(v)}"' for k, v in labels])
+                lines.append(f"{name}{{{label_str}}} {value}")
+
+        def per_series(field, fmt=lambda v: v):
+            return [((("model", m), ("agent", a)), fmt(s[field])) for (m, a), s in sorted(series.items())]
+
+        metric("cyber_llm_calls_total", "counter", "Model calls", per_series("calls"))
+        metric("cyber_llm_cached_calls_total", "counter", "Model calls served from the response cache", per_series("cached"))
+        metric("cyber_llm_errors_total", "counter", "Failed model calls", per_series("errors"))
+        tokens = []
+        for (m, a), s in sorted(series.items()):
+            tokens.append(((("model", m), ("agent", a), ("type", "prompt")), s["prompt_tokens"]))
+            tokens.append(((("model", m), ("agent", a), ("type", "completion")), s["completion_tokens"]))
+        metric("cyber_llm_tokens_total", "counter", "Tokens by type", tokens)
+        metric("cyber_llm_cost_cny_total", "counter", "Estimated cost in CNY", per_series("cost", lambda v: round(v, 6)))
+        metric("cyber_llm_latency_seconds_sum", "counter", "Total wall latency of model calls", per_series("latency_sum", lambda v: round(v, 4)))
+        metric("cyber_llm_latency_seconds_count", "counter", "Number of timed model calls", per_series("calls"))
+        metric("cyber_llm_latency_seconds_max", "gauge", "Slowest model call", per_series("latency_max", lambda v: round(v, 4)))
+        metric("cyber_llm_ttft_seconds_sum", "counter", "Total time to first token (streamed calls)", per_series("ttft_sum", lambda v: round(v, 4)))
+        metric("cyber_llm_ttft_seconds_count", "counter", "Number of streamed calls", per_series("ttft_count"))
+        metric("cyber_session_uptime_seconds", "gauge", "Seconds since the session started", [((), round(time.time() - self._started, 1))])
+        for name, value in sorted(gauges.items()):
+            metric(f"cyber_session_{name}", "gauge", name.replace("_", " "), [((), value)])
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self):
+        """原子重写快照文件 (先写临时文件再替换)"""
+        if not self.prom_path:
+            return
+        tmp_path = self.prom_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render_snapshot())
+            os.replace(tmp_path, self.prom_path)
+        except OSError as e:
+            print(f"⚠️ Failed to write metrics snapshot: {e}")
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
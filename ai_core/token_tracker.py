@@ -1,13 +1,179 @@
 # -*- coding: utf-8 -*-
-# 版本: v1.0
+# 版本: v2.4
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-29
-# 总结: Token 使用追踪和成本监控模块，支持预算控制和自动终止。
+# 日期: 2026-10-18
+# 总结: TokenEstimator 成为唯一的 token 估算入口：新增 count_request (限流预扣)，字节启发式的 BYTES_PER_TOKEN 供按字节截断的调用方共用。
 
+import copy
+import functools
+import hashlib
 import json
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from .model_router import percentile
+from .telemetry import TelemetryWriter
+
+class BudgetExceededError(RuntimeError):
+    """剩余预算不足以支付下一次模型调用"""
+
+# 检查点中保存/恢复的累计统计字段
+STATE_FIELDS = (
+    "usage", "total_cost", "estimated_cost", "cache_hits", "cache_misses", "rate_limit_waits",
+    "speaker_rule_selections", "speaker_llm_selections", "speaker_tokens_avoided",
+    "compaction_saved", "compaction_summaries", "round_count", "blocked_calls", "routes",
+    "model_selections", "ttft_samples", "ttft_calls",
+)
+
+# 报告中 p50/p95 使用的最近样本数 (样本随检查点保存，不能无限增长)
+LATENCY_SAMPLE_WINDOW = 200
+
+# 每条消息的格式开销 (role/name 等)，与 OpenAI 的计数方式一致
+MESSAGE_OVERHEAD_TOKENS = 4
+# 字节长度启发式：UTF-8 约 4 字节一个 token
+BYTES_PER_TOKEN = 4
+
+# 模型名前缀 -> tiktoken 编码 (tiktoken 可用时)
+DEFAULT_TIKTOKEN_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "o1": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5": "cl100k_base",
+}
+
+def _synchronized(method):
+    """方法体在 self._lock 内执行"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def heuristic_token_count(text):
+    """字节长度启发式：UTF-8 约 4 字节一个 token (英文约 4 字符/token，中文约 0.75 token/字)"""
+    if not text:
+        return 0
+    return (len(text.encode("utf-8")) + BYTES_PER_TOKEN - 1) // BYTES_PER_TOKEN
+
+class TokenEstimator:
+    """
+    离线 token 估算器
+    - 分词器可插拔: register_tokenizer(模型名前缀, fn(text) -> int)，按最长前缀匹配
+    - 未匹配或分词器不可用时退化为字节长度启发式
+    - 真实分词器的结果按 (分词器, 内容哈希) 缓存 (LRU)，长历史每轮只需分词新增消息
+    """
+
+    def __init__(self, max_cache=50000):
+        self.max_cache = max_cache
+        self._tokenizers = {}  # {前缀: (名称, fn)}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        for prefix, encoding in DEFAULT_TIKTOKEN_ENCODINGS.items():
+            self.register_tiktoken(prefix, encoding)
+
+    def register_tokenizer(self, model_prefix, fn, name=None):
+        """注册分词器 fn(text) -> token 数"""
+        with self._lock:
+            self._tokenizers[model_prefix] = (name or model_prefix, fn)
+
+    def register_tiktoken(self, model_prefix, encoding_name):
+        """注册 tiktoken 编码 (首次使用时加载；未安装或离线无法加载时该前缀退化为启发式)"""
+        state = {}
+
+        def count(text):
+            if "encoding" not in state:
+                try:
+                    import tiktoken
+                    state["encoding"] = tiktoken.get_encoding(encoding_name)
+                except Exception:
+                    state["encoding"] = None
+            if state["encoding"] is None:
+                return None
+            return len(state["encoding"].encode(text, disallowed_special=()))
+
+        self.register_tokenizer(model_prefix, count, name=f"tiktoken:{encoding_name}")
+
+    def configure(self, estimator_cfg=None):
+        """
+        按 secrets/config.json 的 token_estimator 段配置
+        tiktoken: {模型名前缀: 编码名}，例如 {"qwen": "cl100k_base"}
+        """
+        for prefix, encoding in (estimator_cfg or {}).get("tiktoken", {}).items():
+            self.register_tiktoken(prefix, encoding)
+
+    def _tokenizer_for(self, model):
+        model = (model or "").lower()
+        with self._lock:
+            matches = [p for p in self._tokenizers if model.startswith(p.lower())]
+            if not matches:
+                return None
+            return self._tokenizers[max(matches, key=len)]
+
+    def count_text(self, text, model=None):
+        """
+        :return: (token 数, 方法名)；方法名为分词器名称或 "heuristic"
+        """
+        if not text:
+            return 0, "heuristic"
+        tokenizer = self._tokenizer_for(model)
+        if tokenizer is None:
+            # 启发式本身比哈希更快，无需缓存
+            return heuristic_token_count(text), "heuristic"
+        method = tokenizer[0]
+        key = hashlib.sha1(f"{method}\x00{text}".encode("utf-8")).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+
+        try:
+            count = tokenizer[1](text)
+        except Exception:
+            count = None
+        if count is None:
+            count, method = heuristic_token_count(text), "heuristic"
+
+        result = (count, method)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+        return result
+
+    def count_messages(self, messages, model=None):
+        """估算一组 chat 消息的输入 token 数 (内容 + 工具调用 + 每条消息的格式开销)"""
+        total = 0
+        for message in messages or []:
+            content = message.get("content")
+            if isinstance(content, list):
+                content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            total += MESSAGE_OVERHEAD_TOKENS + self.count_text(content or "", model)[0]
+            for key in ("tool_calls", "function_call"):
+                if message.get(key):
+                    total += self.count_text(json.dumps(message[key], ensure_ascii=False, default=str), model)[0]
+        return total
+
+    def count_request(self, request):
+        """一次请求的预估 token 数 (输入 + max_tokens)，用于限流预扣"""
+        return self.count_messages(request.get("messages"), request.get("model")) + (request.get("max_tokens") or 0)
+
+    def get_stats(self):
+        with self._lock:
+            return {"cache_entries": len(self._cache), "cache_hits": self.cache_hits, "cache_misses": self.cache_misses}
+
+_estimator = TokenEstimator()
+
+def get_token_estimator():
+    """进程内共享的 TokenEstimator (计数缓存跨会话复用)"""
+    return _estimator
 
 class TokenTracker:
     """
@@ -15,6 +181,7 @@ class TokenTracker:
     - 统计每个模型的 token 消耗
     - 成本估算（基于配置的价格）
     - 预算控制和超限警告
+    - 线程安全：对冲落败请求在对冲线程的回调中记账，与对话线程的记账/预算检查互斥
     """
     
     # 默认价格表（每百万 token 的价格，单位：元）
@@ -27,48 +194,256 @@ class TokenTracker:
         "local": {"input": 0.0, "output": 0.0}
     }
     
-    def __init__(self, project_name, budget_limit=None, log_dir="logs"):
+    def __init__(self, project_name, budget_limit=None, log_dir="logs", hard_limit=False, reserve_output_tokens=0):
         """
         初始化追踪器
         :param project_name: 项目名称
         :param budget_limit: 预算上限（元），None 表示无限制
         :param log_dir: 日志目录
+        :param hard_limit: 是否在调用前拒绝会超出预算的调用 (preflight)
+        :param reserve_output_tokens: 预估成本时为输出预留的 token 数
         """
         self.project_name = project_name
         self.budget_limit = budget_limit
+        self.hard_limit = hard_limit
+        self.reserve_output_tokens = reserve_output_tokens
+        self.blocked_calls = 0
+        self.stop_reason = None
+        self.estimator = get_token_estimator()
+        # 可重入：track_call 内部还会调用 track_usage 等同样加锁的方法
+        self._lock = threading.RLock()
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
         
         # 统计数据
-        self.usage = {}  # {model_name: {"input": tokens, "output": tokens}}
+        self.usage = {}  # {model_name: {"input", "output", "calls", "cached_calls", "estimated_*"}}
         self.total_cost = 0.0
+        self.estimated_cost = 0.0  # total_cost 中基于本地估算的部分
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rate_limit_waits = {}  # {limiter_key: {"calls", "waited_calls", "total_wait", "max_wait"}}
+        self.speaker_rule_selections = 0
+        self.speaker_llm_selections = 0
+        self.speaker_tokens_avoided = 0  # 预估值
+        self.compaction_saved = {}  # {轮次: 省下的预估 token}
+        self.compaction_summaries = 0
+        self.routes = {}  # {端点别名: {"calls", "fallback_calls", "hedged_calls", "hedge_wins", "errors", "latencies"}}，latencies 为最近的样本
+        self.ttft_samples = []  # 最近流式调用的首 token 耗时 (秒)
+        self.ttft_calls = 0
+        self.model_selections = {}  # {Agent: {"primary", "turns", "selected": {别名: 次数}, "reasons", "saved"}}
         self.round_count = 0
+        self.resumed_from_round = None
         self.start_time = datetime.now()
+        self.telemetry = None
         
         # 时间戳文件
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.usage_file = self.log_dir / f"token_usage_{timestamp}_{project_name}.json"
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.usage_file = self.log_dir / f"token_usage_{self.timestamp}_{project_name}.json"
     
-    def track_usage(self, model_name, input_tokens, output_tokens):
+    @_synchronized
+    def enable_telemetry(self, telemetry_cfg=None):
+        """
+        开启调用级遥测 (secrets/config.json 的 telemetry 段)
+        - logs/calls_<时间戳>_<项目>.jsonl: 每次模型调用一条记录
+        - logs/metrics_<项目>.prom: 定期重写的 Prometheus 文本快照
+        """
+        cfg = telemetry_cfg or {}
+        if not cfg.get("enabled", True) or self.telemetry is not None:
+            return self.telemetry
+        self.telemetry = TelemetryWriter(
+            self.log_dir / f"calls_{self.timestamp}_{self.project_name}.jsonl",
+            prom_path=self.log_dir / f"metrics_{self.project_name}.prom" if cfg.get("prometheus", True) else None,
+            project=self.project_name,
+            flush_every=cfg.get("flush_every", 20),
+            flush_interval=cfg.get("flush_interval_seconds", 2.0),
+            snapshot_interval=cfg.get("snapshot_interval_seconds", 5.0),
+        )
+        self._update_gauges()
+        return self.telemetry
+    
+    @_synchronized
+    def close_telemetry(self):
+        """写出剩余的遥测记录并关闭文件"""
+        if self.telemetry is not None:
+            self._update_gauges()
+            self.telemetry.close()
+    
+    @_synchronized
+    def track_call(self, model_name, input_tokens, output_tokens, agent=None, latency=None, ttft=None,
+                   estimated=False, **extra):
+        """
+        记录一次真实的模型调用 (用量 + 遥测)
+        :param agent: 发起调用的 Agent 名称
+        :param latency: 网络调用耗时 (秒)
+        :param ttft: 首 token 耗时 (秒)，非流式调用为 None
+        :param estimated: token 数是否为本地估算
+        :return: 本次成本 (元)
+        """
+        round_num = self.round_count + 1
+        cost = self.track_usage(model_name, input_tokens, output_tokens, estimated=estimated)
+        if ttft is not None:
+            self.ttft_calls += 1
+            _add_sample(self.ttft_samples, ttft)
+        self._record_call(model_name, agent, round_num, prompt_tokens=input_tokens, completion_tokens=output_tokens,
+                          cost_cny=round(cost, 6), latency_s=latency, ttft_s=ttft, cached=False,
+                          token_source="estimated" if estimated else "measured", **extra)
+        return cost
+    
+    @_synchronized
+    def track_call_error(self, model_name, error, agent=None, latency=None, **extra):
+        """记录一次失败的模型调用 (只写遥测，不计成本)"""
+        if extra.get("endpoint"):
+            self._ensure_route(extra["endpoint"])["errors"] += 1
+        self._record_call(model_name, agent, self.round_count + 1, latency_s=latency, error=str(error)[:500], **extra)
+    
+    def _record_call(self, model_name, agent, round_num, **fields):
+        if self.telemetry is None:
+            return
+        latency = fields.get("latency_s")
+        if latency is not None:
+            fields["latency_s"] = round(latency, 4)
+        if fields.get("ttft_s") is not None:
+            fields["ttft_s"] = round(fields["ttft_s"], 4)
+        self.telemetry.record(agent=agent, model=model_name, round=round_num, **fields)
+        self._update_gauges()
+    
+    def _update_gauges(self):
+        if self.telemetry is None:
+            return
+        self.telemetry.set_gauge("rounds", self.round_count)
+        self.telemetry.set_gauge("cost_cny", round(self.total_cost, 6))
+        if self.budget_limit is not None:
+            self.telemetry.set_gauge("budget_limit_cny", self.budget_limit)
+    
+    @_synchronized
+    def track_usage(self, model_name, input_tokens, output_tokens, estimated=False):
         """
         记录 token 使用
         :param model_name: 模型名称
         :param input_tokens: 输入 token 数
         :param output_tokens: 输出 token 数
+        :param estimated: True 表示数字来自本地估算 (服务端未返回 usage)
         """
-        if model_name not in self.usage:
-            self.usage[model_name] = {"input": 0, "output": 0, "calls": 0}
+        self._ensure_model(model_name)
         
         self.usage[model_name]["input"] += input_tokens
         self.usage[model_name]["output"] += output_tokens
         self.usage[model_name]["calls"] += 1
+        if estimated:
+            self.usage[model_name]["estimated_input"] += input_tokens
+            self.usage[model_name]["estimated_output"] += output_tokens
+            self.usage[model_name]["estimated_calls"] += 1
         
         # 计算成本
         cost = self._calculate_cost(model_name, input_tokens, output_tokens)
         self.total_cost += cost
+        if estimated:
+            self.estimated_cost += cost
         
         return cost
     
+    def estimate_usage(self, model_name, messages, completion_text):
+        """
+        本地估算一次调用的 (输入, 输出) token 数
+        :param messages: 请求消息
+        :param completion_text: 回复文本 (含工具调用时为其 JSON)
+        """
+        prompt_tokens = self.estimator.count_messages(messages, model_name)
+        completion_tokens = self.estimator.count_text(completion_text or "", model_name)[0]
+        return prompt_tokens, completion_tokens
+    
+    def _ensure_model(self, model_name):
+        if model_name not in self.usage:
+            self.usage[model_name] = {
+                "input": 0, "output": 0, "calls": 0, "cached_calls": 0,
+                "estimated_input": 0, "estimated_output": 0, "estimated_calls": 0,
+            }
+    
+    @_synchronized
+    def track_cache_hit(self, model_name, agent=None, latency=None):
+        """记录一次缓存命中：计为调用，但不产生 token 和成本"""
+        self._ensure_model(model_name)
+        self.usage[model_name]["calls"] += 1
+        self.usage[model_name]["cached_calls"] += 1
+        self.cache_hits += 1
+        self._record_call(model_name, agent, self.round_count + 1, prompt_tokens=0, completion_tokens=0,
+                          cost_cny=0.0, latency_s=latency, ttft_s=None, cached=True)
+        return 0.0
+    
+    @_synchronized
+    def track_cache_miss(self):
+        """记录一次缓存未命中 (随后的真实调用由 track_usage 记录)"""
+        self.cache_misses += 1
+    
+    @_synchronized
+    def track_rate_limit_wait(self, key, seconds):
+        """记录一次限流排队 (key 为模型别名或 base_url)"""
+        stats = self.rate_limit_waits.setdefault(key, {"calls": 0, "waited_calls": 0, "total_wait": 0.0, "max_wait": 0.0})
+        stats["calls"] += 1
+        if seconds > 0.001:
+            stats["waited_calls"] += 1
+        stats["total_wait"] += seconds
+        stats["max_wait"] = max(stats["max_wait"], seconds)
+    
+    def _ensure_route(self, alias):
+        return self.routes.setdefault(alias, {
+            "calls": 0, "fallback_calls": 0, "hedged_calls": 0, "hedge_wins": 0, "errors": 0, "latencies": [],
+        })
+    
+    @_synchronized
+    def track_route(self, alias, latency, fallback=False, hedged=False, hedge_won=False):
+        """
+        记录一次调用实际由哪个端点服务
+        :param fallback: 前面的端点失败后由兜底端点完成
+        :param hedged: 发出过对冲请求；hedge_won 表示对冲请求先返回
+        """
+        stats = self._ensure_route(alias)
+        stats["calls"] += 1
+        stats["fallback_calls"] += int(fallback)
+        stats["hedged_calls"] += int(hedged)
+        stats["hedge_wins"] += int(hedge_won)
+        _add_sample(stats["latencies"], latency)
+    
+    @_synchronized
+    def track_model_selection(self, agent, primary, selected, reason, saved=0.0):
+        """
+        记录一次逐轮模型选择
+        :param primary: Agent 配置的模型别名
+        :param selected: 本轮实际使用的别名
+        :param saved: 按主模型计价与实际成本之差 (元)
+        """
+        stats = self.model_selections.setdefault(agent or "unknown", {
+            "primary": primary, "turns": 0, "selected": {}, "reasons": {}, "saved": 0.0,
+        })
+        stats["turns"] += 1
+        stats["selected"][selected] = stats["selected"].get(selected, 0) + 1
+        stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+        stats["saved"] += saved
+    
+    @_synchronized
+    def track_speaker_selection(self, local, avoided_tokens=0):
+        """
+        记录一次发言人选择
+        :param local: True 表示由规则在本地解析 (省下一次 LLM 选择调用)
+        :param avoided_tokens: 省下的选择器调用的预估 token 数
+        """
+        if local:
+            self.speaker_rule_selections += 1
+            self.speaker_tokens_avoided += avoided_tokens
+        else:
+            self.speaker_llm_selections += 1
+    
+    @_synchronized
+    def track_compaction(self, saved_tokens, summaries=0):
+        """
+        记录一次上下文压缩
+        :param saved_tokens: 本次请求省下的预估 token 数 (计入当前进行中的轮次)
+        :param summaries: 新生成的滚动摘要数
+        """
+        round_num = self.round_count + 1
+        self.compaction_saved[round_num] = self.compaction_saved.get(round_num, 0) + saved_tokens
+        self.compaction_summaries += summaries
+    
     def _calculate_cost(self, model_name, input_tokens, output_tokens):
         """计算成本（元）"""
         pricing = self.DEFAULT_PRICING.get(model_name, {"input": 0.0, "output": 0.0})
@@ -78,10 +453,35 @@ class TokenTracker:
         
         return input_cost + output_cost
     
+    @_synchronized
     def increment_round(self):
         """增加轮次计数"""
         self.round_count += 1
+        self._update_gauges()
     
+    @_synchronized
+    def export_state(self):
+        """累计统计的快照 (可 JSON 序列化)，写入检查点"""
+        state = copy.deepcopy({field: getattr(self, field) for field in STATE_FIELDS})
+        state["elapsed_seconds"] = round((datetime.now() - self.start_time).total_seconds(), 2)
+        return state
+    
+    @_synchronized
+    def restore_state(self, state):
+        """从检查点恢复累计统计 (成本、轮次等)，续跑的会话接着计数与控制预算"""
+        for field in STATE_FIELDS:
+            if field in state:
+                setattr(self, field, copy.deepcopy(state[field]))
+        # 旧检查点没有 ttft_calls，样本数即调用数
+        if "ttft_calls" not in state:
+            self.ttft_calls = len(self.ttft_samples)
+        # JSON 中的轮次键为字符串
+        self.compaction_saved = {int(k): v for k, v in self.compaction_saved.items()}
+        self.start_time = datetime.now() - timedelta(seconds=state.get("elapsed_seconds", 0))
+        self.resumed_from_round = self.round_count
+        self._update_gauges()
+    
+    @_synchronized
     def check_budget(self):
         """
         检查预算
@@ -93,16 +493,108 @@ class TokenTracker:
         remaining = self.budget_limit - self.total_cost
         return self.total_cost >= self.budget_limit, remaining
     
+    @_synchronized
+    def preflight(self, model_name, prompt_tokens, output_tokens=None):
+        """
+        调用前的预算检查 (硬限制)
+        :param prompt_tokens: 预估输入 token 数
+        :param output_tokens: 预估输出 token 数，None 时使用 reserve_output_tokens
+        :return: 预估成本 (元)
+        :raises BudgetExceededError: 已花费 + 预估成本 超过预算上限
+        """
+        if output_tokens is None:
+            output_tokens = self.reserve_output_tokens
+        estimated = self._calculate_cost(model_name, prompt_tokens, output_tokens)
+        if not self.hard_limit or self.budget_limit is None:
+            return estimated
+        if self.total_cost + estimated > self.budget_limit:
+            self.blocked_calls += 1
+            self.stop_reason = "budget_exceeded"
+            raise BudgetExceededError(
+                f"{model_name} call (~{prompt_tokens} prompt tokens, ~¥{estimated:.4f}) would exceed budget: "
+                f"spent ¥{self.total_cost:.4f} / ¥{self.budget_limit:.4f}"
+            )
+        return estimated
+    
+    @_synchronized
     def get_summary(self):
         """获取统计摘要"""
         duration = (datetime.now() - self.start_time).total_seconds()
+        lookups = self.cache_hits + self.cache_misses
         
         summary = {
             "project": self.project_name,
             "duration_seconds": round(duration, 2),
             "total_rounds": self.round_count,
+            "resumed_from_round": self.resumed_from_round,
             "total_cost_cny": round(self.total_cost, 4),
+            "estimated_cost_cny": round(self.estimated_cost, 4),
+            "token_source": _token_source(
+                sum(m["input"] + m["output"] for m in self.usage.values()),
+                sum(m["estimated_input"] + m["estimated_output"] for m in self.usage.values()),
+            ),
             "budget_limit_cny": self.budget_limit,
+            "budget_hard_limit": self.hard_limit,
+            "blocked_calls": self.blocked_calls,
+            "stop_reason": self.stop_reason,
+            "response_cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+            },
+            "rate_limits": {
+                key: {
+                    "calls": stats["calls"],
+                    "waited_calls": stats["waited_calls"],
+                    "total_wait_seconds": round(stats["total_wait"], 3),
+                    "max_wait_seconds": round(stats["max_wait"], 3),
+                }
+                for key, stats in self.rate_limit_waits.items()
+            },
+            "speaker_selection": {
+                "rule_based": self.speaker_rule_selections,
+                "llm_fallback": self.speaker_llm_selections,
+                "selector_calls_avoided": self.speaker_rule_selections,
+                "selector_tokens_avoided_est": self.speaker_tokens_avoided,
+            },
+            "routing": {
+                alias: {
+                    "calls": stats["calls"],
+                    "fallback_calls": stats["fallback_calls"],
+                    "hedged_calls": stats["hedged_calls"],
+                    "hedge_wins": stats["hedge_wins"],
+                    "errors": stats["errors"],
+                    "p50_latency_s": percentile(stats["latencies"], 50),
+                    "p95_latency_s": percentile(stats["latencies"], 95),
+                }
+                for alias, stats in self.routes.items()
+            },
+            "streaming": {
+                "calls": self.ttft_calls,
+                "ttft_p50_s": percentile(self.ttft_samples, 50),
+                "ttft_p95_s": percentile(self.ttft_samples, 95),
+            },
+            "model_selection": {
+                "turns": sum(s["turns"] for s in self.model_selections.values()),
+                "downgraded": sum(n for s in self.model_selections.values()
+                                  for alias, n in s["selected"].items() if alias != s["primary"]),
+                "savings_cny_est": round(sum(s["saved"] for s in self.model_selections.values()), 4),
+                "per_agent": {
+                    agent: {
+                        "primary": s["primary"],
+                        "turns": s["turns"],
+                        "selected": dict(s["selected"]),
+                        "reasons": dict(s["reasons"]),
+                        "savings_cny_est": round(s["saved"], 4),
+                    }
+                    for agent, s in self.model_selections.items()
+                },
+            },
+            "context_compaction": {
+                "tokens_saved_est": sum(self.compaction_saved.values()),
+                "summaries": self.compaction_summaries,
+                "per_round": dict(sorted(self.compaction_saved.items())),
+            },
             "models": {}
         }
         
@@ -110,13 +602,26 @@ class TokenTracker:
             total_tokens = stats["input"] + stats["output"]
             model_cost = self._calculate_cost(model, stats["input"], stats["output"])
             
+            estimated_tokens = stats["estimated_input"] + stats["estimated_output"]
             summary["models"][model] = {
                 "calls": stats["calls"],
+                "cached_calls": stats["cached_calls"],
                 "input_tokens": stats["input"],
                 "output_tokens": stats["output"],
                 "total_tokens": total_tokens,
-                "cost_cny": round(model_cost, 4)
+                "cost_cny": round(model_cost, 4),
+                "token_source": _token_source(total_tokens, estimated_tokens),
+                "measured": {
+                    "input_tokens": stats["input"] - stats["estimated_input"],
+                    "output_tokens": stats["output"] - stats["estimated_output"],
+                },
+                "estimated": {
+                    "calls": stats["estimated_calls"],
+                    "input_tokens": stats["estimated_input"],
+                    "output_tokens": stats["estimated_output"],
+                },
             }
+        summary["token_estimator"] = self.estimator.get_stats()
         
         return summary
     
@@ -139,18 +644,69 @@ class TokenTracker:
         print(f"⏱️  运行时长: {summary['duration_seconds']}s")
         print(f"🔄 总轮次: {summary['total_rounds']}")
         print(f"💰 总成本: ¥{summary['total_cost_cny']:.4f}")
+        if summary['estimated_cost_cny']:
+            print(f"   (其中本地估算 ¥{summary['estimated_cost_cny']:.4f}，服务端未返回 usage)")
         
         if self.budget_limit:
             print(f"📈 预算限制: ¥{self.budget_limit:.4f}")
             remaining = self.budget_limit - summary['total_cost_cny']
             print(f"💵 剩余预算: ¥{remaining:.4f}")
+        if self.stop_reason:
+            print(f"🛑 提前结束: {self.stop_reason} (拒绝调用 {self.blocked_calls} 次)")
+        
+        cache = summary['response_cache']
+        if cache['hits'] or cache['misses']:
+            print(f"🗄️  响应缓存: 命中 {cache['hits']} / 未命中 {cache['misses']} (命中率 {cache['hit_rate']:.0%})")
+        
+        for key, stats in summary['rate_limits'].items():
+            if stats['waited_calls']:
+                print(f"🚦 限流 {key}: 排队 {stats['waited_calls']}/{stats['calls']} 次, 累计等待 {stats['total_wait_seconds']}s")
+        
+        speaker = summary['speaker_selection']
+        if speaker['rule_based'] or speaker['llm_fallback']:
+            print(f"🗣️  发言选择: 规则 {speaker['rule_based']} 次 / LLM {speaker['llm_fallback']} 次, "
+                  f"省下约 {speaker['selector_tokens_avoided_est']:,} tokens")
+        
+        routing = summary['routing']
+        if len(routing) > 1 or any(r['fallback_calls'] or r['hedged_calls'] or r['errors'] for r in routing.values()):
+            for alias, stats in routing.items():
+                print(f"🔀 端点 {alias}: 服务 {stats['calls']} 次 (兜底 {stats['fallback_calls']}, "
+                      f"对冲 {stats['hedged_calls']} / 胜出 {stats['hedge_wins']}, 失败 {stats['errors']}), "
+                      f"p50 {stats['p50_latency_s']}s / p95 {stats['p95_latency_s']}s")
+        
+        streaming = summary['streaming']
+        if streaming['calls']:
+            print(f"⚡ 流式输出: {streaming['calls']} 次, 首 token p50 {streaming['ttft_p50_s']}s / p95 {streaming['ttft_p95_s']}s")
+        
+        selection = summary['model_selection']
+        if selection['turns']:
+            print(f"🎚️  模型选择: 降级 {selection['downgraded']}/{selection['turns']} 轮, "
+                  f"预估节省 ¥{selection['savings_cny_est']:.4f}")
+        
+        compaction = summary['context_compaction']
+        if compaction['per_round']:
+            print(f"🗜️  上下文压缩: 省下约 {compaction['tokens_saved_est']:,} tokens, 摘要 {compaction['summaries']} 次")
         
         print("\n模型详情:")
         for model, stats in summary['models'].items():
             print(f"  🤖 {model}:")
-            print(f"     调用次数: {stats['calls']}")
+            print(f"     调用次数: {stats['calls']} (缓存命中 {stats['cached_calls']}, 估算 {stats['estimated']['calls']})")
             print(f"     输入 Tokens: {stats['input_tokens']:,}")
             print(f"     输出 Tokens: {stats['output_tokens']:,}")
             print(f"     成本: ¥{stats['cost_cny']:.4f}")
         
         print("="*60 + "\n")
+
+def _add_sample(samples, value):
+    """追加延迟样本，只保留最近 LATENCY_SAMPLE_WINDOW 个"""
+    samples.append(round(value, 4))
+    if len(samples) > LATENCY_SAMPLE_WINDOW:
+        del samples[:len(samples) - LATENCY_SAMPLE_WINDOW]
+
+def _token_source(total_tokens, estimated_tokens):
+    """measured: 全部来自服务端 usage；estimated: 全部本地估算；mixed: 两者都有"""
+    if not estimated_tokens:
+        return "measured"
+    if estimated_tokens >= total_tokens:
+        return "estimated"
+    return "mixed"
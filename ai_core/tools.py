@@ -1,22 +1,236 @@
-# 版本: v1.1
+# 版本: v2.4
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-28
-# 总结: 增加路径安全检查，防止 AI 修改框架核心代码。
+# 日期: 2026-10-18
+# 总结: 新增 release_workspace_state：会话结束后移除进程内的工作区状态 (索引、内容哈希)，批量长时间运行不再累积。
 
+import hashlib
+import mmap
 import os
 import re
 import subprocess
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from .code_edits import EditError, parse_edit_block
+from .code_extractor import CodeBlockExtractor
+from .token_tracker import BYTES_PER_TOKEN, get_token_estimator
+from .tracing import span, traced
+
+# 单次 git add 传入的最大路径数，避免命令行过长
+GIT_ADD_CHUNK = 100
+# 不小于该大小的文件经 mmap 读取
+READ_MMAP_THRESHOLD = 64 * 1024
+_workspace_states = {}
+_workspace_lock = threading.Lock()
+
+class WorkspaceState:
+    """
+    工作区运行时状态，按绝对路径在进程内共享
+    - committer: Git 提交合并器，None 表示每次写入立即提交
+    - log_writer: 对话日志写入器，首次 save_log 时创建
+    - content_hashes: {相对路径: 内容 sha1}，内容未变化时跳过写入和提交
+    - saved_versions: 本次运行写入过的 (相对路径, sha1)
+    - index: 工作区文件索引 (workspace_index.WorkspaceIndex)，首次 list_workspace 时创建
+    - edit_errors: {作者: [失败原因]}，在作者下一次回复前反馈给它
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = os.path.abspath(work_dir)
+        self.committer = None
+        self.log_writer = None
+        self.content_hashes = {}
+        self.saved_versions = set()
+        self.index = None
+        self.edit_errors = {}
+        self.writes = 0
+        self.writes_skipped = 0
+        self.edits_applied = 0
+        self.edits_failed = 0
+        self.edit_tokens_saved = 0
+        self._hash_lock = threading.Lock()
+
+    def is_unchanged(self, rel_path, digest):
+        """
+        判断文件内容是否与上次写入一致
+        首次遇到已存在的文件 (断点续跑) 时读取一次并记录哈希
+        """
+        with self._hash_lock:
+            known = self.content_hashes.get(rel_path)
+        if known is None:
+            full_path = os.path.join(self.work_dir, rel_path)
+            if not os.path.isfile(full_path):
+                return False
+            try:
+                with open(full_path, 'rb') as f:
+                    known = hashlib.sha1(f.read()).hexdigest()
+            except OSError:
+                return False
+            with self._hash_lock:
+                self.content_hashes[rel_path] = known
+        return known == digest
+
+    def record_write(self, rel_path, digest):
+        with self._hash_lock:
+            self.content_hashes[rel_path] = digest
+            self.saved_versions.add((rel_path, digest))
+            self.writes += 1
+
+    def is_saved_version(self, rel_path, digest):
+        """该内容是否写入过工作区 (只查内存，不读磁盘)"""
+        with self._hash_lock:
+            return (rel_path, digest) in self.saved_versions or self.content_hashes.get(rel_path) == digest
+
+    def record_skip(self):
+        with self._hash_lock:
+            self.writes_skipped += 1
+
+    def record_edit(self, author, rel_path, error=None, tokens_saved=0):
+        with self._hash_lock:
+            if error is None:
+                self.edits_applied += 1
+                self.edit_tokens_saved += tokens_saved
+            else:
+                self.edits_failed += 1
+                self.edit_errors.setdefault(author, []).append(f"{rel_path}: {error}")
+
+    def pop_edit_errors(self, author):
+        with self._hash_lock:
+            return self.edit_errors.pop(author, [])
+
+def get_workspace_state(work_dir):
+    """获取 (或创建) 工作区运行时状态"""
+    key = os.path.abspath(work_dir)
+    with _workspace_lock:
+        state = _workspace_states.get(key)
+        if state is None:
+            state = WorkspaceState(key)
+            _workspace_states[key] = state
+        return state
+
+def release_workspace_state(work_dir):
+    """
+    会话结束 (flush_workspace 之后) 调用：移除进程内的工作区状态，释放索引与内容哈希
+    之后再访问同一工作区会重新创建状态
+    """
+    with _workspace_lock:
+        _workspace_states.pop(os.path.abspath(work_dir), None)
+
+def _git_commit_paths(work_dir, paths, message):
+    """只暂存指定路径并提交 (不扫描整个工作树)"""
+    with span("git.commit", "git", files=len(paths)):
+        for start in range(0, len(paths), GIT_ADD_CHUNK):
+            chunk = paths[start:start + GIT_ADD_CHUNK]
+            subprocess.run(["git", "add", "-A", "--"] + chunk, cwd=work_dir, capture_output=True)
+        subprocess.run(["git", "commit", "-q", "-m", message], cwd=work_dir, capture_output=True)
+
+class CommitCoalescer:
+    """
+    Git 提交合并器
+    - save_code_to_file 只登记变更路径，不再触发子进程
+    - 每轮 (GroupChat 中即每条消息) 调用一次 commit()，提交信息包含轮次和发言 Agent
+    - 会话结束时 flush() 提交剩余变更
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = os.path.abspath(work_dir)
+        self._pending = {}  # {rel_path: None}，保持登记顺序并去重
+        self._lock = threading.Lock()
+
+        # 统计数据
+        self.commits = 0
+        self.files_committed = 0
+        self.git_seconds = 0.0
+
+    def stage(self, rel_path):
+        """登记一个已写入的相对路径"""
+        with self._lock:
+            self._pending[rel_path.replace("\\", "/")] = None
+
+    def pending(self):
+        """当前待提交的路径列表"""
+        with self._lock:
+            return list(self._pending)
+
+    def commit(self, round_num=None, author=None):
+        """
+        提交所有已登记的路径
+        :param round_num: 对话轮次 (写入提交信息)
+        :param author: 产生这些文件的 Agent 名称
+        :return: 是否产生了提交
+        """
+        with self._lock:
+            paths = list(self._pending)
+            self._pending.clear()
+        if not paths:
+            return False
+
+        title = f"Round {round_num}" if round_num is not None else "Auto-save"
+        if author:
+            title += f" [{author}]"
+        message = f"{title}: {len(paths)} file(s)\n\n" + "\n".join(paths)
+
+        start = time.perf_counter()
+        try:
+            _git_commit_paths(self.work_dir, paths, message)
+        except Exception as e:
+            print(f"Warning: Git commit failed: {e}")
+            return False
+        finally:
+            self.git_seconds += time.perf_counter() - start
+
+        self.commits += 1
+        self.files_committed += len(paths)
+        return True
+
+    def flush(self, author="session-end"):
+        """会话结束时提交剩余变更"""
+        return self.commit(author=author)
+
+    def get_stats(self):
+        """获取提交统计"""
+        return {
+            "commits": self.commits,
+            "files_committed": self.files_committed,
+            "git_seconds": round(self.git_seconds, 4),
+        }
+
+def enable_commit_coalescing(work_dir):
+    """为工作区启用提交合并，返回 CommitCoalescer"""
+    state = get_workspace_state(work_dir)
+    with _workspace_lock:
+        if state.committer is None:
+            state.committer = CommitCoalescer(state.work_dir)
+        return state.committer
+
+def flush_workspace(work_dir):
+    """
+    会话结束时调用：关闭日志文件并提交剩余变更
+    :return: 提交统计 (未启用合并时为 None)
+    """
+    state = get_workspace_state(work_dir)
+    if state.log_writer is not None:
+        state.log_writer.close()
+    if state.committer is None:
+        return None
+    state.committer.flush()
+    return state.committer.get_stats()
+
 def is_safe_path(base_dir, target_path):
     """
     检查目标路径是否在基础目录内 (防止路径遍历攻击)
     """
-    abs_base = os.path.abspath(base_dir)
-    abs_target = os.path.abspath(os.path.join(base_dir, target_path))
-    return abs_target.startswith(abs_base)
+    abs_base = os.path.realpath(base_dir)
+    abs_target = os.path.realpath(os.path.join(base_dir, target_path))
+    # 按路径组件比较：字符串前缀会放行同前缀的兄弟目录 (如 ../workspace_old)
+    try:
+        return os.path.commonpath([abs_base, abs_target]) == abs_base
+    except ValueError:  # Windows 下不同盘符
+        return False
 
+@traced("workspace.init", "git")
 def init_workspace(work_dir):
     """
     初始化工作区：创建目录，初始化Git
@@ -33,98 +247,382 @@ def init_workspace(work_dir):
         except Exception as e:
             print(f"Warning: Git init failed: {e}")
 
+class LogWriter:
+    """
+    工作区对话日志写入器
+    - 每个 Agent 独立的版本计数器 (精确匹配名称，Dev 与 FullStackDev 互不干扰)
+    - 计数器保存在内存中，仅在创建时扫描一次 logs/ 目录 (断点续跑时延续编号)
+    - transcript=False: 每条消息一个文件 <Agent>_vN.md (原有格式)
+    - transcript=True: 追加到单个文件 <Agent>.transcript.md，文件句柄常驻
+    """
+
+    VERSION_FILE_RE = re.compile(r'^(.+)_v(\d+)\.md$')
+    TRANSCRIPT_SUFFIX = ".transcript.md"
+    TRANSCRIPT_HEADER_RE = re.compile(r'^# (.+) - Version (\d+)$', re.MULTILINE)
+
+    def __init__(self, work_dir, transcript=False):
+        self.log_dir = os.path.join(work_dir, "logs")
+        self.transcript = transcript
+        self._counters = {}  # {agent_name: last_version}
+        self._handles = {}   # {agent_name: file} (transcript 模式)
+        self._lock = threading.Lock()
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._seed_counters()
+
+    def _seed_counters(self):
+        """一次性扫描已有日志，恢复各 Agent 的最大版本号"""
+        for name in os.listdir(self.log_dir):
+            if name.endswith(self.TRANSCRIPT_SUFFIX):
+                try:
+                    with open(os.path.join(self.log_dir, name), 'r', encoding='utf-8') as f:
+                        headers = self.TRANSCRIPT_HEADER_RE.findall(f.read())
+                except Exception:
+                    continue
+                for agent, version in headers:
+                    self._bump(agent, int(version))
+                continue
+            match = self.VERSION_FILE_RE.match(name)
+            if match:
+                self._bump(match.group(1), int(match.group(2)))
+
+    def _bump(self, agent_name, version):
+        if version > self._counters.get(agent_name, 0):
+            self._counters[agent_name] = version
+
+    def next_version(self, agent_name):
+        """分配下一个版本号 (O(1))"""
+        with self._lock:
+            version = self._counters.get(agent_name, 0) + 1
+            self._counters[agent_name] = version
+            return version
+
+    @traced("log.write", "io")
+    def write(self, agent_name, content):
+        """
+        写入一条日志
+        :return: 日志文件路径
+        """
+        version = self.next_version(agent_name)
+        header = f"# {agent_name} - Version {version}\n\n**Time**: {datetime.now().isoformat()}\n\n"
+
+        if not self.transcript:
+            path = os.path.join(self.log_dir, f"{agent_name}_v{version}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(header)
+                f.write(content)
+            return path
+
+        path = os.path.join(self.log_dir, f"{agent_name}{self.TRANSCRIPT_SUFFIX}")
+        with self._lock:
+            handle = self._handles.get(agent_name)
+            if handle is None:
+                handle = open(path, "a", encoding="utf-8")
+                self._handles[agent_name] = handle
+            handle.write(header)
+            handle.write(content)
+            handle.write("\n\n")
+            handle.flush()
+        return path
+
+    def close(self):
+        """关闭 transcript 文件句柄"""
+        with self._lock:
+            for handle in self._handles.values():
+                handle.close()
+            self._handles.clear()
+
+def get_log_writer(work_dir, transcript=None):
+    """
+    获取工作区的日志写入器 (首次调用时创建并扫描已有日志)
+    :param transcript: 非 None 时设置写入模式
+    """
+    state = get_workspace_state(work_dir)
+    with _workspace_lock:
+        if state.log_writer is None:
+            state.log_writer = LogWriter(state.work_dir, transcript=bool(transcript))
+        elif transcript is not None:
+            state.log_writer.transcript = transcript
+        return state.log_writer
+
 def save_log(work_dir, agent_name, content):
     """保存对话日志"""
-    log_dir = os.path.join(work_dir, "logs")
-    os.makedirs(log_dir, exist_ok=True)
-    
-    version = len([f for f in os.listdir(log_dir) if agent_name.lower() in f.lower()]) + 1
-    path = os.path.join(log_dir, f"{agent_name}_v{version}.md")
-    
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(f"# {agent_name} - Version {version}\n\n")
-            f.write(f"**Time**: {datetime.now().isoformat()}\n\n")
-            f.write(content)
+        path = get_log_writer(work_dir).write(agent_name, content)
         print(f"📝 Log saved: {path}")
     except Exception as e:
         print(f"❌ Failed to save log: {e}")
 
-def save_code_to_file(work_dir, rel_path, content):
+@traced("workspace.write", "io")
+def _write_workspace_file(work_dir, rel_path, content):
     """
-    将内容保存到指定文件 (安全模式)
+    写入工作区文件并登记提交
+    :return: (status, message)，status 为 "saved" / "unchanged" / "error"
     """
     if not is_safe_path(work_dir, rel_path):
-        return False, f"⛔ Security Violation: Cannot write to '{rel_path}' (Outside workspace)"
+        return "error", f"⛔ Security Violation: Cannot write to '{rel_path}' (Outside workspace)"
+
+    state = get_workspace_state(work_dir)
+    key = os.path.normpath(rel_path).replace("\\", "/")
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    if state.is_unchanged(key, digest):
+        state.record_skip()
+        print(f"⏭️  Unchanged: {rel_path}")
+        return "unchanged", f"{rel_path} is unchanged (skipped write)"
 
     full_path = os.path.join(work_dir, rel_path)
     try:
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, 'w', encoding='utf-8') as f:
+        # 先写临时文件再原子替换，读者 (索引扫描、read_file) 不会看到写了一半的内容
+        tmp_path = f"{full_path}.tmp{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(content)
+        os.replace(tmp_path, full_path)
+        state.record_write(key, digest)
+        if state.index is not None:
+            state.index.update(key, content, digest)
         print(f"💾 Saved: {rel_path}")
         
-        # Git commit
-        subprocess.run(["git", "add", "."], cwd=work_dir, capture_output=True)
-        subprocess.run(["git", "commit", "-m", f"Auto-save: {rel_path}"], cwd=work_dir, capture_output=True)
+        # Git commit: 启用合并时仅登记路径，由每轮的 commit() 统一提交
+        if state.committer is not None:
+            state.committer.stage(key)
+        else:
+            _git_commit_paths(work_dir, [key], f"Auto-save: {rel_path}")
         
-        return True, f"Successfully saved to {rel_path}"
+        return "saved", f"Successfully saved to {rel_path}"
     except Exception as e:
-        return False, str(e)
+        return "error", str(e)
+
+def save_code_to_file(work_dir, rel_path, content):
+    """
+    将内容保存到指定文件 (安全模式)
+    内容与上次写入一致时跳过写入和提交，仍视为成功
+    """
+    status, msg = _write_workspace_file(work_dir, rel_path, content)
+    return status != "error", msg
+
+def get_write_stats(work_dir):
+    """获取工作区文件写入统计"""
+    state = get_workspace_state(work_dir)
+    return {
+        "written": state.writes,
+        "skipped_unchanged": state.writes_skipped,
+        "edits_applied": state.edits_applied,
+        "edits_failed": state.edits_failed,
+        "edit_tokens_saved_est": state.edit_tokens_saved,
+    }
+
+def pop_edit_errors(work_dir, author):
+    """取出 (并清空) 该作者尚未反馈的编辑失败原因"""
+    return get_workspace_state(work_dir).pop_edit_errors(author)
+
+@contextmanager
+def _open_buffer(path):
+    """文件内容的只读缓冲：小文件直接读入，大文件 mmap (切片只拷贝取出的部分)"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < READ_MMAP_THRESHOLD:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def _line_start(buf, line_no, pos=0, from_line=1):
+    """第 line_no 行 (从 1 开始) 的起始字节偏移，超出文件时返回 -1"""
+    for _ in range(line_no - from_line):
+        pos = buf.find(b"\n", pos)
+        if pos < 0:
+            return -1
+        pos += 1
+    return pos
+
+def _line_text(buf, line_no, start, end, max_bytes):
+    """'N| 内容'，单行超过上限 (例如压缩过的代码) 时只解码开头"""
+    if max_bytes is not None and end - start > max_bytes:
+        return f"{line_no}| " + buf[start:start + max_bytes].decode('utf-8', errors='ignore') \
+            + f" ... [line truncated at {max_bytes} of {end - start} bytes; use offset/length]"
+    return f"{line_no}| " + buf[start:end].decode('utf-8', errors='replace').rstrip("\r\n")
+
+def _read_lines(buf, start_line, end_line, max_bytes):
+    start = _line_start(buf, start_line)
+    if start < 0 or start >= len(buf):
+        return f"❌ Error: start_line {start_line} is past the end of file"
+    lines, used, line_no, pos = [], 0, start_line, start
+    while pos < len(buf) and (end_line is None or line_no <= end_line):
+        end = buf.find(b"\n", pos)
+        end = len(buf) if end < 0 else end + 1
+        text = _line_text(buf, line_no, pos, end, max_bytes)
+        used += len(text) + 1
+        if max_bytes is not None and used > max_bytes and lines:
+            lines.append(f"... [truncated by token cap; continue with start_line={line_no}]")
+            break
+        lines.append(text)
+        line_no, pos = line_no + 1, end
+    return "\n".join(lines)
+
+def _read_bytes(buf, offset, length, max_bytes):
+    if offset >= len(buf):
+        return f"❌ Error: offset {offset} is past the end of file ({len(buf)} bytes)"
+    if max_bytes is not None:
+        length = min(length, max_bytes)
+    end = min(len(buf), offset + length)
+    text = buf[offset:end].decode('utf-8', errors='replace')
+    if end < len(buf):
+        text += f"\n... [bytes {offset}-{end} of {len(buf)}; continue with offset={end}]"
+    return text
 
-def read_workspace_file(work_dir, filepath):
-    """安全读取工作区文件"""
+def _grep(buf, pattern, max_bytes):
+    try:
+        regex = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+    except re.error as e:
+        return f"❌ Error: invalid pattern: {e}"
+    results, used, line_no, line_pos, last_line = [], 0, 1, 0, 0
+    for match in regex.finditer(buf):
+        if match.start() == len(buf) and (not buf or buf[-1:] == b"\n"):
+            break  # 末尾换行之后的空匹配 (如 '^') 不是真实的一行
+        start = buf.rfind(b"\n", 0, match.start()) + 1
+        if start < line_pos:
+            continue  # 同一行已输出
+        # 从上一个匹配行向后数换行，得到当前行号
+        while True:
+            nl = buf.find(b"\n", line_pos)
+            if nl < 0 or nl >= start:
+                break
+            line_no, line_pos = line_no + 1, nl + 1
+        end = buf.find(b"\n", start)
+        end = len(buf) if end < 0 else end
+        text = _line_text(buf, line_no, start, end, max_bytes)
+        used += len(text) + 1
+        if max_bytes is not None and used > max_bytes and results:
+            results.append(f"... [truncated by token cap after line {last_line}; narrow the pattern or use start_line]")
+            break
+        results.append(text)
+        last_line = line_no
+        line_no, line_pos = line_no + 1, end + 1
+    return "\n".join(results) if results else f"No match for {pattern!r}"
+
+def read_workspace_file(work_dir, filepath, start_line=None, end_line=None, offset=None, length=None,
+                        pattern=None, max_tokens=None):
+    """
+    安全读取工作区文件
+    - 不带范围参数时返回全文 (受 max_tokens 限制时只返回开头并提示续读位置)
+    - start_line / end_line: 行范围 (从 1 开始，含 end_line)，每行带 'N| ' 行号
+    - offset / length: 字节范围
+    - pattern: 正则，返回匹配行 (带行号)
+    - max_tokens: 返回内容的 token 上限 (按字节数/4 估算)，None 为不限
+    不小于 READ_MMAP_THRESHOLD 的文件经 mmap 读取，只拷贝实际返回的部分
+    """
     if not is_safe_path(work_dir, filepath):
         return "❌ Error: Access denied (Outside workspace)"
         
     safe_path = os.path.abspath(os.path.join(work_dir, filepath))
-    if os.path.exists(safe_path):
+    if not os.path.isfile(safe_path):
+        return "❌ Error: File not found"
+    max_bytes = max_tokens * BYTES_PER_TOKEN if max_tokens else None
+    try:
+        with _open_buffer(safe_path) as buf:
+            if pattern:
+                return _grep(buf, pattern, max_bytes)
+            if offset is not None or length is not None:
+                return _read_bytes(buf, offset or 0, length if length is not None else len(buf), max_bytes)
+            if start_line is not None or end_line is not None:
+                return _read_lines(buf, start_line or 1, end_line, max_bytes)
+            if max_bytes is None or len(buf) <= max_bytes:
+                return buf[:].decode('utf-8', errors='replace')
+            return _read_lines(buf, 1, None, max_bytes)
+    except Exception as e:
+        return f"❌ Error reading file: {e}"
+
+def _workspace_key(path):
+    """对话中的文件路径 -> 工作区相对路径键"""
+    clean_path = path.replace('workspace/', '').replace('workspace\\', '')
+    return clean_path, os.path.normpath(clean_path).replace("\\", "/")
+
+def saved_file_ref(work_dir, path, code):
+    """
+    代码块内容已保存到工作区时返回 'path@hash' 引用，否则返回 None
+    """
+    _, key = _workspace_key(path)
+    digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+    if get_workspace_state(work_dir).is_saved_version(key, digest):
+        return f"{key}@{digest[:10]}"
+    return None
+
+def _apply_edit_block(work_dir, clean_path, code, author):
+    """
+    代码块是增量编辑时应用到工作区文件：全部 hunk / SEARCH 匹配后一次性写入，否则文件保持不变
+    :return: (是否为编辑块, 实际写入时的相对路径)
+    """
+    try:
+        edit = parse_edit_block(clean_path, code)
+    except EditError as e:
+        edit, error = None, e
+    else:
+        if edit is None:
+            return False, None
+        error = None
+
+    state = get_workspace_state(work_dir)
+    if error is None:
+        full_path = os.path.join(work_dir, clean_path)
+        original = None
         try:
-            with open(safe_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            return f"❌ Error reading file: {e}"
-    return "❌ Error: File not found"
+            if not is_safe_path(work_dir, clean_path):
+                raise EditError("path is outside the workspace")
+            if os.path.isfile(full_path):
+                with open(full_path, 'r', encoding='utf-8') as f:
+                    original = f.read()
+            content = edit.apply(original)
+        except (EditError, OSError, UnicodeDecodeError) as e:
+            error = e
+    if error is None:
+        status, msg = _write_workspace_file(work_dir, clean_path, content)
+        if status == "error":
+            error = msg
+    if error is not None:
+        state.record_edit(author, clean_path, error=str(error))
+        print(f"❌ Edit not applied: {clean_path}: {error}")
+        return True, None
+    estimator = get_token_estimator()
+    saved = max(0, estimator.count_text(content)[0] - estimator.count_text(code)[0])
+    state.record_edit(author, clean_path, tokens_saved=saved)
+    print(f"🩹 Applied {edit.kind} edit: {clean_path}")
+    return True, clean_path if status == "saved" else None
 
-def extract_and_save_code(work_dir, content):
+def save_code_block(work_dir, path, code, author=None):
+    """
+    保存对话中的一个文件代码块
+    - 统一 diff / SEARCH-REPLACE 块应用到现有文件，失败原因记录在 author 名下 (见 pop_edit_errors)
+    - 其余按整文件内容写入
+    :return: 实际写入时返回工作区相对路径，内容未变化、编辑失败或路径非法时返回 None
+    """
+    clean_path, _ = _workspace_key(path)
+    is_edit, saved_path = _apply_edit_block(work_dir, clean_path, code, author)
+    if is_edit:
+        return saved_path
+    status, msg = _write_workspace_file(work_dir, clean_path, code)
+    if status == "error":
+        print(f"   (Skipped invalid path: {clean_path})")
+    return clean_path if status == "saved" else None
+
+@traced("code.extract", "io")
+def extract_and_save_code(work_dir, content, author=None, skip_blocks=None):
     """
     从对话内容中提取代码块并保存
-    支持格式: #### path/to/file \n ```python ... ```
+    支持格式: #### path/to/file \n ```python ... ``` (代码块可以是整文件、统一 diff 或 SEARCH/REPLACE)
+    :param author: 发言的 Agent，编辑失败原因记录在其名下
+    :param skip_blocks: 本条消息中已处理过的 (path, code)，例如流式输出时已保存/应用的块，不再重复处理
+    :return: 实际写入的文件列表 (内容未变化的文件不计入)
     """
-    lines = content.split('\n')
     saved_files = []
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        path_match = re.match(r'^#{1,4}\s+`?(.+?)`?\s*$', line)
-        if path_match:
-            path = path_match.group(1).strip()
-            # 过滤掉普通标题，只处理看起来像文件路径的
-            # 简单的启发式：包含 '.' 或者 '/'
-            if not ('.' in path or '/' in path or '\\' in path):
-                i += 1
-                continue
-                
-            j = i + 1
-            code_lines = []
-            found_block = False
-            
-            while j < len(lines):
-                if lines[j].strip().startswith("```"):
-                    if not found_block: found_block = True
-                    else: break
-                elif found_block:
-                    code_lines.append(lines[j])
-                j += 1
-            
-            if found_block and code_lines:
-                clean_path = path.replace('workspace/', '').replace('workspace\\', '')
-                success, msg = save_code_to_file(work_dir, clean_path, "\n".join(code_lines))
-                if success:
-                    saved_files.append(clean_path)
-                else:
-                    print(f"   (Skipped invalid path: {clean_path})")
-            i = j
-        else:
-            i += 1
+
+    def on_block(path, code):
+        if skip_blocks and (path, code) in skip_blocks:
+            return
+        clean_path = save_code_block(work_dir, path, code, author)
+        if clean_path:
+            saved_files.append(clean_path)
+
+    extractor = CodeBlockExtractor(on_block=on_block)
+    extractor.feed(content)
+    extractor.close()
     return saved_files
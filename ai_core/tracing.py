@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 轻量级 Span 追踪，输出 Chrome Trace / Perfetto 可打开的 JSON，并汇总各阶段耗时。
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+class _NoopSpan:
+    """未启用追踪时的空 Span (共享单例，无任何开销)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start", "child_time")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.child_time = 0.0
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._pop(self, end)
+        return False
+
+    def set(self, **args):
+        """补充 Span 参数 (例如调用结束后才知道的 token 数)"""
+        self.args.update(args)
+
+class Tracer:
+    """
+    Span 记录器
+    - 事件在内存中缓冲，write() 时一次性写成 Chrome Trace JSON (ph="X" 完整事件)
+    - 同时按 Span 名称汇总次数、总耗时 (含子 Span) 与自身耗时 (扣除子 Span)
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: Trace 文件路径，None 表示只汇总不落盘
+        """
+        self.path = path
+        self.pid = os.getpid()
+        self._origin = time.perf_counter()
+        self._wall_start = time.time()
+        self._events = []
+        self._stats = {}  # {name: [count, total, self_time, max]}
+        self._thread_names = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def span(self, name, cat="", **args):
+        return _Span(self, name, cat, args)
+
+    def _push(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+            tid = threading.get_ident()
+            with self._lock:
+                self._thread_names[tid] = threading.current_thread().name
+        stack.append(span)
+
+    def _pop(self, span, end):
+        stack = self._local.stack
+        # 协程交错时 (同一线程上的多个会话) Span 不一定按 LIFO 结束
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+        duration = end - span.start
+        if stack:
+            stack[-1].child_time += duration
+        event = {
+            "name": span.name,
+            "cat": span.cat,
+            "ph": "X",
+            "ts": round((span.start - self._origin) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+        }
+        if span.args:
+            event["args"] = {k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v)
+                             for k, v in span.args.items()}
+        with self._lock:
+            self._events.append(event)
+            stats = self._stats.setdefault(span.name, [0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] += duration - span.child_time
+            stats[3] = max(stats[3], duration)
+
+    def get_stats(self):
+        """
+        各阶段耗时汇总
+        :return: {"wall_seconds", "stages": {name: {count, total_seconds, self_seconds, max_seconds}}}
+        """
+        with self._lock:
+            stats = {name: list(v) for name, v in self._stats.items()}
+        return {
+            "wall_seconds": round(time.perf_counter() - self._origin, 3),
+            "stages": {
+                name: {
+                    "count": count,
+                    "total_seconds": round(total, 4),
+                    "self_seconds": round(self_time, 4),
+                    "max_seconds": round(longest, 4),
+                }
+                for name, (count, total, self_time, longest) in sorted(stats.items(), key=lambda kv: -kv[1][2])
+            },
+        }
+
+    def write(self):
+        """写出 Chrome Trace JSON (chrome://tracing、ui.perfetto.dev 可直接打开)"""
+        if not self.path:
+            return None
+        with self._lock:
+            events = list(self._events)
+            names = dict(self._thread_names)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "cyber-workforce"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in names.items()]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({
+                "traceEvents": metadata + events,
+                "displayTimeUnit": "ms",
+                "otherData": {"started": self._wall_start},
+            }, f, ensure_ascii=False)
+        return self.path
+
+def span(name, cat="", **args):
+    """
+    追踪一个阶段: with span("git.commit", "git", files=3): ...
+    未启用追踪时返回共享的空 Span
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.span(name, cat, **args)
+
+def traced(name=None, cat=""):
+    """函数装饰器版本的 span()，未启用时只多一次全局变量判断"""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with tracer.span(span_name, cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def tracing_enabled():
+    return _tracer is not None
+
+def enable_tracing(path=None):
+    """
+    开启进程级追踪 (已开启时返回 None，由首次开启者负责收尾)
+    :param path: Trace 文件路径，None 表示只汇总耗时
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is not None:
+            return None
+        _tracer = Tracer(path)
+        atexit.register(_write_at_exit, _tracer)
+        return _tracer
+
+def finish_tracing():
+    """关闭追踪并写出 Trace 文件，返回 (路径, 耗时汇总)"""
+    global _tracer
+    with _tracer_lock:
+        tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None, None
+    atexit.unregister(_write_at_exit)
+    return tracer.write(), tracer.get_stats()
+
+def _write_at_exit(tracer):
+    # 异常退出时仍保留已记录的 Span
+    try:
+        tracer.write()
+    except Exception:
+        pass
+
+def print_profile(stats, top=20):
+    """打印各阶段耗时表 (按自身耗时排序)"""
+    if not stats:
+        return
+    wall = stats["wall_seconds"] or 1e-9
+    print("\n" + "=" * 78)
+    print(f"⏱️  Profile - wall {stats['wall_seconds']:.2f}s")
+    print("=" * 78)
+    print(f"{'Stage':<32}{'Count':>7}{'Total(s)':>11}{'Self(s)':>10}{'Self%':>8}{'Max(s)':>10}")
+    for name, s in list(stats["stages"].items())[:top]:
+        print(f"{name[:31]:<32}{s['count']:>7}{s['total_seconds']:>11.3f}{s['self_seconds']:>10.3f}"
+              f"{s['self_seconds'] / wall:>8.1%}{s['max_seconds']:>10.3f}")
+    print("=" * 78 + "\n")
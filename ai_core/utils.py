@@ -1,28 +1,20 @@
-# 版本: v1.1
+# 版本: v1.3
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-28
-# 总结: 升级配置加载逻辑，支持多模型JSON配置。
+# 日期: 2026-10-18
+# 总结: load_secrets_config 改由 config_service 提供缓存、校验后的只读快照。
 
 import os
-import json
+
+from .config_service import get_config_service
 
 def load_secrets_config():
     """
-    加载 secrets/config.json 的完整内容
+    加载 secrets/config.json 的完整内容 (只读快照，文件未修改时直接复用缓存)
+    环境变量 CYBER_SECRETS_PATH 可指定其他配置文件
+    :raises ConfigError: 配置无法解析或校验失败
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__)) # ai_core/
-    root_dir = os.path.dirname(current_dir) # AutoGenTest/
-    secret_path = os.path.join(root_dir, "secrets", "config.json")
-
-    if os.path.exists(secret_path):
-        try:
-            with open(secret_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Warning: Failed to read secrets/config.json: {e}")
-    
-    return None
+    return get_config_service().secrets()
 
 def get_model_config(config_data, alias=None):
     """
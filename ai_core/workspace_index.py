@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 工作区内存索引 (路径/大小/行数/哈希/符号大纲)，随 save_code_to_file 增量更新，供 list_workspace 工具返回紧凑清单。
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+from .tools import get_workspace_state
+
+# 不进入索引的目录 (对话日志、版本库与依赖/构建产物)
+SKIP_DIRS = {".git", "logs", "__pycache__", "node_modules", ".venv", "venv", "build", "dist"}
+# 超过该大小的文件只记录大小与哈希，不提取符号
+MAX_OUTLINE_BYTES = 512 * 1024
+
+_C_KEYWORDS = {"if", "for", "while", "switch", "return", "sizeof", "else"}
+
+# 扩展名 -> 符号正则 (只取顶层定义，每个匹配取第一个非空分组)
+OUTLINE_PATTERNS = {
+    ".py": r"^(?:async\s+def|def|class)\s+(\w+)",
+    ".js": r"^(?:export\s+(?:default\s+)?)?(?:async\s+)?(?:function\*?|class)\s+(\w+)"
+           r"|^export\s+(?:const|let|var)\s+(\w+)",
+    ".go": r"^func\s+(?:\([^)]*\)\s*)?(\w+)|^type\s+(\w+)",
+    ".c": r"^(?:typedef\s+)?(?:struct|enum|union)\s+(\w+)\s*\{"
+          r"|^[A-Za-z_][\w \t\*]*?[\s\*](\w+)\s*\([^;]*\)\s*\{?\s*$",
+    ".md": r"^#{1,2}\s+(.+?)\s*$",
+}
+for _ext in (".ts", ".jsx", ".tsx", ".mjs"):
+    OUTLINE_PATTERNS[_ext] = OUTLINE_PATTERNS[".js"]
+for _ext in (".h", ".cpp", ".hpp", ".cc"):
+    OUTLINE_PATTERNS[_ext] = OUTLINE_PATTERNS[".c"]
+_OUTLINE_RE = {ext: re.compile(p, re.MULTILINE) for ext, p in OUTLINE_PATTERNS.items()}
+
+_index_lock = threading.Lock()
+
+def outline(rel_path, text, max_symbols=None):
+    """按扩展名提取文件的顶层符号名，未知类型返回空列表"""
+    pattern = _OUTLINE_RE.get(os.path.splitext(rel_path)[1].lower())
+    if pattern is None:
+        return []
+    symbols = []
+    for match in pattern.finditer(text):
+        name = next((g for g in match.groups() if g), None)
+        if not name or name in _C_KEYWORDS or name in symbols:
+            continue
+        symbols.append(name)
+        if max_symbols and len(symbols) >= max_symbols:
+            break
+    return symbols
+
+def _format_size(size):
+    if size < 1024:
+        return f"{size}B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f}K"
+    return f"{size / (1024 * 1024):.1f}M"
+
+class IndexEntry:
+    __slots__ = ("path", "size", "lines", "digest", "symbols")
+
+    def __init__(self, path, size, lines, digest, symbols):
+        self.path = path
+        self.size = size
+        self.lines = lines
+        self.digest = digest
+        self.symbols = symbols
+
+    def manifest_line(self, max_symbols):
+        line = f"{self.path} {_format_size(self.size)} {self.lines}L {self.digest[:10]}"
+        if self.symbols:
+            shown = self.symbols[:max_symbols]
+            more = len(self.symbols) - len(shown)
+            line += " | " + ", ".join(shown) + (f" +{more}" if more > 0 else "")
+        return line
+
+class WorkspaceIndex:
+    """
+    单个工作区的文件索引
+    - 首次查询时扫描一次磁盘 (断点续跑时已有的文件)，之后只随工作区写入增量更新
+    - 哈希与 'path@hash' 引用、WorkspaceState.content_hashes 使用同一 sha1，前 10 位可直接对照
+    """
+
+    def __init__(self, work_dir, max_symbols=40):
+        self.work_dir = os.path.abspath(work_dir)
+        self.max_symbols = max_symbols
+        self._entries = {}
+        self._scanned = False
+        self._lock = threading.Lock()
+        self.scan_seconds = 0.0
+        self.updates = 0
+        self.manifests = 0
+
+    def _build_entry(self, rel_path, data, digest=None):
+        symbols = []
+        if len(data) <= MAX_OUTLINE_BYTES:
+            try:
+                symbols = outline(rel_path, data.decode("utf-8"), self.max_symbols)
+            except UnicodeDecodeError:
+                pass
+        return IndexEntry(rel_path, len(data), data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0),
+                          digest or hashlib.sha1(data).hexdigest(), symbols)
+
+    def _scan(self):
+        """调用方持有 self._lock"""
+        start = time.perf_counter()
+        for root, dirs, files in os.walk(self.work_dir):
+            dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, self.work_dir).replace("\\", "/")
+                try:
+                    with open(full_path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                self._entries[rel_path] = self._build_entry(rel_path, data)
+        self._scanned = True
+        self.scan_seconds = time.perf_counter() - start
+
+    def update(self, rel_path, content, digest=None):
+        """工作区写入后调用 (content 为写入的文本)"""
+        entry = self._build_entry(rel_path, content.encode("utf-8"), digest)
+        with self._lock:
+            self._entries[rel_path] = entry
+            self.updates += 1
+
+    def entries(self, path_prefix=""):
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            prefix = (path_prefix or "").strip().replace("\\", "/")
+            while prefix.startswith("./"):
+                prefix = prefix[2:]
+            return sorted((e for p, e in self._entries.items() if p.startswith(prefix)), key=lambda e: e.path)
+
+    def manifest(self, path_prefix="", max_entries=200, max_symbols=12):
+        """
+        紧凑清单：每个文件一行 '路径 大小 行数 哈希 | 符号'
+        :param max_entries: 超出时截断并提示用 path_prefix 缩小范围
+        """
+        entries = self.entries(path_prefix)
+        with self._lock:
+            self.manifests += 1
+        if not entries:
+            return f"No files under '{path_prefix}'." if path_prefix else "Workspace is empty."
+        total = sum(e.size for e in entries)
+        lines = [f"# {len(entries)} files, {_format_size(total)} (path size lines sha1 | symbols)"]
+        lines.extend(e.manifest_line(max_symbols) for e in entries[:max_entries])
+        if len(entries) > max_entries:
+            lines.append(f"... {len(entries) - max_entries} more files, narrow with path_prefix")
+        return "\n".join(lines)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": sum(e.size for e in self._entries.values()),
+                "scan_seconds": round(self.scan_seconds, 4),
+                "updates": self.updates,
+                "manifests": self.manifests,
+            }
+
+def get_workspace_index(work_dir):
+    """获取 (或创建) 工作区索引，创建后 save_code_to_file 的每次写入都会同步更新它"""
+    state = get_workspace_state(work_dir)
+    with _index_lock:
+        if state.index is None:
+            state.index = WorkspaceIndex(state.work_dir)
+        return state.index
@@ -0,0 +1,80 @@
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 测量 main.py 在各种快速退出路径下的冷启动耗时，以及是否加载了 autogen / openai。
+
+"""
+用法:
+    python benchmarks/bench_cold_start.py --runs 10
+
+每个场景在新的 Python 进程中执行 main.py (runpy)，记录进程总耗时的中位数，
+并报告结束时 sys.modules 中是否出现重量级依赖。
+- help / arg_error / missing_task / design_missing_task: 参数错误与任务文件缺失等失败路径
+- import_runner: 直接导入 ai_core.runner 作为对照 (组建公司前必然付出的导入成本)
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("autogen", "openai", "tiktoken")
+
+SCENARIOS = {
+    "help": ["--help"],
+    "arg_error": ["--task", "my_tasks/web_sample.txt"],
+    "missing_task": ["--company", "companies/startup.json", "--task", "my_tasks/__missing__.md"],
+    "design_missing_task": ["--design", "--task", "my_tasks/__missing__.md"],
+}
+
+PROBE = """
+import runpy, sys
+sys.argv = {argv!r}
+try:
+    {body}
+except SystemExit:
+    pass
+except Exception as e:
+    print("__ERROR__", type(e).__name__, e)
+print("__HEAVY__", ",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+def _probe(argv=None, body=None):
+    body = body or "runpy.run_path('main.py', run_name='__main__')"
+    return PROBE.format(argv=["main.py"] + (argv or []), body=body, heavy=HEAVY_MODULES)
+
+def run_scenario(code, runs):
+    timings, heavy, error = [], "", None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+        for line in result.stdout.splitlines():
+            if line.startswith("__HEAVY__"):
+                heavy = line[len("__HEAVY__"):].strip()
+            elif line.startswith("__ERROR__"):
+                error = line[len("__ERROR__"):].strip()
+    return statistics.median(timings), heavy, error
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    scenarios = {name: _probe(argv) for name, argv in SCENARIOS.items()}
+    scenarios["import_runner"] = _probe(body="import ai_core.runner")
+
+    print(f"{'Scenario':<22}{'Median (ms)':>13}  Heavy modules loaded")
+    for name, code in scenarios.items():
+        median, heavy, error = run_scenario(code, args.runs)
+        note = heavy or "-"
+        if error:
+            note += f"  (error: {error})"
+        print(f"{name:<22}{median * 1000:>13.1f}  {note}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 对比逐文件提交与按轮合并提交在大工作区上的 Hook 耗时。
+
+"""
+用法:
+    python benchmarks/bench_commit_coalescing.py --filler 5000 --messages 10 --files-per-message 12
+
+模拟 logged_append 中的代码提取：每条消息写入若干文件。
+- legacy: 每个文件执行 git add . + git commit (旧行为)
+- coalesced: 登记路径，每条消息只暂存变更路径并提交一次
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_core.tools import init_workspace, save_code_to_file, enable_commit_coalescing, flush_workspace
+
+def _make_workspace(root, filler):
+    """创建带大量已提交文件的工作区"""
+    init_workspace(root)
+    filler_dir = os.path.join(root, "src", "vendor")
+    os.makedirs(filler_dir, exist_ok=True)
+    for i in range(filler):
+        with open(os.path.join(filler_dir, f"mod_{i}.py"), "w", encoding="utf-8") as f:
+            f.write(f"VALUE_{i} = {i}\n")
+    subprocess.run(["git", "add", "."], cwd=root, capture_output=True)
+    subprocess.run(["git", "commit", "-q", "-m", "filler"], cwd=root, capture_output=True)
+
+def _legacy_save(work_dir, rel_path, content):
+    """旧实现: 写文件后 git add . + commit"""
+    full_path = os.path.join(work_dir, rel_path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    subprocess.run(["git", "add", "."], cwd=work_dir, capture_output=True)
+    subprocess.run(["git", "commit", "-m", f"Auto-save: {rel_path}"], cwd=work_dir, capture_output=True)
+
+def run_legacy(work_dir, messages, files_per_message):
+    start = time.perf_counter()
+    for m in range(messages):
+        for k in range(files_per_message):
+            _legacy_save(work_dir, f"src/app/file_{k}.py", f"# msg {m}\nX = {m * k}\n")
+    return time.perf_counter() - start
+
+def run_coalesced(work_dir, messages, files_per_message):
+    committer = enable_commit_coalescing(work_dir)
+    start = time.perf_counter()
+    for m in range(messages):
+        for k in range(files_per_message):
+            save_code_to_file(work_dir, f"src/app/file_{k}.py", f"# msg {m}\nX = {m * k}\n")
+        committer.commit(round_num=m + 1, author="Bench")
+    flush_workspace(work_dir)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Commit coalescing benchmark")
+    parser.add_argument("--filler", type=int, default=5000, help="Pre-existing files in workspace")
+    parser.add_argument("--messages", type=int, default=10, help="Simulated chat messages")
+    parser.add_argument("--files-per-message", type=int, default=12, help="Files saved per message")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_dir = os.path.join(tmp, "legacy")
+        coalesced_dir = os.path.join(tmp, "coalesced")
+        _make_workspace(legacy_dir, args.filler)
+        _make_workspace(coalesced_dir, args.filler)
+
+        # 屏蔽 save_code_to_file 的逐文件打印，只保留结果
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            legacy = run_legacy(legacy_dir, args.messages, args.files_per_message)
+            coalesced = run_coalesced(coalesced_dir, args.messages, args.files_per_message)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    per_msg_legacy = legacy / args.messages * 1000
+    per_msg_coalesced = coalesced / args.messages * 1000
+    print("=" * 60)
+    print(f"Workspace: {args.filler} files, {args.messages} messages x {args.files_per_message} files")
+    print("=" * 60)
+    print(f"{'mode':<12}{'total (s)':>12}{'per message (ms)':>20}")
+    print(f"{'legacy':<12}{legacy:>12.3f}{per_msg_legacy:>20.1f}")
+    print(f"{'coalesced':<12}{coalesced:>12.3f}{per_msg_coalesced:>20.1f}")
+    if coalesced > 0:
+        print(f"Speedup: {legacy / coalesced:.1f}x, hook time saved per message: {per_msg_legacy - per_msg_coalesced:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# 版本: v1.2
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 文件写入数取自 run_company 返回摘要的 workspace_writes (会话结束后工作区状态已释放)。
+
+"""
+用法:
+    python benchmarks/bench_company.py                       # 运行全部脚本并与基线对比
+    python benchmarks/bench_company.py --rounds 30 --repeat 3
+    python benchmarks/bench_company.py --save-baseline       # 把本次结果写为新基线
+    python benchmarks/bench_company.py --fail-on-regression  # 有回归时退出码为 1 (CI)
+    python benchmarks/bench_company.py --stream              # 开启流式输出，额外报告首 token 耗时
+
+流程 (每个 benchmarks/transcripts/*.json 脚本):
+1. 启动本地 OpenAI 兼容模拟服务 (mock_openai_server.py)，按脚本返回回复
+2. 生成临时 secrets 配置 (通过 CYBER_SECRETS_PATH 指定)，所有模型指向模拟服务，关闭响应缓存与预算
+3. 在临时目录中用 companies/startup.json 运行 run_company，开启 Span 追踪收集各阶段耗时
+4. 输出 rounds/sec、每条消息的 Hook 开销、文件写入数、Git 耗时与峰值 RSS
+
+需要安装 requirements.txt 中的依赖 (pyautogen)；不访问任何外部 API。
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openai_server import MockOpenAIServer, load_script
+
+DEFAULT_COMPANY = os.path.join(ROOT, "companies", "startup.json")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline_company.json")
+TRANSCRIPT_DIR = os.path.join(ROOT, "benchmarks", "transcripts")
+BENCH_TASK = "开发一个待办事项 Web 应用，支持增删改查与标签过滤。"
+
+# 指标 -> 数值越大越好 (True) / 越小越好 (False)
+METRICS = {
+    "rounds_per_sec": True,
+    "hook_ms_per_message": False,
+    "git_ms_total": False,
+    "files_written": None,  # 只展示，不判定回归
+    "peak_rss_mb": False,
+    "ttft_ms_p50": False,
+}
+
+def _bench_secrets(base_url, stream=False):
+    """所有模型指向模拟服务的临时配置"""
+    models = {
+        alias: {"provider": "mock", "model": f"mock-{alias}", "api_key": "mock", "base_url": base_url}
+        for alias in ("qwen_max", "qwen_turbo")
+    }
+    return {
+        "default_model": "qwen_max",
+        "models": models,
+        "budget_control": {"enabled": False},
+        "llm_cache": {"enabled": False},
+        "streaming": {"enabled": stream, "echo": False},
+    }
+
+def _bench_company(company_path, out_dir, rounds):
+    """复制公司配置：prompt_file 改为绝对路径，覆盖最大轮次"""
+    with open(company_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    for role in config.get("roles", []):
+        prompt_file = role.get("prompt_file")
+        if prompt_file and not os.path.isabs(prompt_file):
+            role["prompt_file"] = os.path.join(ROOT, prompt_file)
+    if rounds:
+        config.setdefault("process", {})["max_round"] = rounds
+    path = os.path.join(out_dir, "company.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return path
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_once(transcript_path, company_path, rounds, stream=False):
+    """运行一次完整公司会话，返回指标"""
+    from ai_core.runner import run_company
+    from ai_core.tracing import enable_tracing, finish_tracing
+
+    tmp_root = tempfile.mkdtemp(prefix="cyber_bench_")
+    old_cwd = os.getcwd()
+    old_secrets = os.environ.get("CYBER_SECRETS_PATH")
+    server = MockOpenAIServer(load_script(transcript_path)).start()
+    try:
+        secrets_path = os.path.join(tmp_root, "config.json")
+        with open(secrets_path, "w", encoding="utf-8") as f:
+            json.dump(_bench_secrets(server.base_url, stream), f)
+        os.environ["CYBER_SECRETS_PATH"] = secrets_path
+        company = _bench_company(company_path, tmp_root, rounds)
+        work_dir = os.path.join(tmp_root, "projects", "bench", "workspace")
+        # 日志与 Token 报告写到临时目录
+        os.chdir(tmp_root)
+
+        enable_tracing()
+        start = time.perf_counter()
+        summary = run_company(company, BENCH_TASK, work_dir) or {}
+        elapsed = time.perf_counter() - start
+        _, trace = finish_tracing()
+    finally:
+        os.chdir(old_cwd)
+        if old_secrets is None:
+            os.environ.pop("CYBER_SECRETS_PATH", None)
+        else:
+            os.environ["CYBER_SECRETS_PATH"] = old_secrets
+        server.stop()
+
+    stages = (trace or {}).get("stages", {})
+    rounds_done = summary.get("total_rounds", 0)
+    messages = stages.get("hook.append", {}).get("count", 0) or rounds_done
+    hook_seconds = sum(stages.get(name, {}).get("total_seconds", 0.0) for name in ("hook.append", "hook.side_effects"))
+    write_stats = summary.get("workspace_writes", {})
+    ttft = summary.get("streaming", {}).get("ttft_p50_s")
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    return {
+        "rounds": rounds_done,
+        "model_calls": server.calls,
+        "seconds": round(elapsed, 3),
+        "rounds_per_sec": round(rounds_done / elapsed, 3) if elapsed else 0.0,
+        "hook_ms_per_message": round(hook_seconds * 1000 / messages, 3) if messages else 0.0,
+        "git_ms_total": round(stages.get("git.commit", {}).get("total_seconds", 0.0) * 1000, 1),
+        "files_written": write_stats.get("written", 0),
+        "peak_rss_mb": _peak_rss_mb(),
+        "ttft_ms_p50": round(ttft * 1000, 1) if ttft is not None else None,
+    }
+
+def _median(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else round((values[mid - 1] + values[mid]) / 2, 3)
+
+def compare(results, baseline, tolerance):
+    """与基线对比，返回回归列表 [(脚本, 指标, 基线值, 当前值, 变化比例)]"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base.get(metric), current.get(metric)
+            if higher_is_better is None or not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+def print_results(results, baseline):
+    print("\n" + "=" * 86)
+    print("🏁 Company benchmark (offline, mock OpenAI server)")
+    print("=" * 86)
+    print(f"{'Transcript':<16}{'Rounds':>8}{'Rounds/s':>11}{'Hook ms/msg':>13}{'Git ms':>10}{'Files':>8}"
+          f"{'Peak RSS MB':>13}{'TTFT ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['rounds']:>8}{r['rounds_per_sec']:>11.2f}{r['hook_ms_per_message']:>13.2f}"
+              f"{r['git_ms_total']:>10.1f}{r['files_written']:>8}{str(r['peak_rss_mb']):>13}"
+              f"{str(r.get('ttft_ms_p50') or '-'):>10}")
+        base = baseline.get(name)
+        if base:
+            print(f"{'  baseline':<16}{base.get('rounds', 0):>8}{base.get('rounds_per_sec', 0):>11.2f}"
+                  f"{base.get('hook_ms_per_message', 0):>13.2f}{base.get('git_ms_total', 0):>10.1f}"
+                  f"{base.get('files_written', 0):>8}{str(base.get('peak_rss_mb')):>13}"
+                  f"{str(base.get('ttft_ms_p50') or '-'):>10}")
+    print("=" * 86)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end company benchmark")
+    parser.add_argument("--company", default=DEFAULT_COMPANY, help="公司配置 JSON")
+    parser.add_argument("--transcripts", nargs="*", help="回复脚本 (默认 benchmarks/transcripts/*.json)")
+    parser.add_argument("--rounds", type=int, default=20, help="每次运行的最大轮次")
+    parser.add_argument("--repeat", type=int, default=1, help="每个脚本运行次数 (取中位数)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例 (默认 20%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果写为基线")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有回归时以退出码 1 结束")
+    parser.add_argument("--stream", action="store_true", help="开启流式输出 (模拟服务按 chunk 返回)，报告首 token 耗时")
+    args = parser.parse_args()
+
+    transcripts = args.transcripts or sorted(glob.glob(os.path.join(TRANSCRIPT_DIR, "*.json")))
+    results = {}
+    for path in transcripts:
+        name = os.path.splitext(os.path.basename(path))[0]
+        runs = [run_once(path, args.company, args.rounds, args.stream) for _ in range(args.repeat)]
+        results[name] = {key: _median([r[key] for r in runs]) for key in runs[0]}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Baseline saved: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("ℹ️ No baseline yet, run with --save-baseline to create one.")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, old, new, change in regressions:
+        print(f"⚠️ Regression [{name}] {metric}: {old} -> {new} ({change:+.1%})")
+    if not regressions:
+        print(f"✅ No regressions beyond {args.tolerance:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
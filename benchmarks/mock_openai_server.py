@@ -0,0 +1,233 @@
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 支持 stream=true 的 SSE 流式回复 (可配置 chunk 大小与间隔)，用于测量首 token 耗时。
+
+"""
+用法:
+    python benchmarks/mock_openai_server.py --port 8765 --transcript benchmarks/transcripts/code_heavy.json
+
+只实现 POST /v1/chat/completions (支持 stream=true 的 SSE 流式回复)，仅依赖标准库。
+回复脚本 (transcript JSON):
+{
+    "latency_ms": 50,            # 每次调用的固定延迟
+    "jitter_ms": 10,             # 叠加的均匀随机延迟 (固定种子，结果可复现)
+    "chunk_chars": 24,           # 流式回复每个 chunk 的字符数
+    "chunk_ms": 5,               # 流式回复相邻 chunk 的间隔 (首个 chunk 在上述延迟后发出)
+    "replies": [                 # 按调用顺序循环使用
+        {"text": "需求如下...", "words": 120},
+        {"files": 3, "lines": 60, "text": "实现如下:"}
+    ]
+}
+- words: 在 text 后追加的填充词数 (控制 completion token)
+- files/lines: 生成 files 个 "#### path + 代码块" 的文件，每个 lines 行 (代码密集回复)
+- 发言人选择请求 (AutoGen auto 模式) 按角色列表轮流返回角色名
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# AutoGen 0.2 发言人选择提示词中的角色列表行: "Name: description"
+ROLE_LINE_RE = re.compile(r'^(\w+): ', re.MULTILINE)
+SELECT_MARKER = "select the next role"
+
+DEFAULT_SCRIPT = {
+    "latency_ms": 0,
+    "jitter_ms": 0,
+    "replies": [{"text": "收到，继续推进。", "words": 40}],
+}
+
+class ScriptedReplies:
+    """按脚本生成确定性的回复 (线程安全)"""
+
+    def __init__(self, script=None, seed=0):
+        script = script or DEFAULT_SCRIPT
+        self.latency = script.get("latency_ms", 0) / 1000
+        self.jitter = script.get("jitter_ms", 0) / 1000
+        self.chunk_chars = max(1, script.get("chunk_chars", 24))
+        self.chunk_delay = script.get("chunk_ms", 0) / 1000
+        self.replies = script.get("replies") or DEFAULT_SCRIPT["replies"]
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self, messages):
+        """返回 (回复文本, 本次延迟秒数)"""
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        selection = _speaker_selection(messages, index)
+        if selection is not None:
+            return selection, delay
+        return render_reply(self.replies[index % len(self.replies)], index), delay
+
+def render_reply(spec, index):
+    """按回复规格生成文本"""
+    parts = [spec.get("text", "")]
+    words = spec.get("words", 0)
+    if words:
+        parts.append(" ".join(f"item{(index + i) % 97}" for i in range(words)))
+    for f in range(spec.get("files", 0)):
+        path = f"src/module_{f}.py"
+        body = "\n".join(f"    value_{i} = compute({i}, {index})  # step {i}" for i in range(spec.get("lines", 20)))
+        parts.append(f"#### {path}\n```python\ndef handler_{f}():\n{body}\n    return value_0\n```")
+    return "\n\n".join(p for p in parts if p)
+
+def _speaker_selection(messages, index):
+    """AutoGen auto 模式的发言人选择请求：按角色列表轮流返回"""
+    for m in messages:
+        content = m.get("content")
+        if m.get("role") == "system" and isinstance(content, str) and SELECT_MARKER in content:
+            roles = ROLE_LINE_RE.findall(content)
+            if roles:
+                return roles[index % len(roles)]
+    return None
+
+def approx_tokens(text):
+    """与 ai_core 的离线估算一致: UTF-8 字节数 / 4"""
+    return (len(text.encode("utf-8")) + 3) // 4
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send(400, {"error": {"message": f"invalid JSON: {e}"}})
+            return
+
+        messages = request.get("messages", [])
+        text, delay = self.server.replies.next(messages)
+        if delay:
+            time.sleep(delay)
+        prompt_tokens = sum(approx_tokens(str(m.get("content") or "")) + 4 for m in messages)
+        completion_tokens = approx_tokens(text)
+        head = {
+            "id": f"chatcmpl-mock-{self.server.replies.calls}",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._stream(head, text, usage if include_usage else None)
+            return
+        self._send(200, dict(head, object="chat.completion", usage=usage, choices=[{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }]))
+
+    def _stream(self, head, text, usage):
+        """SSE 流式回复: 按 chunk_chars 切分文本，最后一个 chunk 携带 finish_reason (及 usage)"""
+        replies = self.server.replies
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        pieces = [text[i:i + replies.chunk_chars] for i in range(0, len(text), replies.chunk_chars)]
+        events = [{"index": 0, "delta": {"role": "assistant", "content": p}, "finish_reason": None} for p in pieces]
+        events.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+        for i, choice in enumerate(events):
+            if i and replies.chunk_delay:
+                time.sleep(replies.chunk_delay)
+            self._event(dict(head, object="chat.completion.chunk", choices=[choice]))
+        if usage is not None:
+            self._event(dict(head, object="chat.completion.chunk", choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _event(self, payload):
+        self.wfile.write(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MockOpenAIServer:
+    """
+    在后台线程运行的模拟服务
+        with MockOpenAIServer(script) as server:
+            base_url = server.base_url
+    """
+
+    def __init__(self, script=None, host="127.0.0.1", port=0, seed=0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.replies = ScriptedReplies(script, seed=seed)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def calls(self):
+        return self.httpd.replies.calls
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+def load_script(path):
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--transcript", help="回复脚本 JSON")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(load_script(args.transcript), host=args.host, port=args.port)
+    print(f"🧪 Mock OpenAI server at {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
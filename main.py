@@ -1,100 +1,355 @@
-# 版本: v1.4
+# 版本: v2.2
 # 作者: wei-Aug2024
 # 邮箱: wei_qiao@tigerte.com
-# 日期: 2026-01-28
-# 总结: 增加 Windows 路径自动兼容处理，确保在 Docker (Linux) 中能正确读取文件。
+# 日期: 2026-10-18
+# 总结: 启动时经 config_service 校验 secrets 与公司配置，配置错误在组建团队前一次性报告。
 
 import argparse
+import hashlib
 import os
 import sys
+from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from ai_core.runner import run_project, run_company
-from ai_core.skills.team_builder import assess_and_build_team
-from ai_core.skills.ui_designer import generate_design_system
+# 只导入轻量模块；runner (autogen)、技能与 batch 在选定模式后才导入
+from ai_core.skill_registry import load_skill
+from ai_core.utils import load_secrets_config
+from ai_core.config_service import ConfigError, get_config_service
+from ai_core.tracing import enable_tracing, finish_tracing, print_profile
+from ai_core.session_archive import get_session_archive, start_recording, start_replay, finish_session_archive
+from ai_core.checkpoint import load_checkpoint
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Multi-AI Collaboration Runner")
-    
-    # 模式选择
-    group = parser.add_mutually_exclusive_group(required=True)
+
+    # 模式选择 (--resume 时可省略，公司配置取自检查点)
+    group = parser.add_mutually_exclusive_group()
     group.add_argument("--type", choices=["web", "embedded"], help="Legacy: Quick project type")
     group.add_argument("--company", help="Path to company config JSON")
     group.add_argument("--auto-team", action="store_true", help="Skill: Analyze task and build custom team automatically")
     group.add_argument("--design", action="store_true", help="Skill: Generate UI design system")
-    
+
     # 任务参数
-    parser.add_argument("--task", required=True, help="Path to task description file (.md)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--task", help="Path to task description file (.md)")
+    source.add_argument("--batch", help="Directory or glob of task files, run as parallel projects")
+    source.add_argument("--resume", metavar="PROJECT",
+                        help="Continue output/<PROJECT> from its last checkpointed round (company sessions)")
     parser.add_argument("--name", help="Project name (subfolder in output/), default is task filename")
-    
-    args = parser.parse_args()
-    
-    # 【Fix】路径兼容性处理：将 Windows 的 \ 转换为 Linux 的 /
-    # 因为 Docker 容器是 Linux 环境
-    task_path = args.task.replace("\\", "/")
-    
-    # 确定项目名称
-    project_name = args.name
+
+    # 批量参数 (默认值取 secrets/config.json 的 batch 段)
+    parser.add_argument("--workers", type=int, help="Batch: number of parallel projects")
+    parser.add_argument("--batch-budget", type=float, help="Batch: global cost budget (CNY) across all projects")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run company sessions on asyncio (batch: many sessions in one process)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write a Chrome/Perfetto trace to logs/ and print a per-stage time breakdown")
+
+    # 录制 / 回放 (仅 --company / --type 单任务)
+    archive = parser.add_mutually_exclusive_group()
+    archive.add_argument("--record", nargs="?", const="", metavar="PATH",
+                         help="Record every model request/response to a session archive (default logs/session_<ts>_<project>.jsonl)")
+    archive.add_argument("--replay", metavar="ARCHIVE",
+                         help="Re-run the session from a recorded archive: no network, no waits")
+    return parser
+
+def _file_sha1(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _start_archive(args, project_name, task_path):
+    """
+    --record / --replay 时开启会话归档
+    :return: 录制器/回放器；未开启或已由外层开启时返回 None
+    """
+    if get_session_archive() is not None or not (args.replay or args.record is not None):
+        return None
+    if args.replay:
+        archive = start_replay(args.replay)
+        recorded_sha1 = archive.meta.get("task_sha1")
+        if recorded_sha1 and recorded_sha1 != _file_sha1(task_path):
+            print("⚠️ Task file differs from the recorded session, replies may not match")
+        print(f"⏪ Replay: {args.replay} ({archive.total_calls} recorded calls)")
+        return archive
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = args.record or os.path.join("logs", f"session_{timestamp}_{project_name}.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    print(f"⏺️  Recording session: {path}")
+    return start_recording(path, project=project_name, company=args.company, type=args.type,
+                           task=task_path, task_sha1=_file_sha1(task_path))
+
+def _finish_archive():
+    stats = finish_session_archive()
+    if not stats:
+        return
+    if stats["mode"] == "record":
+        print(f"🎞️ Session recorded: {stats['path']} ({stats['calls']} calls, {stats['speakers']} speaker turns)")
+    else:
+        print(f"⏪ Replayed {stats['calls']}/{stats['recorded_calls']} calls "
+              f"({stats['mismatches']} matched by agent order instead of request)")
+
+def _validate_config(args):
+    """启动时校验 secrets 与 --company 配置，列出全部错误后退出 (结果缓存，后续会话直接复用)"""
+    service = get_config_service()
+    try:
+        service.secrets()
+        if args.company and os.path.exists(args.company.replace("\\", "/")):
+            service.company(args.company.replace("\\", "/"))
+    except ConfigError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+
+def _start_tracing(args, label):
+    """
+    --profile 或 secrets 中 tracing.enabled 时开启追踪
+    :return: Tracer；未开启或已由外层开启时返回 None
+    """
+    cfg = (load_secrets_config() or {}).get("tracing", {})
+    if not (args.profile or cfg.get("enabled", False)):
+        return None
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return enable_tracing(os.path.join(cfg.get("dir", "logs"), f"trace_{timestamp}_{label}.json"))
+
+def _finish_tracing(args):
+    path, stats = finish_tracing()
+    if path:
+        print(f"🧭 Trace saved: {path} (open in chrome://tracing or ui.perfetto.dev)")
+    if args.profile:
+        print_profile(stats)
+
+def _project_dirs(task_path, project_name=None):
+    """
+    确定项目名称与关键路径
+    ROOT/output/project_name/workspace
+    :return: (project_name, project_dir, workspace_dir)
+    """
     if not project_name:
         base_name = os.path.basename(task_path)
         project_name = os.path.splitext(base_name)[0]
-    
-    # 关键路径定义
-    # ROOT/output/project_name/workspace
-    root_dir = os.getcwd()
-    output_base = os.path.join(root_dir, "output")
-    project_dir = os.path.join(output_base, project_name)
-    workspace_dir = os.path.join(project_dir, "workspace")
-    
+    project_dir = os.path.join(os.getcwd(), "output", project_name)
+    return project_name, project_dir, os.path.join(project_dir, "workspace")
+
+def _task_result(project_name, summary=None, error=None):
+    result = {"project": project_name, "status": "failed" if error else "ok",
+              "rounds": 0, "cost_cny": 0.0, "error": error}
+    if summary:
+        result["rounds"] = summary.get("total_rounds", 0)
+        result["cost_cny"] = summary.get("total_cost_cny", 0.0)
+        if summary.get("stop_reason"):
+            result["stop_reason"] = summary["stop_reason"]
+    return result
+
+def run_task(args, task_path, project_name=None, budget_limit=None):
+    """
+    运行单个任务 (按需开启追踪，批量模式下每个子进程各自输出 Trace)
+    :return: 结果字典 {project, status, rounds, cost_cny, error}
+    """
+    name = _project_dirs(task_path, project_name)[0]
+    tracer = _start_tracing(args, name)
+    archive = _start_archive(args, name, task_path)
+    try:
+        return _run_task(args, task_path, project_name, budget_limit)
+    finally:
+        if archive is not None:
+            _finish_archive()
+        if tracer is not None:
+            _finish_tracing(args)
+
+def _run_task(args, task_path, project_name=None, budget_limit=None):
+    project_name, project_dir, workspace_dir = _project_dirs(task_path, project_name)
+
     if not os.path.exists(task_path):
         print(f"❌ Task file not found: {task_path}")
         # 调试信息：列出当前文件，帮助用户排查挂载问题
         print(f"   (Current Dir: {os.getcwd()})")
         print(f"   (Available: {os.listdir(os.getcwd())})")
-        return
-        
+        return _task_result(project_name, error="task file not found")
+
     with open(task_path, 'r', encoding='utf-8') as f:
         task_content = f.read()
 
     print(f"📋 Project: {project_name}")
     print(f"💾 Output:  {workspace_dir}")
     print("--------------------------------------------------")
-    
+
     # 执行逻辑
+    summary = None
     if args.design:
         print("🎨 Mode:    UI Design System Generation")
         design_output = os.path.join(project_dir, "design_system.md")
+        generate_design_system = load_skill("ui_designer")
         success = generate_design_system(task_content, design_output)
         if success:
             print(f"✅ Design system generated: {design_output}")
         else:
             print("❌ Design generation failed.")
-            
+            return _task_result(project_name, error="design generation failed")
+
     elif args.auto_team:
         print("🧠 Mode:    Auto-Team Building (AI Skill)")
         # 自动生成的配置也保存在 output 目录下，保持 source 干净
         config_path = os.path.join(project_dir, "company_config.json")
-        
+
+        assess_and_build_team = load_skill("team_builder")
         success = assess_and_build_team(task_content, config_path)
         if success:
+            from ai_core.runner import run_company
             print(f"🏢 Team Assembled! Config saved to: {config_path}")
-            run_company(config_path, task_content, workspace_dir)
+            summary = run_company(config_path, task_content, workspace_dir, budget_limit=budget_limit)
         else:
             print("❌ Team building failed.")
-            
+            return _task_result(project_name, error="team building failed")
+
     elif args.company:
         print(f"🏢 Mode:    Manual Company Config ({args.company})")
         # 同样处理 company config 路径
         company_path = args.company.replace("\\", "/")
         if not os.path.exists(company_path):
              print(f"❌ Company config not found: {company_path}")
-             return
-        run_company(company_path, task_content, workspace_dir)
-        
+             return _task_result(project_name, error="company config not found")
+        from ai_core.runner import run_company
+        summary = run_company(company_path, task_content, workspace_dir, budget_limit=budget_limit)
+
     else:
         print(f"📂 Mode:    Legacy Type ({args.type})")
-        run_project(args.type, task_content, workspace_dir)
+        from ai_core.runner import run_project
+        summary = run_project(args.type, task_content, workspace_dir, budget_limit=budget_limit)
+
+    return _task_result(project_name, summary)
+
+async def run_task_async(args, task_path, project_name=None, budget_limit=None):
+    """
+    run_task 的异步版本：公司模式 (--company / --auto-team) 走 run_company_async，
+    其余模式在线程中执行同步流程
+    """
+    import asyncio
+    if not (args.company or args.auto_team):
+        return await asyncio.to_thread(run_task, args, task_path, project_name, budget_limit)
+
+    project_name, project_dir, workspace_dir = _project_dirs(task_path, project_name)
+    if not os.path.exists(task_path):
+        print(f"❌ Task file not found: {task_path}")
+        return _task_result(project_name, error="task file not found")
+
+    with open(task_path, 'r', encoding='utf-8') as f:
+        task_content = f.read()
+
+    print(f"📋 Project: {project_name} (async)")
+    print(f"💾 Output:  {workspace_dir}")
+
+    if args.auto_team:
+        company_path = os.path.join(project_dir, "company_config.json")
+        success = await asyncio.to_thread(load_skill("team_builder"), task_content, company_path)
+        if not success:
+            print("❌ Team building failed.")
+            return _task_result(project_name, error="team building failed")
+    else:
+        company_path = args.company.replace("\\", "/")
+        if not os.path.exists(company_path):
+            print(f"❌ Company config not found: {company_path}")
+            return _task_result(project_name, error="company config not found")
+
+    from ai_core.runner import run_company_async
+    summary = await run_company_async(company_path, task_content, workspace_dir, budget_limit=budget_limit)
+    return _task_result(project_name, summary)
+
+def resume_task(args, project_name):
+    """
+    从 output/<项目>/checkpoint.json 续跑：任务与公司配置取自检查点 (--company 可覆盖)
+    :return: 结果字典 {project, status, rounds, cost_cny, error}
+    """
+    _, _, workspace_dir = _project_dirs("", project_name)
+    state = load_checkpoint(workspace_dir)
+    if state is None:
+        print(f"❌ No checkpoint found for project: {project_name}")
+        return _task_result(project_name, error="checkpoint not found")
+
+    company_path = (args.company or state["company"]).replace("\\", "/")
+    print(f"📋 Project: {project_name} (resume from round {state['round']}, status: {state.get('status')})")
+    print(f"🏢 Company: {company_path}")
+    print(f"💾 Output:  {workspace_dir}")
+    print("--------------------------------------------------")
+    from ai_core.runner import run_company, run_company_async
+    if args.use_async:
+        import asyncio
+        summary = asyncio.run(run_company_async(company_path, state["task"], workspace_dir, resume=True))
+    else:
+        summary = run_company(company_path, state["task"], workspace_dir, resume=True)
+    if summary is None:
+        return _task_result(project_name, error="nothing to resume")
+    return _task_result(project_name, summary)
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if not (args.resume or args.type or args.company or args.auto_team or args.design):
+        parser.error("one of the arguments --type --company --auto-team --design is required")
+    if args.resume and (args.type or args.auto_team or args.design):
+        parser.error("--resume continues a company session, use --company (optional) to override its config")
+    if (args.record is not None or args.replay) and (args.batch or args.auto_team or args.design):
+        parser.error("--record / --replay only support a single --task with --company or --type")
+    _validate_config(args)
+
+    if args.resume:
+        tracer = _start_tracing(args, args.resume)
+        archive = _start_archive(args, args.resume, "")
+        try:
+            resume_task(args, args.resume)
+        finally:
+            if archive is not None:
+                _finish_archive()
+            if tracer is not None:
+                _finish_tracing(args)
+        return
+
+    if args.batch:
+        from ai_core.batch import discover_tasks, run_batch, run_batch_async
+        batch_cfg = (load_secrets_config() or {}).get("batch", {})
+        tasks = discover_tasks(args.batch)
+        if not tasks:
+            print(f"❌ No task files found for batch: {args.batch}")
+            return
+        workers = args.workers or batch_cfg.get("workers", 4)
+        budget = args.batch_budget if args.batch_budget is not None else batch_cfg.get("max_cost_cny")
+        print(f"📦 Batch: {len(tasks)} tasks, {workers} workers, budget: {budget if budget is not None else 'unlimited'}")
+        batch_kwargs = {
+            "output_base": os.path.join(os.getcwd(), "output"),
+            "workers": workers,
+            "budget_limit": budget,
+            "model_concurrency": batch_cfg.get("model_concurrency"),
+        }
+        if args.use_async:
+            import asyncio
+            tracer = _start_tracing(args, "batch")
+            try:
+                asyncio.run(run_batch_async(run_task_async, args, tasks, **batch_kwargs))
+            finally:
+                if tracer is not None:
+                    _finish_tracing(args)
+        else:
+            run_batch(run_task, args, tasks, **batch_kwargs)
+        return
+
+    # 【Fix】路径兼容性处理：将 Windows 的 \ 转换为 Linux 的 /
+    # 因为 Docker 容器是 Linux 环境
+    task_path = args.task.replace("\\", "/")
+    if args.use_async:
+        import asyncio
+        name = _project_dirs(task_path, args.name)[0]
+        tracer = _start_tracing(args, name)
+        archive = _start_archive(args, name, task_path)
+        try:
+            asyncio.run(run_task_async(args, task_path, args.name))
+        finally:
+            if archive is not None:
+                _finish_archive()
+            if tracer is not None:
+                _finish_tracing(args)
+    else:
+        run_task(args, task_path, args.name)
 
 if __name__ == "__main__":
     main()
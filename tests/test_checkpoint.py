@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 逐轮检查点：消息追加写入与读取、残行忽略、旧格式兼容，以及续跑回退工作区前列出被丢弃的内容。
+
+import json
+import os
+import subprocess
+
+import pytest
+
+from ai_core.checkpoint import (
+    CHECKPOINT_FILE, SessionCheckpoint, checkpoint_path, load_checkpoint, messages_path, restore_workspace,
+)
+
+def _git(work_dir, *args):
+    return subprocess.run(["git", *args], cwd=work_dir, capture_output=True, text=True, check=True).stdout.strip()
+
+@pytest.fixture
+def work_dir(tmp_path):
+    path = tmp_path / "proj" / "workspace"
+    path.mkdir(parents=True)
+    _git(path, "init", "-q")
+    _git(path, "config", "user.email", "t@example.com")
+    _git(path, "config", "user.name", "t")
+    return str(path)
+
+def _message(i):
+    return {"role": "user", "name": f"A{i % 2}", "content": f"消息 {i}"}
+
+def _save(checkpoint, count):
+    messages = [_message(i) for i in range(count)]
+    checkpoint.save_round(count, messages, messages[-1]["name"], {"round_count": count})
+    return messages
+
+def test_rounds_append_only_new_messages(work_dir):
+    checkpoint = SessionCheckpoint(work_dir, "company.json", "task")
+    _save(checkpoint, 2)
+    size = os.path.getsize(messages_path(work_dir))
+    messages = _save(checkpoint, 5)
+
+    with open(messages_path(work_dir), encoding="utf-8") as f:
+        assert len(f.readlines()) == 5
+    assert os.path.getsize(messages_path(work_dir)) > size
+    with open(checkpoint_path(work_dir), encoding="utf-8") as f:
+        assert "messages" not in json.load(f)
+
+    state = load_checkpoint(work_dir)
+    assert state["messages"] == messages
+    assert state["round"] == 5 and state["tracker"] == {"round_count": 5}
+
+def test_lines_beyond_message_count_are_ignored(work_dir):
+    checkpoint = SessionCheckpoint(work_dir, "company.json", "task")
+    messages = _save(checkpoint, 3)
+    # 进程在写完消息之后、替换检查点之前被杀
+    with open(messages_path(work_dir), "a", encoding="utf-8") as f:
+        f.write(json.dumps(_message(3)) + "\n" + '{"partial": ')
+    assert load_checkpoint(work_dir)["messages"] == messages
+
+    # 续跑的新进程整体重写一次，之后继续追加
+    resumed = SessionCheckpoint(work_dir, "company.json", "task")
+    messages = _save(resumed, 4)
+    messages = _save(resumed, 6)
+    assert load_checkpoint(work_dir)["messages"] == messages
+
+def test_missing_messages_file_invalidates_checkpoint(work_dir):
+    _save(SessionCheckpoint(work_dir, "company.json", "task"), 2)
+    os.remove(messages_path(work_dir))
+    assert load_checkpoint(work_dir) is None
+
+def test_version_1_checkpoint_with_inline_messages(work_dir):
+    state = {"version": 1, "round": 1, "messages": [_message(0)], "task": "t"}
+    with open(os.path.join(os.path.dirname(work_dir), CHECKPOINT_FILE), "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    assert load_checkpoint(work_dir)["messages"] == [_message(0)]
+
+def test_restore_workspace_lists_what_is_discarded(work_dir, capsys):
+    with open(os.path.join(work_dir, "a.py"), "w") as f:
+        f.write("v1\n")
+    _git(work_dir, "add", "a.py")
+    _git(work_dir, "commit", "-q", "-m", "round 1")
+    head = _git(work_dir, "rev-parse", "HEAD")
+    with open(os.path.join(work_dir, "b.py"), "w") as f:
+        f.write("later\n")
+    _git(work_dir, "add", "b.py")
+    _git(work_dir, "commit", "-q", "-m", "round 2")
+
+    assert restore_workspace(work_dir, head)
+    out = capsys.readouterr().out
+    assert "discarding 1 later commit(s) and changes to 1 tracked file(s)" in out
+    assert "round 2" in out and "A\tb.py" in out
+    assert _git(work_dir, "rev-parse", "HEAD") == head
+    assert not os.path.exists(os.path.join(work_dir, "b.py"))
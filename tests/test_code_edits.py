@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.1
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 增量编辑块 (统一 diff / SEARCH-REPLACE) 的解析与应用，工作区中同一条消息内的去重，以及会话结束后释放工作区状态。
+
+import pytest
+
+from ai_core.code_edits import EditError, SearchReplaceEdit, UnifiedDiffEdit, parse_edit_block
+from ai_core.streaming import StreamSink
+from ai_core import tools
+from ai_core.tools import extract_and_save_code, get_workspace_state, pop_edit_errors, release_workspace_state
+
+ORIGINAL = "".join(f"line{i}\n" for i in range(1, 601))
+
+def _lines(text):
+    return text.split("\n")
+
+# ---- 统一 diff ----
+
+def test_diff_applies_hunks_with_offsets():
+    diff = (
+        "--- a/x.py\n+++ b/x.py\n"
+        "@@ -10,0 +11,1 @@\n+inserted\n"
+        "@@ -300,3 +301,3 @@\n line300\n-line301\n+LINE301\n line302\n"
+    )
+    edit = parse_edit_block("x.py", diff)
+    assert isinstance(edit, UnifiedDiffEdit)
+    lines = _lines(edit.apply(ORIGINAL))
+    assert lines[9:12] == ["line10", "inserted", "line11"]
+    assert lines[299:303] == ["line299", "line300", "LINE301", "line302"]
+    assert lines[-1] == ""  # 保留末尾换行
+
+def test_diff_hunk_with_wrong_line_numbers_is_located_by_context():
+    edit = parse_edit_block("x.py", "@@ -5,2 +5,2 @@\n line400\n-line401\n+X\n")
+    assert _lines(edit.apply(ORIGINAL))[399:402] == ["line400", "X", "line402"]
+
+def test_diff_prefers_match_nearest_to_header_line():
+    text = "a\nb\na\nb\n"
+    edit = parse_edit_block("x.py", "@@ -3,2 +3,2 @@\n a\n-b\n+c\n")
+    assert edit.apply(text) == "a\nb\na\nc\n"
+
+def test_diff_is_all_or_nothing():
+    diff = "@@ -1,1 +1,1 @@\n-line1\n+ONE\n@@ -50,1 +50,1 @@\n-missing\n+x\n"
+    edit = parse_edit_block("x.py", diff)
+    with pytest.raises(EditError, match="hunk 2"):
+        edit.apply(ORIGINAL)
+
+def test_diff_new_file_from_dev_null():
+    edit = parse_edit_block("n.py", "--- /dev/null\n+++ b/n.py\n@@ -0,0 +1,2 @@\n+a\n+b\n")
+    assert edit.new_file
+    assert edit.apply(None) == "a\nb\n"
+
+def test_diff_against_missing_file_fails():
+    edit = parse_edit_block("x.py", "@@ -1,1 +1,1 @@\n-a\n+b\n")
+    with pytest.raises(EditError, match="does not exist"):
+        edit.apply(None)
+
+def test_diff_rejects_multiple_files_and_deletion():
+    with pytest.raises(EditError, match="only one file"):
+        parse_edit_block("x.py", "--- a/x\n+++ b/x\n@@ -1 +1 @@\n-a\n+b\n--- a/y\n+++ b/y\n@@ -1 +1 @@\n-a\n+b\n")
+    with pytest.raises(EditError, match="deleting"):
+        parse_edit_block("x.py", "--- a/x.py\n+++ /dev/null\n@@ -1 +0,0 @@\n-a\n")
+
+def test_diff_keeps_missing_trailing_newline():
+    edit = parse_edit_block("x.py", "@@ -1,2 +1,2 @@\n a\n-b\n+c\n")
+    assert edit.apply("a\nb") == "a\nc"
+
+# ---- SEARCH/REPLACE ----
+
+def test_search_replace_applies_pairs_in_order():
+    block = (
+        "<<<<<<< SEARCH\nline10\nline11\n=======\nten\n>>>>>>> REPLACE\n"
+        "<<<<<<< SEARCH\n=======\ntail\n>>>>>>> REPLACE"
+    )
+    edit = parse_edit_block("x.py", block)
+    assert isinstance(edit, SearchReplaceEdit)
+    lines = _lines(edit.apply(ORIGINAL))
+    assert lines[8:11] == ["line9", "ten", "line12"]
+    assert lines[-2:] == ["tail", ""]
+
+def test_search_matching_several_places_is_rejected():
+    edit = parse_edit_block("x.py", "<<<<<<< SEARCH\ndup\n=======\nz\n>>>>>>> REPLACE")
+    with pytest.raises(EditError, match="matches 2 places"):
+        edit.apply("dup\nother\ndup\n")
+
+def test_search_replace_is_all_or_nothing():
+    block = (
+        "<<<<<<< SEARCH\nline5\n=======\nfive\n>>>>>>> REPLACE\n"
+        "<<<<<<< SEARCH\nnot in file\n=======\ny\n>>>>>>> REPLACE"
+    )
+    with pytest.raises(EditError, match="SEARCH block 2 was not found"):
+        parse_edit_block("x.py", block).apply(ORIGINAL)
+
+def test_search_tolerates_trailing_whitespace():
+    edit = parse_edit_block("x.py", "<<<<<<< SEARCH\nvalue = 1\n=======\nvalue = 2\n>>>>>>> REPLACE")
+    assert edit.apply("value = 1   \n") == "value = 2\n"
+
+def test_unterminated_search_replace_block():
+    with pytest.raises(EditError, match="unterminated"):
+        parse_edit_block("x.py", "<<<<<<< SEARCH\na\n=======\nb\n")
+
+# ---- 识别 ----
+
+@pytest.mark.parametrize("path, code", [
+    ("x.py", "print(1)\n"),
+    ("x.sql", "--- header comment\nselect 1;"),
+    ("fix.patch", "--- a/x\n+++ b/x\n@@ -1 +1 @@\n-a\n+b\n"),
+])
+def test_plain_blocks_are_not_edits(path, code):
+    assert parse_edit_block(path, code) is None
+
+# ---- 工作区：同一编辑只在同一条消息内去重 ----
+
+def _edit_message(path, block):
+    return f"#### {path}\n```python\n{block}\n```\n"
+
+SR_EDIT = "<<<<<<< SEARCH\nx = 1\n=======\nx = 2\n>>>>>>> REPLACE"
+
+def test_identical_edit_resent_after_failure_is_applied(tmp_path):
+    work_dir = str(tmp_path)
+    message = _edit_message("src/a.py", SR_EDIT)
+
+    assert extract_and_save_code(work_dir, message, "Dev") == []
+    assert "does not exist" in pop_edit_errors(work_dir, "Dev")[0]
+
+    extract_and_save_code(work_dir, "#### src/a.py\n```python\nx = 1\n```\n", "Lead")
+    assert extract_and_save_code(work_dir, message, "Dev") == ["src/a.py"]
+    assert (tmp_path / "src" / "a.py").read_text() == "x = 2"
+    assert pop_edit_errors(work_dir, "Dev") == []
+
+def test_identical_edit_after_revert_is_applied_again(tmp_path):
+    work_dir = str(tmp_path)
+    original = "#### src/a.py\n```python\nx = 1\n```\n"
+    message = _edit_message("src/a.py", SR_EDIT)
+    for _ in range(2):
+        extract_and_save_code(work_dir, original, "Lead")
+        assert extract_and_save_code(work_dir, message, "Dev") == ["src/a.py"]
+    assert get_workspace_state(work_dir).edits_applied == 2
+
+def test_streamed_edit_is_not_applied_twice_by_hook(tmp_path):
+    work_dir = str(tmp_path)
+    extract_and_save_code(work_dir, "#### src/a.py\n```python\ncount = 0\n```\n", "Lead")
+    message = _edit_message("src/a.py", "@@ -1,1 +1,2 @@\n count = 0\n+count += 1")
+
+    sink = StreamSink(work_dir, echo=False)
+    stream = sink.open("Dev")
+    for i in range(0, len(message), 7):
+        stream.feed(message[i:i + 7])
+    stream.close()
+
+    extract_and_save_code(work_dir, message, "Dev", skip_blocks=sink.take_handled("Dev"))
+    assert (tmp_path / "src" / "a.py").read_text() == "count = 0\ncount += 1"
+    assert pop_edit_errors(work_dir, "Dev") == []
+    assert sink.take_handled("Dev") == set()
+
+def test_released_workspace_state_is_evicted(tmp_path):
+    work_dir = str(tmp_path)
+    extract_and_save_code(work_dir, "#### a.py\n```python\nx = 1\n```\n", "Dev")
+    state = get_workspace_state(work_dir)
+    assert state.writes == 1
+
+    release_workspace_state(work_dir)
+    assert state.work_dir not in tools._workspace_states
+    release_workspace_state(work_dir)  # 重复释放无副作用
+    assert get_workspace_state(work_dir) is not state
+    assert get_workspace_state(work_dir).writes == 0
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 配置校验：畸形的配置段 (类型错误、触发规则缺字段) 报告为错误列表 / ConfigError，而不是抛出 AttributeError。
+
+import json
+
+import pytest
+
+from ai_core.config_service import ConfigError, ConfigService, validate_company, validate_secrets
+
+MODELS = {"qwen_max": {"model": "qwen-max"}, "qwen_turbo": {"model": "qwen-turbo"}}
+ROLES = [{"name": "ProductManager"}, {"name": "FullStackDev"}]
+
+def _secrets(**sections):
+    return {"models": MODELS, **sections}
+
+def _company(rules=None, **process):
+    if rules is not None:
+        process.update(speaker_selection_method="rules", speaker_rules=rules)
+    return {"roles": ROLES, "process": process}
+
+def test_valid_configs_have_no_errors():
+    assert validate_secrets(_secrets(routing={"fallbacks": {"qwen_max": ["qwen_turbo"]}})) == []
+    rules = {"start": "ProductManager", "transitions": {
+        "FullStackDev": {"next": ["ProductManager"], "triggers": [{"pattern": "需求", "next": "ProductManager"}]},
+    }}
+    assert validate_company(_company(rules), {"qwen_max"}) == []
+
+@pytest.mark.parametrize("section, value, message", [
+    ("routing", [], "routing must be an object"),
+    ("routing", {"fallbacks": ["qwen_turbo"]}, "routing.fallbacks must be an object"),
+    ("role_mapping", ["a"], "role_mapping must be an object"),
+    ("budget_control", 5, "budget_control must be an object"),
+    ("model_selection", {"downgrade": "qwen_turbo"}, "model_selection.downgrade must be an object"),
+    ("rate_limits", "60rpm", "rate_limits must be an object"),
+])
+def test_secrets_sections_with_wrong_type_are_reported(section, value, message):
+    assert validate_secrets(_secrets(**{section: value})) == [message]
+
+def test_unhashable_alias_is_reported_as_unknown():
+    errors = validate_secrets(_secrets(role_mapping={"Dev": ["qwen_max"]}, default_model={"a": 1}))
+    assert len(errors) == 2
+    assert all("not defined in models" in e or "unknown model alias" in e for e in errors)
+
+@pytest.mark.parametrize("config, message", [
+    ({"roles": ROLES, "process": []}, "process must be an object"),
+    (_company(speaker_selection_method="rules", speaker_rules=[]), "process.speaker_rules must be an object"),
+    (_company({"transitions": ["FullStackDev"]}), "speaker_rules.transitions must be an object"),
+    (_company({"transitions": {"FullStackDev": "ProductManager"}}),
+     "speaker_rules.transitions.FullStackDev must be an object"),
+    (_company({"transitions": {"FullStackDev": {"next": "ProductManager"}}}),
+     "speaker_rules.transitions.FullStackDev.next must be a list of role names"),
+    (_company({"transitions": {"FullStackDev": {"triggers": {"pattern": "x"}}}}),
+     "speaker_rules.transitions.FullStackDev.triggers must be a list"),
+    (_company({"transitions": {"FullStackDev": {"triggers": ["x"]}}}),
+     "speaker_rules.transitions.FullStackDev.triggers[0] must be an object"),
+    (_company(context_compaction=True), "process.context_compaction must be an object"),
+])
+def test_company_sections_with_wrong_type_are_reported(config, message):
+    assert validate_company(config) == [message]
+
+def test_trigger_without_next_is_a_missing_field():
+    rules = {"transitions": {"FullStackDev": {"triggers": [{"pattern": "需求"}]}}}
+    assert validate_company(_company(rules)) == [
+        "speaker_rules.transitions.FullStackDev.triggers[0] is missing required field(s): next"
+    ]
+
+def test_trigger_routing_to_unknown_role_and_bad_pattern():
+    rules = {"transitions": {"FullStackDev": {"triggers": [{"pattern": "(", "next": "Nobody"}]}}}
+    errors = validate_company(_company(rules))
+    assert len(errors) == 2
+    assert errors[0].startswith("speaker_rules.transitions.FullStackDev has invalid pattern '('")
+    assert errors[1] == "speaker_rules.transitions.FullStackDev routes to unknown role 'Nobody'"
+
+def test_service_raises_config_error_for_malformed_files(tmp_path, monkeypatch):
+    secrets = tmp_path / "config.json"
+    secrets.write_text(json.dumps(_secrets(routing=[])), encoding="utf-8")
+    company = tmp_path / "company.json"
+    company.write_text(json.dumps({"roles": ROLES, "process": {"speaker_selection_method": "rules",
+                                                               "speaker_rules": {"transitions": []}}}),
+                       encoding="utf-8")
+    monkeypatch.setenv("CYBER_SECRETS_PATH", str(secrets))
+    service = ConfigService()
+
+    with pytest.raises(ConfigError, match="routing must be an object"):
+        service.secrets()
+
+    secrets.write_text(json.dumps(_secrets()), encoding="utf-8")
+    with pytest.raises(ConfigError, match="speaker_rules.transitions must be an object"):
+        service.company(str(company))
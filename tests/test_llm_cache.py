@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 模型响应缓存：缓存键规范化、命中/未命中统计、按条目数和字节数的 LRU 淘汰，以及同一路径共享实例。
+
+import itertools
+
+import pytest
+
+from ai_core import llm_cache
+from ai_core.llm_cache import ResponseCache, make_cache_key, open_response_cache
+
+BASE_URL = "https://dashscope.example.com/v1"
+
+def _request(content="写一个 todo 应用", **params):
+    return {"model": "qwen-max", "temperature": 0.3, "messages": [{"role": "user", "content": content}], **params}
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """每次读时间都前进一秒，保证访问顺序可区分"""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(llm_cache.time, "time", lambda: float(next(ticks)))
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=3, max_bytes=None)
+    yield cache
+    cache.close()
+
+def test_key_ignores_whitespace_and_irrelevant_message_fields():
+    request = _request()
+    noisy = _request("  写一个 todo 应用\n")
+    noisy["messages"][0]["metadata"] = {"ts": 1}
+    assert make_cache_key(BASE_URL, request) == make_cache_key(BASE_URL, noisy)
+
+@pytest.mark.parametrize("changed", [
+    _request("写一个博客"),
+    _request(temperature=0.7),
+    _request(model="qwen-turbo"),
+    _request(tools=[{"type": "function", "function": {"name": "read_file"}}]),
+])
+def test_key_changes_with_request(changed):
+    assert make_cache_key(BASE_URL, _request()) != make_cache_key(BASE_URL, changed)
+
+def test_key_depends_on_endpoint():
+    assert make_cache_key(BASE_URL, _request()) != make_cache_key("http://localhost:8000/v1", _request())
+
+def test_miss_then_hit(cache):
+    key = make_cache_key(BASE_URL, _request())
+    assert cache.get(key) is None
+    cache.set(key, {"id": "c1", "choices": []})
+    assert cache.get(key) == {"id": "c1", "choices": []}
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+def test_entry_limit_evicts_least_recently_used(cache):
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    cache.get("a")  # a 变为最近使用，b 最久未使用
+    cache.set("d", "d")
+
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in ("a", "c", "d")] == ["a", "c", "d"]
+    assert cache.get_stats()["evictions"] == 1
+
+def test_byte_limit_evicts_until_under_limit(tmp_path):
+    value = "x" * 100  # JSON 序列化后 102 字节
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=None, max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.set(key, value)
+    assert cache.get("a") is None
+    assert cache.get("b") == value and cache.get("c") == value
+    cache.set("d", "x" * 200)
+    assert cache.get_stats()["entries"] == 1
+    assert cache.get("d") == "x" * 200
+    cache.close()
+
+def test_replacing_a_key_does_not_evict(cache):
+    for _ in range(5):
+        cache.set("a", "v")
+    assert cache.get_stats()["evictions"] == 0
+
+def test_entries_survive_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    cache.set("k", {"answer": 42})
+    cache.close()
+    reopened = ResponseCache(path)
+    assert reopened.get("k") == {"answer": 42}
+    reopened.close()
+
+def test_open_response_cache_shares_instance_per_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_caches", {})
+    cfg = {"path": str(tmp_path / "shared.sqlite"), "max_entries": 10, "max_mb": 1}
+    cache = open_response_cache(cfg)
+    assert open_response_cache(dict(cfg)) is cache
+    assert cache.max_entries == 10 and cache.max_bytes == 1024 * 1024
+    cache.close()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 逐轮模型选择的决策顺序 (预算、历史长度、写代码、短消息) 与 create_model_selector 的启用条件。
+
+import pytest
+
+from ai_core.model_selector import ModelSelector, create_model_selector
+
+MODELS = {"qwen_max": {}, "qwen_turbo": {}, "local_llama": {}}
+CFG = {
+    "enabled": True,
+    "downgrade": {"qwen_max": "qwen_turbo"},
+    "local_model": "local_llama",
+    "code_roles": ["WebArchitect"],
+    "pinned_roles": ["ProductManager"],
+    "short_message_chars": 40,
+    "max_history_tokens": 1000,
+    "budget_pressure": 0.3,
+    "local_below": 0.1,
+}
+
+def _selector(agent_name="Reviewer", **overrides):
+    return ModelSelector("qwen_max", "qwen_turbo", "local_llama", agent_name, dict(CFG, **overrides))
+
+def _messages(content):
+    return [{"role": "system", "content": "你是团队成员"}, {"role": "user", "name": "PM", "content": content}]
+
+SHORT = _messages("收到，继续")
+LONG = _messages("请评审上面的方案，" * 20)
+
+@pytest.mark.parametrize("messages, history, remaining, expected", [
+    (LONG, 100, 0.05, ("local_llama", "budget_critical")),
+    (LONG, 100, 0.1, ("local_llama", "budget_critical")),
+    (LONG, 100, 0.2, ("qwen_turbo", "budget_pressure")),
+    (SHORT, 5000, None, ("qwen_max", "long_history")),
+    (_messages("fix the login bug"), 100, None, ("qwen_max", "code_expected")),
+    (_messages("#### src/app.py"), 100, None, ("qwen_max", "code_expected")),
+    (_messages("请实现登录"), 100, None, ("qwen_max", "code_expected")),
+    (SHORT, 100, None, ("qwen_turbo", "short_turn")),
+    (SHORT, 100, 0.9, ("qwen_turbo", "short_turn")),
+    (LONG, 100, None, ("qwen_max", "default")),
+])
+def test_decision_order(messages, history, remaining, expected):
+    assert _selector().choose(messages, history, remaining) == expected
+
+def test_budget_outranks_code_role_and_long_history():
+    selector = _selector("WebArchitect")
+    assert selector.choose(SHORT, 5000, 0.2) == ("qwen_turbo", "budget_pressure")
+    assert selector.choose(SHORT, 100, None) == ("qwen_max", "code_expected")
+
+def test_without_local_model_critical_budget_uses_cheap_model():
+    selector = ModelSelector("qwen_max", "qwen_turbo", None, "Reviewer", CFG)
+    assert selector.choose(LONG, 100, 0.05) == ("qwen_turbo", "budget_pressure")
+    assert selector.candidates() == ["qwen_turbo"]
+
+def test_keywords_match_whole_words_only():
+    # "decode" 不含独立的 code 一词
+    assert _selector().choose(_messages("decode ok"), 100) == ("qwen_turbo", "short_turn")
+
+def test_custom_code_pattern():
+    selector = _selector(code_pattern=r"SQL")
+    assert selector.choose(_messages("写 sql"), 100) == ("qwen_max", "code_expected")
+    assert selector.choose(_messages("fix it"), 100) == ("qwen_turbo", "short_turn")
+
+def test_last_non_system_message_is_used():
+    messages = _messages("请实现登录") + [{"role": "system", "content": "提示"}]
+    assert _selector().choose(messages, 100) == ("qwen_max", "code_expected")
+    multimodal = [{"role": "user", "content": [{"type": "text", "text": "看图"}, {"type": "image_url"}]}]
+    assert _selector().choose(multimodal, 100) == ("qwen_turbo", "short_turn")
+    assert _selector().choose([], 0) == ("qwen_turbo", "short_turn")
+
+def test_create_selector_from_config():
+    selector = create_model_selector({"models": MODELS, "model_selection": CFG}, "qwen_max", "Reviewer")
+    assert isinstance(selector, ModelSelector)
+    assert selector.candidates() == ["qwen_turbo", "local_llama"]
+
+@pytest.mark.parametrize("cfg, alias, agent", [
+    (dict(CFG, enabled=False), "qwen_max", "Reviewer"),
+    (CFG, "qwen_max", "ProductManager"),
+    (CFG, "qwen_turbo", "Reviewer"),
+    (dict(CFG, downgrade={"qwen_max": "missing"}), "qwen_max", "Reviewer"),
+    (dict(CFG, downgrade={"qwen_max": "qwen_max"}), "qwen_max", "Reviewer"),
+])
+def test_selector_disabled(cfg, alias, agent):
+    assert create_model_selector({"models": MODELS, "model_selection": cfg}, alias, agent) is None
+
+def test_unknown_local_model_is_dropped():
+    cfg = dict(CFG, local_model="missing")
+    selector = create_model_selector({"models": MODELS, "model_selection": cfg}, "qwen_max", "Reviewer")
+    assert selector.local_alias is None
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 令牌桶补充与等待时间、等待者按到达顺序放行 (大请求不被后来的小请求插队)、429 暂停与用量修正，以及进程池的速率份额。
+
+import threading
+import time
+
+import pytest
+
+from ai_core import rate_limiter
+from ai_core.rate_limiter import RateLimiter, TokenBucket, get_rate_limiter, set_rate_share
+
+@pytest.fixture(autouse=True)
+def fresh_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(rate_limiter, "_rate_share", 1.0)
+
+def test_bucket_refills_at_per_minute_rate_up_to_capacity():
+    bucket = TokenBucket(600)  # 每秒 10 个
+    bucket.tokens = 0
+    bucket.refill(bucket.updated + 0.5)
+    assert bucket.tokens == pytest.approx(5)
+    bucket.refill(bucket.updated + 3600)
+    assert bucket.tokens == 600
+
+def test_bucket_wait_time_caps_amount_at_capacity():
+    bucket = TokenBucket(600)
+    assert bucket.wait_time(600) == 0.0
+    bucket.tokens = 100
+    assert bucket.wait_time(200) == pytest.approx(10)
+    # 超过容量的请求按容量计算，否则永远等不到
+    assert bucket.wait_time(10_000) == pytest.approx(50)
+
+def _start_in_order(limiter, amounts, order):
+    """依次启动等待者，上一个拿到 ticket 之后才启动下一个"""
+    lock = threading.Lock()
+
+    def worker(i, tokens):
+        limiter.acquire(tokens)
+        with lock:
+            order.append(i)
+
+    threads = []
+    for i, tokens in enumerate(amounts):
+        ticket = limiter._next_ticket
+        t = threading.Thread(target=worker, args=(i, tokens))
+        t.start()
+        threads.append(t)
+        while limiter._next_ticket == ticket:
+            time.sleep(0.001)
+    return threads
+
+def test_waiters_are_served_in_arrival_order():
+    limiter = RateLimiter("m", rpm=1200)  # 每 50ms 一个请求
+    limiter.requests.tokens = 0
+    order = []
+    for t in _start_in_order(limiter, [0] * 5, order):
+        t.join(timeout=5)
+    assert order == [0, 1, 2, 3, 4]
+    stats = limiter.get_stats()
+    assert stats["calls"] == 5 and stats["waited_calls"] == 5
+
+def test_small_request_does_not_overtake_large_one():
+    limiter = RateLimiter("m", tpm=60_000)  # 每秒 1000 token
+    limiter.token_bucket.tokens = 50
+    order = []
+    threads = _start_in_order(limiter, [300, 10], order)
+    for t in threads:
+        t.join(timeout=5)
+    # 桶里的 50 个令牌足够小请求，但它排在大请求之后
+    assert order == [0, 1]
+
+def test_pause_blocks_until_deadline():
+    limiter = RateLimiter("m", rpm=600)
+    limiter.pause(0.2)
+    assert limiter.acquire() >= 0.19
+
+def test_reconcile_overdraws_and_caps_at_capacity():
+    limiter = RateLimiter("m", tpm=1000)
+    limiter.acquire(100)
+    limiter.reconcile(100, 1500)
+    assert limiter.token_bucket.tokens == pytest.approx(-500, abs=1)
+    limiter.reconcile(1500, 0)
+    assert limiter.token_bucket.tokens == 1000
+
+def test_limiter_is_shared_and_looked_up_by_alias_then_base_url():
+    secrets = {"rate_limits": {"qwen_max": {"rpm": 60}, "http://local/v1": {"tpm": 1000}}}
+    limiter = get_rate_limiter(secrets, "qwen_max", "http://local/v1")
+    assert limiter.key == "qwen_max"
+    assert get_rate_limiter(secrets, "qwen_max") is limiter
+    assert get_rate_limiter(secrets, "local", "http://local/v1").key == "http://local/v1"
+    assert get_rate_limiter(secrets, "other", "http://other/v1") is None
+
+def test_rate_share_scales_configured_limits():
+    set_rate_share(0.25)
+    limiter = get_rate_limiter({"rate_limits": {"qwen_max": {"rpm": 100, "tpm": 40_000}}}, "qwen_max")
+    assert limiter.requests.capacity == 25
+    assert limiter.token_bucket.capacity == 10_000
+
+@pytest.mark.parametrize("share, expected", [(0, 0.01), (-1, 0.01), (0.5, 0.5), (4, 1.0)])
+def test_rate_share_is_clamped(share, expected):
+    set_rate_share(share)
+    assert rate_limiter._rate_share == expected
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: 会话录制/回放的往返：按请求键匹配、请求变化时按 Agent 顺序退回、发言顺序，以及用回放重跑 extract_and_save_code 得到相同的工作区。
+
+import json
+import os
+
+import pytest
+
+from ai_core import session_archive
+from ai_core.llm_cache import make_cache_key
+from ai_core.session_archive import (
+    ReplayExhaustedError, SessionRecorder, SessionReplayer, finish_session_archive, get_session_archive,
+    start_recording, start_replay,
+)
+from ai_core.tools import extract_and_save_code
+
+BASE_URL = "https://dashscope.example.com/v1"
+
+@pytest.fixture(autouse=True)
+def no_global_archive(monkeypatch):
+    monkeypatch.setattr(session_archive, "_archive", None)
+
+def _request(content, model="qwen-max"):
+    return {"model": model, "messages": [{"role": "user", "content": content}]}
+
+def _response(content):
+    """ChatCompletion.model_dump() 的最小形式"""
+    return {"id": "c", "model": "qwen-max", "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+def _record(path, calls, speakers=()):
+    recorder = SessionRecorder(path, project="demo")
+    for agent, prompt, reply in calls:
+        request = _request(prompt)
+        recorder.record_call(agent, "qwen_max", make_cache_key(BASE_URL, request), request, _response(reply), 0.5)
+    for name in speakers:
+        recorder.record_speaker(name)
+    recorder.close()
+
+def test_round_trip_returns_recorded_responses(tmp_path):
+    path = tmp_path / "session.jsonl"
+    _record(path, [("PM", "需求", "PRD"), ("Dev", "实现", "代码")], speakers=["PM", "Dev"])
+
+    replayer = SessionReplayer(path)
+    assert replayer.meta["project"] == "demo" and replayer.meta["version"] == session_archive.ARCHIVE_VERSION
+    call = replayer.next_call("Dev", make_cache_key(BASE_URL, _request("实现")))
+    assert call["response"] == _response("代码") and call["cached"] is False
+    assert replayer.next_call("PM", make_cache_key(BASE_URL, _request("需求")))["response"] == _response("PRD")
+    assert [replayer.next_speaker(), replayer.next_speaker(), replayer.next_speaker()] == ["PM", "Dev", None]
+    assert replayer.get_stats() == {
+        "mode": "replay", "path": str(path), "calls": 2, "recorded_calls": 2, "mismatches": 0, "speakers": 2,
+    }
+
+def test_repeated_request_replays_in_recorded_order(tmp_path):
+    path = tmp_path / "session.jsonl"
+    _record(path, [("Dev", "继续", "第一次"), ("Dev", "继续", "第二次")])
+    replayer = SessionReplayer(path)
+    key = make_cache_key(BASE_URL, _request("继续"))
+    assert replayer.next_call("Dev", key)["response"] == _response("第一次")
+    assert replayer.next_call("Dev", key)["response"] == _response("第二次")
+
+def test_changed_request_falls_back_to_agents_next_call(tmp_path):
+    path = tmp_path / "session.jsonl"
+    _record(path, [("PM", "需求", "PRD"), ("Dev", "实现", "代码 v1"), ("Dev", "修复", "代码 v2")])
+    replayer = SessionReplayer(path)
+    changed = make_cache_key(BASE_URL, _request("实现 (提示词已修改)"))
+    assert replayer.next_call("Dev", changed)["response"] == _response("代码 v1")
+    # 已按 Agent 顺序消费的记录不会再按请求键命中
+    assert replayer.next_call("Dev", make_cache_key(BASE_URL, _request("实现")))["response"] == _response("代码 v2")
+    assert replayer.mismatches == 2
+
+def test_replay_past_the_recording_raises(tmp_path):
+    path = tmp_path / "session.jsonl"
+    _record(path, [("PM", "需求", "PRD")])
+    replayer = SessionReplayer(path)
+    replayer.next_call("PM", "other-key")
+    with pytest.raises(ReplayExhaustedError, match="1/1 replayed"):
+        replayer.next_call("PM", "other-key")
+
+def test_recording_is_readable_before_close(tmp_path):
+    path = tmp_path / "session.jsonl"
+    recorder = SessionRecorder(path)
+    recorder.record_call("PM", "qwen_max", "k", _request("需求"), _response("PRD"), cached=True)
+    # 进程中断时：每行写入后已 flush
+    assert SessionReplayer(path).next_call("PM", "k")["cached"] is True
+    recorder.close()
+
+def test_process_archive_lifecycle(tmp_path):
+    path = tmp_path / "session.jsonl"
+    recorder = start_recording(path, task="todo")
+    assert get_session_archive() is recorder and not recorder.replaying
+    recorder.record_speaker("PM")
+    assert finish_session_archive() == {"mode": "record", "path": str(path), "calls": 0, "speakers": 1}
+    assert get_session_archive() is None
+
+    replayer = start_replay(path)
+    assert get_session_archive() is replayer and replayer.replaying
+    assert finish_session_archive()["speakers"] == 0
+    assert finish_session_archive() is None
+
+# ---- 回归用例：录制一次会话，回放时重跑代码提取，工作区应完全一致 ----
+
+TURNS = [
+    ("Architect", "设计", "#### src/app.py\n```python\ndef main():\n    return 1\n```\n"
+                          "#### README.md\n```markdown\n# Demo\n```\n"),
+    ("Dev", "实现", "#### src/app.py\n```python\n<<<<<<< SEARCH\n    return 1\n=======\n    return 2\n>>>>>>> REPLACE\n```\n"),
+    ("Dev", "测试", "#### tests/test_app.py\n```python\nfrom src.app import main\n\nassert main() == 2\n```\n"),
+]
+
+def _run_session(archive, work_dir, model_reply=None):
+    """最小的对话驱动：录制时调用 model_reply，回放时取录制的响应；回复都经过 extract_and_save_code"""
+    for agent, prompt, _ in TURNS:
+        request = _request(prompt)
+        key = make_cache_key(BASE_URL, request)
+        if archive.replaying:
+            response = archive.next_call(agent, key)["response"]
+        else:
+            response = _response(model_reply(agent, prompt))
+            archive.record_call(agent, "qwen_max", key, request, response)
+        extract_and_save_code(work_dir, response["choices"][0]["message"]["content"], agent)
+
+def _tree(root):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, encoding="utf-8") as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+def test_replay_reproduces_extracted_workspace(tmp_path):
+    replies = {(agent, prompt): reply for agent, prompt, reply in TURNS}
+    path = tmp_path / "session.jsonl"
+    recorded_dir = tmp_path / "recorded"
+    recorded_dir.mkdir()
+    recorder = SessionRecorder(path)
+    _run_session(recorder, str(recorded_dir), lambda agent, prompt: replies[(agent, prompt)])
+    recorder.close()
+
+    replayed_dir = tmp_path / "replayed"
+    replayed_dir.mkdir()
+    replayer = SessionReplayer(path)
+    _run_session(replayer, str(replayed_dir))
+
+    expected = _tree(recorded_dir)
+    assert expected[os.path.join("src", "app.py")] == "def main():\n    return 2"
+    assert _tree(replayed_dir) == expected
+    assert replayer.get_stats()["mismatches"] == 0
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)["type"] for line in f] == ["session", "call", "call", "call"]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: RuleBasedSpeakerSelector 的转移规则：start、正则触发、角色/全局 fallback、未知角色与工具调用。
+
+import json
+import os
+
+import pytest
+
+from ai_core.config_service import ROOT_DIR, validate_company
+from ai_core.speaker_selector import LLMSpeakerSelector, RuleBasedSpeakerSelector, create_speaker_selector
+from ai_core.token_tracker import TokenTracker
+
+class FakeAgent:
+    def __init__(self, name):
+        self.name = name
+        self.description = f"{name} role"
+
+class FakeGroupChat:
+    """只实现选择器用到的 GroupChat 接口"""
+
+    def __init__(self, names):
+        self.agents = [FakeAgent(n) for n in names]
+        self.messages = []
+
+    def agent(self, name):
+        return next(a for a in self.agents if a.name == name)
+
+    def say(self, name, content="", **fields):
+        self.messages.append({"role": "user", "name": name, "content": content, **fields})
+        return self.agent(name)
+
+    def select_speaker_msg(self, agents):
+        return "roles: " + ", ".join(a.name for a in agents)
+
+    def select_speaker_prompt(self, agents):
+        return "Select the next role."
+
+    def next_agent(self, agent, agents):
+        return agents[(agents.index(agent) + 1) % len(agents)]
+
+class FakeClient:
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+
+    def create(self, request):
+        self.requests.append(request)
+        return self.reply
+
+    def message_retrieval(self, response):
+        return [response]
+
+RULES = {
+    "start": "ProductManager",
+    "transitions": {
+        "ProductManager": {"next": ["ChiefArchitect"]},
+        "ChiefArchitect": {"next": ["FullStackDev", "ProductManager"]},
+        "FullStackDev": {
+            "next": ["ChiefArchitect", "ProductManager"],
+            "triggers": [
+                {"pattern": "需求不明确|clarify requirement", "next": "ProductManager"},
+                {"pattern": "security review", "next": "SecurityAuditor"},
+            ],
+            "fallback": "ChiefArchitect",
+        },
+    },
+    "fallback": "auto",
+}
+TEAM = ["UserProxy", "ProductManager", "ChiefArchitect", "FullStackDev"]
+
+@pytest.fixture
+def chat():
+    return FakeGroupChat(TEAM)
+
+@pytest.fixture
+def tracker(tmp_path):
+    return TokenTracker("t", log_dir=str(tmp_path))
+
+def test_speaker_without_rule_hands_over_to_start(chat, tracker):
+    selector = RuleBasedSpeakerSelector(RULES, tracker=tracker)
+    speaker = chat.say("UserProxy", "Build a todo app")
+    assert selector(speaker, chat) is chat.agent("ProductManager")
+    assert tracker.speaker_rule_selections == 1
+    assert tracker.speaker_tokens_avoided > 0
+
+def test_single_next_candidate_is_selected(chat):
+    speaker = chat.say("ProductManager", "PRD done")
+    assert RuleBasedSpeakerSelector(RULES)(speaker, chat) is chat.agent("ChiefArchitect")
+
+def test_regex_trigger_matches_case_insensitively(chat):
+    speaker = chat.say("FullStackDev", "Need to CLARIFY REQUIREMENT about login")
+    assert RuleBasedSpeakerSelector(RULES)(speaker, chat) is chat.agent("ProductManager")
+
+def test_trigger_to_role_missing_from_chat_falls_through(chat):
+    speaker = chat.say("FullStackDev", "ready for security review")
+    assert RuleBasedSpeakerSelector(RULES)(speaker, chat) is chat.agent("ChiefArchitect")
+
+def test_role_fallback_when_several_candidates(chat):
+    speaker = chat.say("FullStackDev", "implemented the API")
+    assert RuleBasedSpeakerSelector(RULES)(speaker, chat) is chat.agent("ChiefArchitect")
+
+def test_global_auto_fallback_without_llm_selector(chat, tracker):
+    speaker = chat.say("ChiefArchitect", "design ready")
+    assert RuleBasedSpeakerSelector(RULES, tracker=tracker)(speaker, chat) == "auto"
+    assert tracker.speaker_llm_selections == 1
+    assert tracker.speaker_rule_selections == 0
+
+def test_global_auto_fallback_uses_llm_selector(chat, tracker):
+    client = FakeClient("FullStackDev")
+    selector = RuleBasedSpeakerSelector(RULES, tracker=tracker, llm_selector=LLMSpeakerSelector(client))
+    speaker = chat.say("ChiefArchitect", "design ready")
+    assert selector(speaker, chat) is chat.agent("FullStackDev")
+    assert len(client.requests) == 1
+    assert tracker.speaker_llm_selections == 1
+
+def test_global_fallback_builtin_method(chat):
+    selector = RuleBasedSpeakerSelector(dict(RULES, fallback="round_robin"))
+    assert selector(chat.say("ChiefArchitect", "design ready"), chat) == "round_robin"
+
+def test_global_fallback_role(chat):
+    selector = RuleBasedSpeakerSelector(dict(RULES, fallback="ProductManager"))
+    assert selector(chat.say("ChiefArchitect", "design ready"), chat) is chat.agent("ProductManager")
+
+def test_unknown_roles_are_ignored(chat):
+    rules = {
+        "start": "Designer",
+        "transitions": {"ProductManager": {"next": ["Designer", "ChiefArchitect"]}},
+        "fallback": "Nobody",
+    }
+    selector = RuleBasedSpeakerSelector(rules)
+    # start 指向不存在的角色：交给全局 fallback，全局 fallback 也不存在时回到 auto
+    assert selector(chat.say("UserProxy", "task"), chat) == "auto"
+    # 不存在的候选被过滤，只剩一个候选
+    assert selector(chat.say("ProductManager", "PRD"), chat) is chat.agent("ChiefArchitect")
+
+def test_tool_call_goes_to_framework_and_result_returns_to_caller(chat):
+    selector = RuleBasedSpeakerSelector(RULES)
+    speaker = chat.say("FullStackDev", None, tool_calls=[{"id": "1", "function": {"name": "read_file"}}])
+    assert selector(speaker, chat) == "auto"
+    speaker = chat.say("UserProxy", "file content", role="tool", tool_responses=[{"tool_call_id": "1"}])
+    assert selector(speaker, chat) is chat.agent("FullStackDev")
+
+def test_llm_selector_falls_back_to_next_agent_on_ambiguous_reply(chat):
+    client = FakeClient("ChiefArchitect or FullStackDev")
+    speaker = chat.say("ProductManager", "PRD done")
+    assert LLMSpeakerSelector(client)(speaker, chat) is chat.agent("ChiefArchitect")
+    request = client.requests[0]["messages"]
+    assert request[0]["content"].startswith("roles:") and request[-1]["role"] == "system"
+
+def test_shipped_company_rules_are_valid_and_default_stays_auto():
+    with open(os.path.join(ROOT_DIR, "companies", "startup.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    process = config["process"]
+    assert process["speaker_selection_method"] == "auto"
+    assert create_speaker_selector(process) == "auto"
+    enabled = dict(config, process=dict(process, speaker_selection_method="rules"))
+    assert validate_company(enabled) == []
+    assert isinstance(create_speaker_selector(enabled["process"]), RuleBasedSpeakerSelector)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# 版本: v1.0
+# 作者: wei-Aug2024
+# 邮箱: wei_qiao@tigerte.com
+# 日期: 2026-10-18
+# 总结: TokenTracker 在多线程并发记账 (对冲落败回调 + 对话线程) 时不丢失用量与成本。
+
+import sys
+import threading
+
+import pytest
+
+from ai_core.token_tracker import BudgetExceededError, TokenTracker
+
+@pytest.fixture
+def frequent_switches():
+    """让线程频繁切换，未加锁的读-改-写更容易交错"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+def test_concurrent_tracking_keeps_every_call(tmp_path, frequent_switches):
+    tracker = TokenTracker("t", log_dir=str(tmp_path))
+    threads, calls = 8, 2000
+
+    def worker(i):
+        for _ in range(calls):
+            tracker.track_call("qwen-max", 1000, 500, agent=f"A{i}", endpoint="qwen_max", latency=0.01)
+            tracker.track_route("qwen_max", 0.01, hedged=True)
+            tracker.export_state()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    total = threads * calls
+    assert tracker.usage["qwen-max"]["calls"] == total
+    assert tracker.usage["qwen-max"]["input"] == total * 1000
+    assert tracker.routes["qwen_max"]["calls"] == total
+    expected = total * tracker._calculate_cost("qwen-max", 1000, 500)
+    assert tracker.total_cost == pytest.approx(expected)
+
+def test_preflight_sees_costs_recorded_by_other_threads(tmp_path):
+    tracker = TokenTracker("t", budget_limit=0.001, hard_limit=True, log_dir=str(tmp_path))
+    recorder = threading.Thread(target=tracker.track_call, args=("qwen-max", 10_000, 10_000))
+    recorder.start()
+    recorder.join()
+    with pytest.raises(BudgetExceededError):
+        tracker.preflight("qwen-max", 100)
+    assert tracker.blocked_calls == 1